@@ -1,9 +1,20 @@
+from datetime import timedelta
+from functools import wraps
+
+from django.http import FileResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.contrib import messages, auth
 from django.contrib.auth.models import User
 from django.db.models import Q
-from django.core.paginator import Paginator
+from django.db.models.functions import Substr
+from . import bulk, profiling, rollups
+from .pagination import paginate
+from .roles import get_role
 from .models import Order, DeliveryBoy, Delivery
 from .forms import UserProfileForm, DeliveryBoyForm, DeliveryBoyEditForm
 
@@ -13,16 +24,30 @@ def is_admin(user):
     return user.is_authenticated and hasattr(user, "profile") and user.profile.is_admin
 
 
+def admin_required(view_func):
+    """Like user_passes_test(is_admin), using the role cached in the session"""
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if get_role(request) == "admin":
+            return view_func(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path())
+
+    return wrapper
+
+
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_dashboard(request):
     """Admin dashboard with statistics"""
-    # Get statistics
+    # Statistics are evaluated by the template, only when its cached fragment expires.
+    # Order figures come from the daily rollups, so they include archived orders.
+    totals = SimpleLazyObject(rollups.order_totals)
     stats = {
-        "total_orders": Order.objects.count(),
-        "delivered_orders": Order.objects.filter(status="delivered").count(),
-        "total_users": User.objects.filter(profile__role="customer").count(),
-        "total_delivery_boys": DeliveryBoy.objects.count(),
+        "total_orders": lambda: totals["total"],
+        "delivered_orders": lambda: totals["delivered"],
+        "total_users": User.objects.filter(profile__role="customer").count,
+        "total_delivery_boys": DeliveryBoy.objects.count,
     }
 
     # Get recent orders
@@ -32,17 +57,25 @@ def admin_dashboard(request):
 
     context = {
         "stats": stats,
+        "chart": SimpleLazyObject(order_chart),
         "recent_orders": recent_orders,
     }
 
     return render(request, "admin/dashboard.html", context)
 
 
+def order_chart(days=14):
+    """Daily orders and deliveries of the last ``days`` days for the dashboard chart"""
+    today = timezone.localdate()
+    report = rollups.daily_report(today - timedelta(days=days - 1), today)
+    return {"days": report, "max_orders": max([day["orders"] for day in report] + [1])}
+
+
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_users(request):
     """List all users with filtering"""
-    users = User.objects.select_related("profile").all()
+    users = User.objects.select_related("profile").defer("password", "profile__address")
 
     # Filter by role
     role_filter = request.GET.get("role")
@@ -60,12 +93,11 @@ def admin_users(request):
         )
 
     # Pagination
-    paginator = Paginator(users, 20)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj, filter_query = paginate(request, users, ("-id",))
 
     context = {
         "page_obj": page_obj,
+        "filter_query": filter_query,
         "role_filter": role_filter,
         "search_query": search_query,
     }
@@ -74,7 +106,7 @@ def admin_users(request):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_users_create(request):
     """Create new user"""
     if request.method == "POST":
@@ -92,7 +124,7 @@ def admin_users_create(request):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_users_edit(request, user_id):
     """Edit existing user"""
     user = get_object_or_404(User, id=user_id)
@@ -114,7 +146,7 @@ def admin_users_edit(request, user_id):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_users_delete(request, user_id):
     """Delete user"""
     user = get_object_or_404(User, id=user_id)
@@ -134,10 +166,11 @@ def admin_users_delete(request, user_id):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_delivery_boys(request):
     """List all delivery boys"""
-    delivery_boys = DeliveryBoy.objects.select_related("user").all()
+    # The list shows user.profile.phone, so the profile is joined too instead of loaded per row
+    delivery_boys = DeliveryBoy.objects.select_related("user", "user__profile").defer("user__password")
 
     # Search
     search_query = request.GET.get("search", "")
@@ -154,12 +187,11 @@ def admin_delivery_boys(request):
         delivery_boys = delivery_boys.filter(is_available=availability_filter == "true")
 
     # Pagination
-    paginator = Paginator(delivery_boys, 20)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj, filter_query = paginate(request, delivery_boys, ("-id",))
 
     context = {
         "page_obj": page_obj,
+        "filter_query": filter_query,
         "search_query": search_query,
         "availability_filter": availability_filter,
     }
@@ -168,7 +200,7 @@ def admin_delivery_boys(request):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_delivery_boys_create(request):
     """Create new delivery boy"""
     if request.method == "POST":
@@ -191,7 +223,7 @@ def admin_delivery_boys_create(request):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_delivery_boys_edit(request, delivery_boy_id):
     """Edit existing delivery boy"""
     delivery_boy = get_object_or_404(DeliveryBoy, id=delivery_boy_id)
@@ -224,7 +256,7 @@ def admin_delivery_boys_edit(request, delivery_boy_id):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_delivery_boys_delete(request, delivery_boy_id):
     """Delete delivery boy"""
     delivery_boy = get_object_or_404(DeliveryBoy, id=delivery_boy_id)
@@ -243,10 +275,15 @@ def admin_delivery_boys_delete(request, delivery_boy_id):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_orders(request):
     """List all orders"""
-    orders = Order.objects.select_related("customer").all()
+    # The list only shows the start of the address, so the full text is never loaded
+    orders = (
+        Order.objects.select_related("customer")
+        .defer("receiver_address", "updated_at", "customer__password", "customer__last_login")
+        .annotate(receiver_address_preview=Substr("receiver_address", 1, 40))
+    )
 
     # Filter by status
     status_filter = request.GET.get("status")
@@ -263,12 +300,11 @@ def admin_orders(request):
         )
 
     # Pagination
-    paginator = Paginator(orders.order_by("-created_at"), 20)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj, filter_query = paginate(request, orders, ("-created_at", "-id"))
 
     context = {
         "page_obj": page_obj,
+        "filter_query": filter_query,
         "status_filter": status_filter,
         "search_query": search_query,
     }
@@ -277,12 +313,15 @@ def admin_orders(request):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_deliveries(request):
     """List all deliveries"""
     deliveries = Delivery.objects.select_related(
         "order__customer", "delivery_boy__user"
-    ).all()
+    ).defer(
+        "notes", "customer_feedback", "order__receiver_address",
+        "order__customer__password", "delivery_boy__user__password",
+    )
 
     # Filter by status
     status_filter = request.GET.get("status")
@@ -298,12 +337,11 @@ def admin_deliveries(request):
         )
 
     # Pagination
-    paginator = Paginator(deliveries.order_by("-assigned_at"), 20)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj, filter_query = paginate(request, deliveries, ("-assigned_at", "-id"))
 
     context = {
         "page_obj": page_obj,
+        "filter_query": filter_query,
         "status_filter": status_filter,
         "search_query": search_query,
     }
@@ -312,7 +350,7 @@ def admin_deliveries(request):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_assign_delivery(request, order_id):
     """Assign a delivery to a delivery boy"""
     order = get_object_or_404(Order, id=order_id)
@@ -321,20 +359,15 @@ def admin_assign_delivery(request, order_id):
         delivery_boy_id = request.POST.get("delivery_boy")
         delivery_boy = get_object_or_404(DeliveryBoy, id=delivery_boy_id)
 
-        # Check if delivery already exists
-        if hasattr(order, "delivery"):
-            messages.error(request, "This order already has a delivery assigned.")
+        # Locks the order, so two concurrent assignments cannot both create a delivery
+        result = bulk.assign_orders([order.pk], delivery_boy)
+        if not result.updated:
+            if result.skipped.get(order.pk) == "already assigned":
+                messages.error(request, "This order already has a delivery assigned.")
+            else:
+                messages.error(request, f"This order cannot be assigned ({result.skipped.get(order.pk)}).")
             return redirect("admin_orders")
 
-        # Create delivery assignment
-        Delivery.objects.create(
-            order=order, delivery_boy=delivery_boy, status="assigned"
-        )
-
-        # Update order status
-        order.status = "in_transit"
-        order.save()
-
         messages.success(
             request,
             f"Order {order.barcode} assigned to {delivery_boy.user.get_full_name() or delivery_boy.user.username}.",
@@ -342,7 +375,7 @@ def admin_assign_delivery(request, order_id):
         return redirect("admin_deliveries")
 
     # Get available delivery boys
-    available_delivery_boys = DeliveryBoy.objects.filter(is_available=True)
+    available_delivery_boys = DeliveryBoy.objects.filter(is_available=True).select_related("user")
 
     context = {
         "order": order,
@@ -353,7 +386,7 @@ def admin_assign_delivery(request, order_id):
 
 
 @login_required
-@user_passes_test(is_admin)
+@admin_required
 def admin_update_delivery_status(request, delivery_id):
     """Update delivery status"""
     delivery = get_object_or_404(Delivery, id=delivery_id)
@@ -383,12 +416,16 @@ def admin_update_delivery_status(request, delivery_id):
             )
 
         elif new_status == "failed":
-            delivery.status = "failed"
-            delivery.notes = notes
-            delivery.save()
-            messages.warning(
-                request, f"Delivery {delivery.order.barcode} marked as failed."
-            )
+            if delivery.mark_failed(notes=notes):
+                messages.warning(
+                    request, f"Delivery {delivery.order.barcode} marked as failed."
+                )
+            else:
+                messages.error(
+                    request,
+                    f"Delivery {delivery.order.barcode} is {delivery.get_status_display().lower()} "
+                    "and cannot be marked as failed.",
+                )
 
         return redirect("admin_deliveries")
 
@@ -399,6 +436,104 @@ def admin_update_delivery_status(request, delivery_id):
     return render(request, "admin/update_delivery_status.html", context)
 
 
+def redirect_back(request, default):
+    """Redirect to the list the bulk form was posted from, keeping its filters"""
+    next_url = request.POST.get("next")
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect(default)
+
+
+def report_bulk_result(request, result, done):
+    if result.updated:
+        messages.success(request, f"{len(result.updated)} {done}.")
+    if result.skipped:
+        details = ", ".join(f"#{pk} ({reason})" for pk, reason in list(result.skipped.items())[:10])
+        more = f" and {len(result.skipped) - 10} more" if len(result.skipped) > 10 else ""
+        messages.warning(request, f"{len(result.skipped)} skipped: {details}{more}")
+
+
+@login_required
+@admin_required
+def admin_orders_bulk(request):
+    """Assign or cancel the selected orders in one transaction"""
+    if request.method != "POST":
+        return redirect("admin_orders")
+
+    try:
+        order_ids = bulk.parse_ids(request.POST.getlist("order_ids"))
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect_back(request, "admin_orders")
+    if not order_ids:
+        messages.error(request, "Select at least one order.")
+        return redirect_back(request, "admin_orders")
+
+    action = request.POST.get("action")
+    if action == "assign":
+        delivery_boy = DeliveryBoy.objects.select_related("user").filter(
+            id=request.POST.get("delivery_boy") or None
+        ).first()
+        if delivery_boy is None:
+            messages.error(request, "Select a delivery boy to assign the orders to.")
+            return redirect_back(request, "admin_orders")
+        result = bulk.assign_orders(order_ids, delivery_boy, notes=request.POST.get("notes", ""))
+        name = delivery_boy.user.get_full_name() or delivery_boy.user.username
+        report_bulk_result(request, result, f"orders assigned to {name}")
+    elif action == "cancel":
+        report_bulk_result(request, bulk.cancel_orders(order_ids), "orders cancelled")
+    else:
+        messages.error(request, "Unknown bulk action.")
+
+    return redirect_back(request, "admin_orders")
+
+
+@login_required
+@admin_required
+def admin_deliveries_bulk(request):
+    """Mark the selected deliveries picked up, delivered or failed in one transaction"""
+    if request.method != "POST":
+        return redirect("admin_deliveries")
+
+    status = request.POST.get("status")
+    try:
+        delivery_ids = bulk.parse_ids(request.POST.getlist("delivery_ids"))
+        if not delivery_ids:
+            raise ValueError("Select at least one delivery.")
+        result = bulk.update_deliveries(delivery_ids, status, notes=request.POST.get("notes", ""))
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect_back(request, "admin_deliveries")
+
+    report_bulk_result(request, result, f"deliveries marked as {status.replace('_', ' ')}")
+    return redirect_back(request, "admin_deliveries")
+
+
+@login_required
+@admin_required
+def admin_profiles(request):
+    """List recent request profiles"""
+    config = profiling.get_profiling_settings()
+    context = {
+        "profiles": profiling.recent_profiles(),
+        "profile_header": profiling.PROFILE_HEADER,
+        "profile_token": profiling.make_profile_token(request.user),
+        "profile_query_flag": profiling.PROFILE_QUERY_FLAG,
+        "profiling_config": config,
+    }
+    return render(request, "admin/profiles.html", context)
+
+
+@login_required
+@admin_required
+def admin_profile_download(request, name):
+    """Download a stored profile"""
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404("Profile not found")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
+
+
 def admin_logout(request):
     """Custom logout view for admin"""
     auth.logout(request)
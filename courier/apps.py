@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CourierConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courier'
+
+    def ready(self):
+        # Register the outbox task handlers and the scheduled jobs
+        from . import scheduled_jobs, tasks  # noqa: F401
@@ -0,0 +1,84 @@
+"""
+Hot/cold archival of finished orders.
+
+Delivered and cancelled orders that have not changed for ARCHIVE["AFTER_DAYS"]
+days are copied, with their delivery, into ArchivedOrder/ArchivedDelivery and
+removed from the hot tables by ``manage.py archive_orders``. Each batch of
+BATCH_SIZE orders is moved in its own transaction, so an interrupted run
+loses nothing and the next run simply continues with the rows that are
+left. Rows keep their ids; order tracking and customer history read the
+archive when an order is no longer in the hot table.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import order_cache
+from .models import ArchivedDelivery, ArchivedOrder, Delivery, Order
+
+
+DEFAULT_ARCHIVE = {
+    "AFTER_DAYS": 90,
+    "BATCH_SIZE": 1000,
+    "LIST_LIMIT": 100,
+}
+
+TERMINAL_STATUSES = [status for status, targets in Order.STATUS_TRANSITIONS.items() if not targets]
+
+ORDER_FIELDS = [
+    "id", "customer_id", "barcode", "receiver_name", "receiver_address", "amount", "status",
+    "payment_status", "created_at", "updated_at",
+]
+DELIVERY_FIELDS = [
+    "id", "order_id", "delivery_boy_id", "assigned_at", "picked_up_at", "delivered_at", "failed_at", "status",
+    "notes", "rating", "customer_feedback", "updated_at",
+]
+
+
+def get_archive_settings():
+    return {**DEFAULT_ARCHIVE, **getattr(settings, "ARCHIVE", {})}
+
+
+def archivable(cutoff):
+    return Order.objects.filter(status__in=TERMINAL_STATUSES, updated_at__lt=cutoff)
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to ``batch_size`` archivable orders in one transaction; returns how many moved"""
+    with transaction.atomic():
+        orders = list(
+            archivable(cutoff)
+            .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+            .order_by("id")
+            .values(*ORDER_FIELDS)[:batch_size]
+        )
+        if not orders:
+            return 0
+        ids = [order["id"] for order in orders]
+        deliveries = list(Delivery.objects.filter(order_id__in=ids).values(*DELIVERY_FIELDS))
+
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+        ArchivedDelivery.objects.bulk_create([ArchivedDelivery(**delivery) for delivery in deliveries])
+        Order.objects.filter(pk__in=ids).delete()  # Cascades to the deliveries
+        order_cache.invalidate(order["customer_id"] for order in orders)
+    return len(orders)
+
+
+def archive_orders(after_days=None, batch_size=None, max_batches=None):
+    """Archive finished orders batch by batch; returns the number of orders moved"""
+    config = get_archive_settings()
+    after_days = config["AFTER_DAYS"] if after_days is None else after_days
+    batch_size = batch_size or config["BATCH_SIZE"]
+    cutoff = timezone.now() - timedelta(days=after_days)
+
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+    return moved
@@ -0,0 +1,207 @@
+"""
+Negative cache for tracking lookups of unknown barcodes.
+
+Every process keeps a Bloom filter over all order barcodes, hot and archived.
+TrackOrderView asks it first and answers 404 without touching the database
+when a barcode is definitely unknown (mistyped codes, enumeration bots).
+
+The filter is built from the database by the ``rebuild_barcode_filter``
+scheduler job (or the management command of the same name), never by a
+request-serving process: the scan and hashing take seconds per million
+barcodes and would hold the GIL of a web worker. The job publishes the filter
+to the shared cache as a snapshot, which web processes load. Snapshots are
+rebuilt every REBUILD_INTERVAL seconds. Orders created after a snapshot was
+taken are remembered under a short-lived cache key per barcode, so they are
+found by every process until the next snapshot includes them. A snapshot
+older than twice REBUILD_INTERVAL is not trusted and lookups go to the
+database, so a stalled rebuild (or no scheduler at all) can never hide an
+order.
+
+This needs a cache shared by all processes (REDIS_URL) when more than one
+process serves requests, which is why it is off unless Redis is configured.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .models import ArchivedOrder, Order
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BARCODE_FILTER = {
+    "ENABLED": False,
+    "FALSE_POSITIVE_RATE": 0.01,
+    "REBUILD_INTERVAL": 300,
+    "CHECK_INTERVAL": 10,
+    "MIN_CAPACITY": 100000,
+}
+
+SNAPSHOT_KEY = "courier:barcode-filter:snapshot"
+VERSION_KEY = "courier:barcode-filter:version"
+
+
+def get_barcode_filter_settings():
+    return {**DEFAULT_BARCODE_FILTER, **getattr(settings, "BARCODE_FILTER", {})}
+
+
+def stale_after(config):
+    return 2 * config["REBUILD_INTERVAL"]
+
+
+def recent_key(barcode):
+    # Barcodes come from the URL, so they are hashed into a cache-safe key
+    return "courier:barcode-filter:recent:" + hashlib.md5(barcode.encode()).hexdigest()
+
+
+class BloomFilter:
+    """Bit array with ``hashes`` positions per item, derived from one BLAKE2b digest"""
+
+    def __init__(self, size, hashes, bits=None, count=0):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((size + 7) // 8)
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity, false_positive_rate):
+        size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        return cls(size, max(1, round(size / capacity * math.log(2))))
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+    def expected_false_positive_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class ProcessFilter:
+    """This process's filter and the snapshot it was loaded from"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.version = None
+        self.built_at = 0.0
+        self.checked_at = None
+
+    def install(self, snapshot):
+        bloom = BloomFilter(snapshot["size"], snapshot["hashes"], snapshot["bits"], snapshot["count"])
+        with self.lock:
+            previous = self.bloom
+            self.bloom, self.version, self.built_at = bloom, snapshot["version"], snapshot["built_at"]
+        metrics.barcode_filter_bytes.inc(bloom.nbytes - (previous.nbytes if previous else 0))
+        metrics.barcode_filter_items.inc(bloom.count - (previous.count if previous else 0))
+
+    def refresh(self, config):
+        """Load a newer published snapshot, at most every CHECK_INTERVAL seconds"""
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < config["CHECK_INTERVAL"]:
+            return
+        self.checked_at = now
+        version = cache.get(VERSION_KEY)
+        if version is not None and version["version"] != self.version:
+            snapshot = cache.get(SNAPSHOT_KEY)
+            if snapshot is not None and snapshot["version"] == version["version"]:
+                self.install(snapshot)
+
+    def current(self, config):
+        """The filter, or None when there is no snapshot recent enough to trust"""
+        self.refresh(config)
+        if self.bloom is None or time.time() - self.built_at > stale_after(config):
+            return None
+        return self.bloom
+
+
+process_filter = ProcessFilter()
+
+
+def might_exist(barcode):
+    """False only when no order (hot or archived) can have ``barcode``"""
+    return bool(possible_barcodes([barcode]))
+
+
+def possible_barcodes(barcodes):
+    """The ``barcodes`` that may belong to an order, with one cache round trip for the misses"""
+    config = get_barcode_filter_settings()
+    if not config["ENABLED"]:
+        return list(barcodes)
+    bloom = process_filter.current(config)
+    if bloom is None:
+        metrics.barcode_filter_lookups.inc(len(barcodes), result="unavailable")
+        return list(barcodes)
+    misses = {recent_key(barcode): barcode for barcode in barcodes if barcode not in bloom}
+    rejected = set(misses.values())
+    if misses:
+        rejected -= {misses[key] for key in cache.get_many(misses)}
+    possible = [barcode for barcode in barcodes if barcode not in rejected]
+    if possible:
+        metrics.barcode_filter_lookups.inc(len(possible), result="passed")
+    if len(possible) < len(barcodes):
+        metrics.barcode_filter_lookups.inc(len(barcodes) - len(possible), result="rejected")
+    return possible
+
+
+def record_false_positive(count=1):
+    """Count lookups the filter passed although the barcode does not exist"""
+    if count and get_barcode_filter_settings()["ENABLED"] and process_filter.bloom is not None:
+        metrics.barcode_filter_lookups.inc(count, result="false_positive")
+
+
+def remember(barcode):
+    """Make a new order's barcode known to every process before the next snapshot"""
+    config = get_barcode_filter_settings()
+    if not config["ENABLED"]:
+        return
+    # Outlives any snapshot taken before this order committed (snapshots are trusted for stale_after)
+    cache.set(recent_key(barcode), 1, stale_after(config) + config["CHECK_INTERVAL"] + 60)
+    with process_filter.lock:
+        if process_filter.bloom is not None:
+            process_filter.bloom.add(barcode)
+
+
+def rebuild(config=None):
+    """Build a filter over every barcode, publish it as the shared snapshot and install it here"""
+    config = config or get_barcode_filter_settings()
+    built_at = time.time()
+    count = Order.objects.count() + ArchivedOrder.objects.count()
+    capacity = max(int(count * 1.2), config["MIN_CAPACITY"])
+    bloom = BloomFilter.for_capacity(capacity, config["FALSE_POSITIVE_RATE"])
+    for model in (Order, ArchivedOrder):
+        for barcode in model.objects.values_list("barcode", flat=True).iterator(chunk_size=10000):
+            bloom.add(barcode)
+
+    snapshot = {
+        "version": uuid.uuid4().hex, "built_at": built_at, "size": bloom.size, "hashes": bloom.hashes,
+        "count": bloom.count, "bits": bytes(bloom.bits),
+    }
+    cache.set(SNAPSHOT_KEY, snapshot, None)
+    cache.set(VERSION_KEY, {"version": snapshot["version"], "built_at": built_at}, None)
+    process_filter.install(snapshot)
+    logger.info(
+        "barcode filter rebuilt: %d barcodes, %d KiB, expected false positive rate %.4f",
+        bloom.count, bloom.nbytes // 1024, bloom.expected_false_positive_rate(),
+    )
+    return bloom
@@ -0,0 +1,299 @@
+"""
+Set-based bulk actions for dispatchers and integrations.
+
+Every action locks the selected rows, checks each one against the model's
+STATUS_TRANSITIONS and applies the change to all valid rows with a single
+UPDATE (or one bulk INSERT) inside one transaction. Rows that cannot make the
+transition are reported in ``BulkResult.skipped`` instead of failing the
+whole batch.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+
+from . import metrics, order_cache
+from .models import (
+    ArchivedDelivery, DailyCourierStats, DailyOrderStats, Delivery, DeliveryBoy, Order, OutboxJob, WebhookDelivery,
+)
+
+
+MAX_BULK_SIZE = 500
+MAX_STATUS_BATCH = 1000
+
+
+class BulkResult:
+    """Primary keys that were changed and the reason each other one was not"""
+
+    def __init__(self):
+        self.updated = []
+        self.skipped = {}
+
+    def as_dict(self):
+        return {"updated": self.updated, "skipped": {str(pk): reason for pk, reason in self.skipped.items()}}
+
+
+def parse_ids(values):
+    """Distinct integer ids from request values, keeping their order and dropping junk"""
+    ids = []
+    for value in values:
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            continue
+        if pk not in ids:
+            ids.append(pk)
+    if len(ids) > MAX_BULK_SIZE:
+        raise ValueError(f"At most {MAX_BULK_SIZE} rows can be changed at once")
+    return ids
+
+
+def allowed_sources(model, new_status):
+    return [status for status, targets in model.STATUS_TRANSITIONS.items() if new_status in targets]
+
+
+ORDER_FIELDS = ("customer_id", "barcode", "created_at", "payment_status", "amount")
+DELIVERY_FIELDS = ("order_id", "delivery_boy_id", "order__customer_id", "order__barcode")
+
+
+def lock_rows(model, ids, fields):
+    """{pk: {"status": ..., *fields}} of the selected rows, locked until the transaction ends"""
+    rows = model.objects.select_for_update(of=("self",)).filter(pk__in=ids).values("pk", "status", *fields)
+    return {row["pk"]: row for row in rows}
+
+
+def partition(ids, current, sources, result):
+    for pk in ids:
+        row = current.get(pk)
+        if row is None:
+            result.skipped[pk] = "not found"
+        elif row["status"] not in sources:
+            result.skipped[pk] = f"cannot change from {row['status']}"
+        else:
+            result.updated.append(pk)
+
+
+def record_transitions(counter, current, updated, new_status):
+    for old_status, count in Counter(current[pk]["status"] for pk in updated).items():
+        counter.inc(count, from_status=old_status, to_status=new_status)
+
+
+def order_rollup_deltas(current, updated, new_status):
+    deltas = {}
+    for pk in updated:
+        row = current[pk]
+        DailyOrderStats.add_change(
+            deltas,
+            DailyOrderStats.state(row["created_at"], row["status"], row["payment_status"], row["amount"]),
+            DailyOrderStats.state(row["created_at"], new_status, row["payment_status"], row["amount"]),
+        )
+    return deltas
+
+
+def courier_rollup_deltas(current, updated, new_status):
+    deltas = {}
+    for delivery_boy_id, count in Counter(current[pk]["delivery_boy_id"] for pk in updated).items():
+        DailyCourierStats.add_events(deltas, delivery_boy_id, [new_status], count=count)
+    return deltas
+
+
+def order_events(current, updated, new_status):
+    return [
+        WebhookDelivery.order_event(pk, current[pk]["customer_id"], current[pk]["barcode"],
+                                    current[pk]["status"], new_status)
+        for pk in updated
+    ]
+
+
+def delivery_events(current, updated, new_status):
+    return [
+        WebhookDelivery.delivery_event(pk, current[pk]["order_id"], current[pk]["order__customer_id"],
+                                       current[pk]["order__barcode"], current[pk]["status"], new_status)
+        for pk in updated
+    ]
+
+
+def assign_orders(order_ids, delivery_boy, notes=""):
+    """Create deliveries for pending orders and move them to in_transit"""
+    result = BulkResult()
+    with transaction.atomic():
+        current = lock_rows(Order, order_ids, ORDER_FIELDS)
+        assigned = set(Delivery.objects.filter(order_id__in=current).values_list("order_id", flat=True))
+        for pk in assigned:
+            current.pop(pk)
+            result.skipped[pk] = "already assigned"
+        partition([pk for pk in order_ids if pk not in assigned], current, ["pending"], result)
+        if result.updated:
+            deliveries = Delivery.objects.bulk_create([
+                Delivery(order_id=pk, delivery_boy=delivery_boy, status="assigned", notes=notes)
+                for pk in result.updated
+            ])
+            Order.objects.filter(pk__in=result.updated).update(status="in_transit", updated_at=timezone.now())
+            order_cache.invalidate(current[pk]["customer_id"] for pk in result.updated)
+            DailyOrderStats.increment(order_rollup_deltas(current, result.updated, "in_transit"))
+            DailyCourierStats.increment(
+                DailyCourierStats.add_events({}, delivery_boy.pk, ["assigned"], count=len(deliveries))
+            )
+            WebhookDelivery.record(order_events(current, result.updated, "in_transit") + [
+                WebhookDelivery.delivery_event(delivery.pk, delivery.order_id, current[delivery.order_id]["customer_id"],
+                                               current[delivery.order_id]["barcode"], "", "assigned")
+                for delivery in deliveries
+            ])
+
+    record_transitions(metrics.order_transitions, current, result.updated, "in_transit")
+    if result.updated:
+        metrics.delivery_transitions.inc(len(result.updated), from_status="", to_status="assigned")
+    return result
+
+
+def cancel_orders(order_ids):
+    """Cancel every selected order that has not been delivered or cancelled yet"""
+    result = BulkResult()
+    with transaction.atomic():
+        current = lock_rows(Order, order_ids, ORDER_FIELDS)
+        partition(order_ids, current, allowed_sources(Order, "cancelled"), result)
+        if result.updated:
+            Order.objects.filter(pk__in=result.updated).update(status="cancelled", updated_at=timezone.now())
+            order_cache.invalidate(current[pk]["customer_id"] for pk in result.updated)
+            DailyOrderStats.increment(order_rollup_deltas(current, result.updated, "cancelled"))
+            shipped = [pk for pk in result.updated if current[pk]["status"] != "pending"]
+            if shipped:
+                Delivery.touch_orders(shipped)
+            WebhookDelivery.record(order_events(current, result.updated, "cancelled"))
+
+    record_transitions(metrics.order_transitions, current, result.updated, "cancelled")
+    return result
+
+
+def update_deliveries(delivery_ids, new_status, notes=""):
+    """Move the selected deliveries to picked_up, in_transit, delivered or failed"""
+    sources = allowed_sources(Delivery, new_status)
+    if not sources:
+        raise ValueError(f"Deliveries cannot be marked as {new_status!r}")
+
+    result = BulkResult()
+    with transaction.atomic():
+        current = lock_rows(Delivery, delivery_ids, DELIVERY_FIELDS)
+        partition(delivery_ids, current, sources, result)
+        if result.updated:
+            now = timezone.now()
+            fields = {"status": new_status, "updated_at": now}
+            if new_status == "picked_up":
+                fields["picked_up_at"] = now
+            elif new_status == "delivered":
+                fields["delivered_at"] = now
+            elif new_status == "failed":
+                fields["failed_at"] = now
+            if notes:
+                fields["notes"] = notes
+            Delivery.objects.filter(pk__in=result.updated).update(**fields)
+            DailyCourierStats.increment(courier_rollup_deltas(current, result.updated, new_status))
+            if new_status == "delivered":
+                delivery_boy_ids = Delivery.objects.filter(pk__in=result.updated).values_list(
+                    "delivery_boy_id", flat=True
+                ).distinct()
+                OutboxJob.enqueue("refresh_courier_stats", delivery_boy_ids=sorted(delivery_boy_ids))
+            WebhookDelivery.record(delivery_events(current, result.updated, new_status))
+
+    record_transitions(metrics.delivery_transitions, current, result.updated, new_status)
+    return result
+
+
+def apply_order_status_batch(queryset, entries):
+    """
+    Apply ``(index, entry)`` status changes to the orders of ``queryset``.
+
+    Entries are validated OrderStatusBatchItemSerializer data. All targets are
+    loaded and locked with one query, replayed in timestamp order so several
+    steps for the same order (pending -> in_transit -> delivered) can arrive in
+    one batch, and written with one UPDATE per resulting status. Returns
+    ``{index: outcome}`` where outcome is updated, unchanged, stale, not_found
+    or invalid_transition.
+    """
+    ids = {entry["id"] for _, entry in entries if entry.get("id")}
+    barcodes = {entry["barcode"] for _, entry in entries if not entry.get("id")}
+    now = timezone.now()
+    results = {}
+    transitions = []
+
+    with transaction.atomic():
+        orders = list(
+            queryset.select_for_update(of=("self",))
+            .filter(Q(pk__in=ids) | Q(barcode__in=barcodes))
+            .only("id", "customer_id", "barcode", "status", "payment_status", "amount", "created_at", "updated_at")
+        )
+        by_id = {order.pk: order for order in orders}
+        by_barcode = {order.barcode: order for order in orders}
+        initial = {order.pk: order.status for order in orders}
+
+        # Replay in event order; entries without a timestamp happened "now"
+        for index, entry in sorted(entries, key=lambda item: (item[1].get("timestamp") or now, item[0])):
+            order = by_id.get(entry["id"]) if entry.get("id") else by_barcode.get(entry["barcode"])
+            new_status = entry["status"]
+            if order is None:
+                results[index] = {"outcome": "not_found", "id": entry.get("id"), "barcode": entry.get("barcode")}
+                continue
+            result = {"id": order.pk, "barcode": order.barcode}
+            if entry.get("timestamp") and entry["timestamp"] < order.updated_at:
+                result.update(outcome="stale", error="order changed after this event")
+            elif order.status == new_status:
+                result["outcome"] = "unchanged"
+            elif order.can_update_status(new_status):
+                transitions.append((order, order.status, new_status))
+                order.status = new_status
+                result["outcome"] = "updated"
+            else:
+                result.update(outcome="invalid_transition",
+                              error=f"cannot change from {order.status} to {new_status}")
+            result["status"] = order.status
+            results[index] = result
+
+        by_status, deltas = {}, {}
+        for order in orders:
+            if order.status != initial[order.pk]:
+                by_status.setdefault(order.status, []).append(order.pk)
+                DailyOrderStats.add_change(
+                    deltas,
+                    DailyOrderStats.state(order.created_at, initial[order.pk], order.payment_status, order.amount),
+                    order.rollup_state(),
+                )
+        for status, pks in by_status.items():
+            Order.objects.filter(pk__in=pks).update(status=status, updated_at=now)
+        order_cache.invalidate(order.customer_id for order in orders if order.status != initial[order.pk])
+        DailyOrderStats.increment(deltas)
+        shipped = [pk for pk, status in initial.items() if status != "pending" and by_id[pk].status != status]
+        if shipped:
+            Delivery.touch_orders(shipped)
+        WebhookDelivery.record(
+            WebhookDelivery.order_event(order.pk, order.customer_id, order.barcode, old_status, new_status)
+            for order, old_status, new_status in transitions
+        )
+
+    for _, old_status, new_status in transitions:
+        metrics.order_transitions.inc(from_status=old_status, to_status=new_status)
+    return results
+
+
+def refresh_courier_stats(delivery_boy_ids=None):
+    """Set total_deliveries and rating of the given couriers (or all), archived deliveries included, with one UPDATE"""
+    couriers = DeliveryBoy.objects.all()
+    if delivery_boy_ids is not None:
+        couriers = couriers.filter(pk__in=delivery_boy_ids)
+
+    def hot_and_archived(expression, **filters):
+        def per_courier(model):
+            rows = model.objects.filter(delivery_boy=OuterRef("pk"), **filters).values("delivery_boy")
+            return Coalesce(Subquery(rows.annotate(v=expression).values("v")), Value(0), output_field=IntegerField())
+        return per_courier(Delivery) + per_courier(ArchivedDelivery)
+
+    rated = hot_and_archived(Count("pk"), rating__isnull=False)
+    couriers.update(
+        total_deliveries=hot_and_archived(Count("pk")),
+        rating=Coalesce(
+            Cast(hot_and_archived(Sum("rating")), FloatField()) / NullIf(rated, Value(0)), Value(0.0)
+        ),
+        updated_at=timezone.now(),
+    )
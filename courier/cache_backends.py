@@ -0,0 +1,87 @@
+"""
+In-memory cache with a memory limit.
+
+Django's LocMemCache bounds the number of entries (MAX_ENTRIES) but not their
+size, and cached order lists range from a few bytes to megabytes. This backend
+also keeps the pickled values of a cache under OPTIONS["MAX_BYTES"], evicting
+least recently used entries first (LocMemCache keeps its entries in recency
+order, most recent first). A value larger than the whole budget is not stored.
+"""
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# Bytes used per cache name, shared like LocMemCache's own per-name storage
+_usage = {}
+
+
+class CacheUsage:
+    def __init__(self):
+        self.sizes = {}
+        self.total = 0
+
+    def put(self, key, size):
+        self.total += size - self.sizes.get(key, 0)
+        self.sizes[key] = size
+
+    def drop(self, key):
+        self.total -= self.sizes.pop(key, 0)
+
+    def clear(self):
+        self.sizes.clear()
+        self.total = 0
+
+
+class BoundedLocMemCache(LocMemCache):
+    """LocMemCache evicting least recently used entries beyond OPTIONS["MAX_BYTES"] (0 means no limit)"""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._max_bytes = int(params.get("OPTIONS", {}).get("MAX_BYTES", 0))
+        self._usage = _usage.setdefault(name, CacheUsage())
+
+    @property
+    def bytes_used(self):
+        return self._usage.total
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if self._max_bytes and len(value) > self._max_bytes:
+            self._delete(key)
+            return
+        super()._set(key, value, timeout)
+        self._usage.put(key, len(value))
+        while self._max_bytes and self._usage.total > self._max_bytes:
+            self._evict_oldest()
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version)
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if key in self._cache:
+                self._usage.put(key, len(self._cache[key]))
+        return value
+
+    def _evict_oldest(self):
+        key, _ = self._cache.popitem()
+        del self._expire_info[key]
+        self._usage.drop(key)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._usage.clear()
+        else:
+            for _ in range(len(self._cache) // self._cull_frequency):
+                self._evict_oldest()
+
+    def _delete(self, key):
+        self._usage.drop(key)
+        return super()._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._usage.clear()
@@ -0,0 +1,140 @@
+"""
+Online move of the status, role and vehicle type columns to integer codes.
+
+Each step ships in its own release, because migrations run when a release
+starts while the previous release is still serving:
+
+1. Expand (this release, migrations 0010 and 0011): a nullable
+   ``<column>_code`` next to each string column, with the status indexes
+   built on the codes (concurrently on PostgreSQL), and triggers that set the
+   code whenever a row is inserted or its string changes. Every writer keeps
+   writing strings (this release, the previous one, raw inserts and
+   set-based updates alike) and the database writes both columns.
+2. Backfill, between deploys: ``manage.py backfill_enum_codes`` encodes the
+   rows written before the triggers existed in small batches, each in its
+   own transaction, and reports how many rows are still without a code. The
+   next release must not be deployed before it reports none.
+3. Switch (next release): the models read and filter on the code columns.
+   Its migration makes the string columns nullable, turns the triggers into
+   a two-way sync so the processes of this release still read correct
+   strings during the rollout, and makes the codes NOT NULL; it fails
+   instead of encoding anything if ``remaining()`` still finds rows.
+4. Contract (the release after): drop the triggers, the string columns and
+   their indexes.
+
+The codes are frozen here on purpose (migrations must not follow later model
+edits); a test checks them against the models' choices. Codes are never
+renumbered; new values get new codes.
+"""
+
+from django.db import transaction
+
+
+# (table, column, {value: code})
+ENCODED_COLUMNS = [
+    ("courier_order", "status", {"pending": 1, "in_transit": 2, "delivered": 3, "cancelled": 4}),
+    ("courier_order", "payment_status", {"unpaid": 1, "paid": 2, "refunded": 3}),
+    ("courier_delivery", "status", {"assigned": 1, "picked_up": 2, "in_transit": 3, "delivered": 4, "failed": 5}),
+    ("courier_userprofile", "role", {"admin": 1, "delivery_boy": 2, "customer": 3}),
+    ("courier_deliveryboy", "vehicle_type", {"": 0, "bike": 1, "car": 2, "van": 3, "truck": 4}),
+]
+
+
+def code_column(column):
+    return f"{column}_code"
+
+
+def trigger_name(table, column):
+    return f"{table}_{column}_code_sync"
+
+
+def literal(value):
+    return str(value) if isinstance(value, int) else "'" + value.replace("'", "''") + "'"
+
+
+def case_sql(source, mapping):
+    """CASE expression mapping ``source`` through ``mapping`` (NULL for anything else)"""
+    whens = " ".join(f"WHEN {literal(key)} THEN {literal(value)}" for key, value in mapping.items())
+    return f"CASE {source} {whens} END"
+
+
+def create_triggers(schema_editor):
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    for table, column, codes in ENCODED_COLUMNS:
+        name, target = trigger_name(table, column), quote(code_column(column))
+        if connection.vendor == "postgresql":
+            schema_editor.execute(
+                f"CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$ BEGIN "
+                f"NEW.{target} := {case_sql(f'NEW.{quote(column)}', codes)}; RETURN NEW; "
+                f"END $$ LANGUAGE plpgsql"
+            )
+            schema_editor.execute(
+                f"CREATE TRIGGER {name} BEFORE INSERT OR UPDATE OF {quote(column)} ON {quote(table)} "
+                f"FOR EACH ROW EXECUTE FUNCTION {name}()"
+            )
+        elif connection.vendor == "sqlite":
+            # SQLite cannot assign NEW, so the row is updated right after the write
+            update = (
+                f"UPDATE {quote(table)} SET {target} = {case_sql(f'NEW.{quote(column)}', codes)} "
+                f"WHERE rowid = NEW.rowid;"
+            )
+            schema_editor.execute(f"CREATE TRIGGER {name}_insert AFTER INSERT ON {quote(table)} BEGIN {update} END")
+            schema_editor.execute(
+                f"CREATE TRIGGER {name}_update AFTER UPDATE OF {quote(column)} ON {quote(table)} BEGIN {update} END"
+            )
+        else:
+            raise NotImplementedError(f"No code sync triggers for {connection.vendor}")
+
+
+def drop_triggers(schema_editor):
+    connection = schema_editor.connection
+    for table, column, _ in ENCODED_COLUMNS:
+        name = trigger_name(table, column)
+        if connection.vendor == "postgresql":
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {name} ON {connection.ops.quote_name(table)}")
+            schema_editor.execute(f"DROP FUNCTION IF EXISTS {name}()")
+        elif connection.vendor == "sqlite":
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}_insert")
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}_update")
+
+
+def remaining(connection):
+    """Rows without a code per (table, column); all zero once the backfill is done"""
+    quote = connection.ops.quote_name
+    counts = {}
+    with connection.cursor() as cursor:
+        for table, column, _ in ENCODED_COLUMNS:
+            cursor.execute(f"SELECT COUNT(*) FROM {quote(table)} WHERE {quote(code_column(column))} IS NULL")
+            counts[(table, column)] = cursor.fetchone()[0]
+    return counts
+
+
+def backfill_batch(connection, table, column, codes, batch_size):
+    """Encode up to ``batch_size`` rows of ``table`` that have no code yet; returns how many were updated"""
+    quote = connection.ops.quote_name
+    target = quote(code_column(column))
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {quote(table)} SET {target} = {case_sql(quote(column), codes)} WHERE id IN ("
+            f"SELECT id FROM {quote(table)} WHERE {target} IS NULL "
+            f"AND {quote(column)} IN ({', '.join(['%s'] * len(codes))}) LIMIT %s)",
+            [*codes, batch_size],
+        )
+        return cursor.rowcount
+
+
+def backfill(connection, batch_size=5000, log=None):
+    """Encode every row without a code, batch by batch; returns the number of rows updated"""
+    total = 0
+    for table, column, codes in ENCODED_COLUMNS:
+        updated = 0
+        while True:
+            count = backfill_batch(connection, table, column, codes, batch_size)
+            updated += count
+            if count < batch_size:
+                break
+        if log:
+            log(f"{table}.{column}: {updated} rows encoded")
+        total += updated
+    return total
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from .models import UserProfile, DeliveryBoy
+from .roles import invalidate_role
 
 
 class UserProfileForm(forms.ModelForm):
@@ -69,6 +70,7 @@ class UserProfileForm(forms.ModelForm):
                 profile.phone = self.cleaned_data.get('phone', '')
                 profile.address = self.cleaned_data.get('address', '')
                 profile.save()
+            invalidate_role(user)
 
         return user
 
@@ -150,6 +152,7 @@ class UserEditForm(forms.ModelForm):
             user.profile.phone = self.cleaned_data.get('phone', '')
             user.profile.address = self.cleaned_data.get('address', '')
             user.profile.save()
+            invalidate_role(user)
         return user
 
 
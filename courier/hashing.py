@@ -0,0 +1,98 @@
+"""
+Password hashing with bounded concurrency.
+
+PBKDF2 dominates login, token and registration requests. The hasher below is
+listed first in PASSWORD_HASHERS and lets at most PASSWORD_POOL["THREADS"]
+request threads per process hash at the same time, so a login storm keeps at
+most that many cores busy hashing while the remaining request threads serve
+cheap endpoints such as tracking. hashlib releases the GIL while it derives a
+key, so the hash runs on the request thread itself; only the slots are
+limited. A hash that finds every slot taken waits up to WAIT seconds and then
+fails fast with PasswordHashingBusy, which PasswordHashingBusyMiddleware turns
+into a 503 (and Retry-After) for API, admin and session logins alike, instead
+of queueing behind the storm.
+
+The algorithm name is unchanged, so existing hashes verify as before. The
+time a hash waits for a slot is exported as
+``courier_password_hash_queue_seconds`` and refused hashes as
+``courier_password_hash_rejected_total``.
+"""
+
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+from . import metrics
+
+
+DEFAULT_PASSWORD_POOL = {
+    "ENABLED": True,
+    "THREADS": 2,
+    "WAIT": 1.0,
+}
+
+
+def get_password_pool_settings():
+    return {**DEFAULT_PASSWORD_POOL, **getattr(settings, "PASSWORD_POOL", {})}
+
+
+class PasswordHashingBusy(Exception):
+    """No hashing slot freed up in time; PasswordHashingBusyMiddleware answers 503 with Retry-After"""
+
+    retry_after = 1
+
+    def __init__(self):
+        super().__init__("Too many password checks in progress, retry shortly.")
+
+
+_slots = None
+_slots_key = None
+_slots_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_slots(threads):
+    """This process's semaphore; a forked worker or a new thread count gets a fresh one"""
+    global _slots, _slots_key
+    key = (os.getpid(), threads)
+    with _slots_lock:
+        if _slots_key != key:
+            _slots = threading.BoundedSemaphore(threads)
+            _slots_key = key
+        return _slots
+
+
+def run(operation, func, *args):
+    """Run ``func(*args)`` once a hashing slot is free; PasswordHashingBusy if none frees up within WAIT"""
+    config = get_password_pool_settings()
+    if not config["ENABLED"] or getattr(_local, "holding", False):
+        return func(*args)  # verify() and harden_runtime() call encode() within their slot
+
+    slots = get_slots(config["THREADS"])
+    submitted = time.perf_counter()
+    if not slots.acquire(timeout=config["WAIT"]):
+        metrics.password_hash_rejected.inc(operation=operation)
+        raise PasswordHashingBusy()
+    metrics.password_hash_queue_time.observe(time.perf_counter() - submitted, operation=operation)
+    _local.holding = True
+    try:
+        return func(*args)
+    finally:
+        _local.holding = False
+        slots.release()
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 hasher, limited to the configured number of concurrent hashes"""
+
+    def encode(self, password, salt, iterations=None):
+        return run("encode", super().encode, password, salt, iterations)
+
+    def verify(self, password, encoded):
+        return run("verify", super().verify, password, encoded)
+
+    def harden_runtime(self, password, encoded):
+        return run("harden_runtime", super().harden_runtime, password, encoded)
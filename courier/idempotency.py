@@ -0,0 +1,116 @@
+"""
+Idempotency-Key support for retried API writes.
+
+The first request with a given key (per user) inserts an IdempotencyKey row,
+runs the view and stores the rendered response in the same transaction, so a
+concurrent retry waits on the unique index and then replays the stored
+response. Later retries are answered from one indexed lookup without running
+the view. Reusing a key for a different request is rejected, 5xx responses
+are not stored, and rows expire after IDEMPOTENCY["TTL"] seconds
+(``manage.py purge_idempotency_keys`` deletes them).
+"""
+
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from . import metrics
+from .models import IdempotencyKey
+
+
+DEFAULT_IDEMPOTENCY = {
+    "TTL": 24 * 3600,
+}
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def get_idempotency_settings():
+    return {**DEFAULT_IDEMPOTENCY, **getattr(settings, "IDEMPOTENCY", {})}
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def find_key(user, key):
+    """The live record for ``key``, deleting it first if it has expired"""
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is not None and record.expires_at <= timezone.now():
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+        return None
+    return record
+
+
+def replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"}, status=422)
+    if record.status_code is None:
+        return Response({"error": f"A request with this {IDEMPOTENCY_HEADER} is still in progress"}, status=409)
+    response = HttpResponse(record.response_body, status=record.status_code, content_type="application/json")
+    response[REPLAYED_HEADER] = "true"
+    return response
+
+
+def idempotent(handler):
+    """Make a DRF view method safe to retry with an Idempotency-Key header"""
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return Response({"error": f"{IDEMPOTENCY_HEADER} must be at most 255 characters"}, status=400)
+
+        fingerprint = request_fingerprint(request)
+        record = find_key(request.user, key)
+        metrics.record_cache_lookup("idempotency", record is not None)
+        if record is not None:
+            return replay(record, fingerprint)
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user, key=key, fingerprint=fingerprint,
+                        expires_at=timezone.now() + timedelta(seconds=get_idempotency_settings()["TTL"]),
+                    )
+            except IntegrityError:
+                # A concurrent request with the same key committed first
+                record = IdempotencyKey.objects.get(user=request.user, key=key)
+                return replay(record, fingerprint)
+
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code >= 500:
+                transaction.set_rollback(True)
+                return response
+            record.status_code = response.status_code
+            record.response_body = JSONRenderer().render(response.data).decode()
+            record.save(update_fields=["status_code", "response_body"])
+        return response
+
+    return wrapper
+
+
+def purge_expired(batch_size=5000):
+    """Delete expired keys in batches; returns the number of rows removed"""
+    removed = 0
+    while True:
+        pks = list(
+            IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not pks:
+            return removed
+        removed += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from courier.archive import archive_orders, get_archive_settings
+
+
+class Command(BaseCommand):
+    help = 'Move delivered and cancelled orders older than ARCHIVE["AFTER_DAYS"] to the archive tables'
+
+    def add_arguments(self, parser):
+        config = get_archive_settings()
+        parser.add_argument('--older-than-days', type=int, default=config['AFTER_DAYS'],
+                            help='Archive orders unchanged for this many days')
+        parser.add_argument('--batch-size', type=int, default=config['BATCH_SIZE'],
+                            help='Orders moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop after this many batches (resume with the next run)')
+
+    def handle(self, *args, **options):
+        moved = archive_orders(
+            after_days=options['older_than_days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} orders'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from courier.enum_migration import backfill, remaining
+
+
+class Command(BaseCommand):
+    help = ('Encode the status, role and vehicle type of rows written before migration 0010 into their code columns; '
+            'run it between deploys, before the release that reads the codes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows encoded per transaction')
+
+    def handle(self, *args, **options):
+        updated = backfill(connection, batch_size=options['batch_size'], log=self.stdout.write)
+        left = {f'{table}.{column}': count for (table, column), count in remaining(connection).items() if count}
+        if left:
+            # Values outside the known codes; fix them before switching to the codes
+            raise CommandError(f'Encoded {updated} values, rows still without a code: '
+                               + ', '.join(f'{name} {count}' for name, count in left.items()))
+        self.stdout.write(self.style.SUCCESS(f'Encoded {updated} values; every row has its codes'))
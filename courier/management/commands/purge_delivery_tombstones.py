@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from courier.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = 'Delete courier sync tombstones older than COURIER_SYNC_TOMBSTONE_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        removed = purge_tombstones(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {removed} delivery tombstones'))
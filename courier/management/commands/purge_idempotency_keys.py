@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from courier.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        removed = purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {removed} expired idempotency keys'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from courier.barcode_filter import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Build the tracking barcode filter now and publish it to the shared cache'
+
+    def handle(self, *args, **options):
+        bloom = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Barcode filter rebuilt: {bloom.count} barcodes in {bloom.nbytes // 1024} KiB, '
+            f'expected false-positive rate {bloom.expected_false_positive_rate():.4f}'
+        ))
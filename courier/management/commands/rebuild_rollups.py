@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from courier.models import ArchivedOrder, Order
+from courier.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily reporting rollups for a date range from the order and delivery tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First day (YYYY-MM-DD), default: the first order')
+        parser.add_argument('--to', dest='end', help='Last day (YYYY-MM-DD), default: today')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days recomputed per transaction')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        end = self.parse_day(options['end']) if options['end'] else today
+        if options['start']:
+            start = self.parse_day(options['start'])
+        else:
+            first = min(filter(None, [
+                Order.objects.aggregate(first=Min('created_at'))['first'],
+                ArchivedOrder.objects.aggregate(first=Min('created_at'))['first'],
+            ]), default=None)
+            start = timezone.localdate(first) if first else today
+        if start > end:
+            raise CommandError('--from must not be after --to')
+
+        chunk = timedelta(days=max(options['chunk_days'], 1))
+        day = start
+        while day <= end:
+            last = min(day + chunk - timedelta(days=1), end)
+            rebuild(day, last)
+            day = last + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups from {start} to {end}'))
+
+    def parse_day(self, value):
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+        return day
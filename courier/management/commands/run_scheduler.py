@@ -0,0 +1,57 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from courier import metrics, scheduler
+from courier.models import ScheduledJob
+
+
+class Command(BaseCommand):
+    help = 'Run the periodic maintenance jobs until stopped; start it on any number of replicas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due, then exit')
+        parser.add_argument('--job', action='append', dest='jobs', metavar='NAME',
+                            help='Run this job now, due or not, then exit (repeatable)')
+        parser.add_argument('--list', action='store_true', help='Show the jobs and their next runs, then exit')
+
+    def handle(self, *args, **options):
+        config = scheduler.get_scheduler_settings()
+        scheduler.ensure_jobs(config)
+
+        if options['list']:
+            self.list_jobs(config)
+            return
+        if options['jobs']:
+            unknown = set(options['jobs']) - {job.name for job in scheduler.enabled_jobs(config)}
+            if unknown:
+                raise CommandError(f'Unknown or disabled jobs: {", ".join(sorted(unknown))}')
+            ran = scheduler.run_due(config, only=options['jobs'])
+            self.stdout.write(self.style.SUCCESS(f'Ran {", ".join(ran) or "nothing (held by another replica)"}'))
+            return
+        if options['once']:
+            ran = scheduler.run_due(config)
+            self.stdout.write(self.style.SUCCESS(f'Ran {len(ran)} due jobs'))
+            return
+
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+
+        self.stdout.write(f'Scheduler {scheduler.worker_name()} started with {len(scheduler.enabled_jobs(config))} jobs')
+        while not stop.is_set():
+            close_old_connections()
+            scheduler.run_due(config)
+            metrics.registry.maybe_flush()
+            stop.wait(config['POLL_INTERVAL'])
+        self.stdout.write('Scheduler stopped')
+
+    def list_jobs(self, config):
+        rows = {row.name: row for row in ScheduledJob.objects.all()}
+        for job in scheduler.enabled_jobs(config):
+            row = rows[job.name]
+            state = f'running on {row.locked_by}' if row.locked_by else f'next run {row.next_run_at:%Y-%m-%d %H:%M:%S}'
+            window = ', off-peak' if job.off_peak else ''
+            self.stdout.write(f'{job.name}: every {scheduler.interval(job, config)}s{window}, {state}')
@@ -0,0 +1,44 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from courier import metrics, outbox
+
+
+class Command(BaseCommand):
+    help = 'Process outbox jobs (post-commit side effects) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, help='Jobs run in parallel (default OUTBOX["THREADS"])')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed per query (default OUTBOX["BATCH_SIZE"])')
+        parser.add_argument('--once', action='store_true', help='Run every due job, then exit')
+
+    def handle(self, *args, **options):
+        config = outbox.get_outbox_settings()
+        if options['threads']:
+            config['THREADS'] = options['threads']
+        if options['batch_size']:
+            config['BATCH_SIZE'] = options['batch_size']
+
+        if options['once']:
+            with outbox.make_executor(config) as executor:
+                processed = outbox.drain(executor, config)
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} outbox jobs'))
+            return
+
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+
+        self.stdout.write(
+            f'Outbox worker started: {config["THREADS"]} threads, batches of {config["BATCH_SIZE"]}'
+        )
+        with outbox.make_executor(config) as executor:
+            while not stop.is_set():
+                processed = outbox.process_batch(executor, config)
+                metrics.registry.maybe_flush()
+                # Keep draining while there is a backlog; otherwise poll
+                if processed < config['BATCH_SIZE']:
+                    stop.wait(config['POLL_INTERVAL'])
+        self.stdout.write('Outbox worker stopped')
@@ -0,0 +1,260 @@
+import csv
+import io
+import random
+import time
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from courier import barcode_filter
+from courier.bulk import refresh_courier_stats
+from courier.models import Delivery, DeliveryBoy, Order, UserProfile
+from courier.rollups import rebuild as rebuild_rollups
+
+
+# Realistic distributions observed in production (weights, not percentages)
+ORDER_STATUS_WEIGHTS = {"delivered": 70, "in_transit": 10, "pending": 12, "cancelled": 8}
+VEHICLE_TYPE_WEIGHTS = {"bike": 55, "car": 25, "van": 15, "truck": 5}
+RATING_WEIGHTS = {1: 3, 2: 4, 3: 10, 4: 28, 5: 55}
+RATED_SHARE = 0.6
+CANCELLED_AFTER_ASSIGNMENT_SHARE = 0.3
+
+FIRST_NAMES = ["Aisha", "Ben", "Carlos", "Divya", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jamal",
+               "Kofi", "Lena", "Mohammed", "Nadia", "Omar", "Priya", "Rahul", "Sara", "Tomas", "Yuki"]
+LAST_NAMES = ["Ahmed", "Brown", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Haddad", "Ito", "Khan",
+              "Lopez", "Murphy", "Nair", "Okafor", "Patel", "Rossi", "Silva", "Tanaka", "Wong", "Zhang"]
+STREETS = ["Main St", "Harbour Rd", "Station Ave", "Market Lane", "Park View", "Mill Road", "Canal St"]
+CITIES = ["Kochi", "Dubai", "Leeds", "Austin", "Lyon", "Osaka", "Nairobi", "Porto"]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with realistic synthetic users, couriers, orders and deliveries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000, help='Customer users to create')
+        parser.add_argument('--couriers', type=int, default=100, help='Delivery boys to create')
+        parser.add_argument('--admins', type=int, default=1, help='Admin users to create')
+        parser.add_argument('--orders', type=int, default=10000, help='Orders to create')
+        parser.add_argument('--days', type=int, default=365, help='Spread order dates over this many days')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per INSERT/COPY batch')
+        parser.add_argument('--password', default='password123', help='Password shared by every seeded user')
+
+    def handle(self, *args, **options):
+        if options['customers'] < 1 and options['orders'] > 0:
+            raise CommandError('At least one customer is needed to create orders.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Work with naive UTC datetimes and format them once, without per-value adaptation
+        self.now = timezone.now().astimezone(dt_timezone.utc).replace(tzinfo=None)
+        self.use_copy = connection.vendor == 'postgresql'
+        self.tz_suffix = '+00:00' if self.use_copy else ''
+        started = time.monotonic()
+
+        with transaction.atomic():
+            customer_ids, courier_ids = self.seed_users(options)
+            self.seed_orders(options, customer_ids, courier_ids)
+            self.reset_sequences()
+            refresh_courier_stats()
+            # Rows were inserted without Order.save(), so the reporting rollups are recomputed
+            today = timezone.localdate()
+            rebuild_rollups(today - timedelta(days=options['days'] + 1), today)
+        # Nor did the barcodes reach the tracking filter; a fresh snapshot covers them once committed
+        if barcode_filter.get_barcode_filter_settings()['ENABLED']:
+            barcode_filter.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(f'Seeding finished in {time.monotonic() - started:.1f}s'))
+
+    # Row generation
+
+    def seed_users(self, options):
+        """Create admins, customers and couriers with their profiles"""
+        # Hash once; PBKDF2 per user would dominate the run time
+        password = make_password(options['password'])
+        joined = self.db_datetime(self.now - timedelta(days=options['days']))
+        admins, customers, couriers = options['admins'], options['customers'], options['couriers']
+
+        first_user_id = self.next_id(User)
+        first_profile_id = self.next_id(UserProfile)
+        roles = ['admin'] * admins + ['customer'] * customers + ['delivery_boy'] * couriers
+        user_ids = range(first_user_id, first_user_id + len(roles))
+
+        def users():
+            for user_id, role in zip(user_ids, roles):
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                username = f'{role}_{user_id}'
+                yield (user_id, password, None, role == 'admin', username, first, last,
+                       f'{username}@example.com', role == 'admin', True, joined)
+
+        def profiles():
+            for offset, (user_id, role) in enumerate(zip(user_ids, roles)):
+                yield (first_profile_id + offset, user_id, role, self.phone(), self.address(),
+                       True, joined, joined)
+
+        self.insert(User, ['id', 'password', 'last_login', 'is_superuser', 'username', 'first_name',
+                           'last_name', 'email', 'is_staff', 'is_active', 'date_joined'], users(), len(roles))
+        self.insert(UserProfile, ['id', 'user_id', 'role', 'phone', 'address', 'is_active',
+                                  'created_at', 'updated_at'], profiles(), len(roles))
+
+        customer_ids = list(user_ids[admins:admins + customers])
+        courier_user_ids = list(user_ids[admins + customers:])
+        first_courier_id = self.next_id(DeliveryBoy)
+        courier_ids = list(range(first_courier_id, first_courier_id + couriers))
+        vehicle_types = self.rng.choices(list(VEHICLE_TYPE_WEIGHTS), list(VEHICLE_TYPE_WEIGHTS.values()), k=couriers)
+
+        def delivery_boys():
+            for courier_id, user_id, vehicle_type in zip(courier_ids, courier_user_ids, vehicle_types):
+                yield (courier_id, user_id, vehicle_type, f'KL-{self.rng.randint(1, 99):02d}-{courier_id:05d}',
+                       f'DL{courier_id:010d}', self.rng.choice(CITIES), self.rng.random() < 0.7,
+                       0, Decimal('0.00'), joined, joined)
+
+        self.insert(DeliveryBoy, ['id', 'user_id', 'vehicle_type', 'vehicle_number', 'license_number',
+                                  'current_location', 'is_available', 'total_deliveries', 'rating',
+                                  'created_at', 'updated_at'], delivery_boys(), couriers)
+        return customer_ids, courier_ids
+
+    def seed_orders(self, options, customer_ids, courier_ids):
+        """Create orders and, for shipped ones, their deliveries, one batch at a time"""
+        total = options['orders']
+        span = options['days'] * 86400
+        rng = self.rng
+        order_id = self.next_id(Order)
+        delivery_id = self.next_id(Delivery)
+        num_customers = len(customer_ids)
+        order_statuses, order_weights = list(ORDER_STATUS_WEIGHTS), list(ORDER_STATUS_WEIGHTS.values())
+        ratings, rating_weights = list(RATING_WEIGHTS), list(RATING_WEIGHTS.values())
+        order_fields = ['id', 'customer_id', 'barcode', 'receiver_name', 'receiver_address', 'amount',
+                        'status', 'payment_status', 'created_at', 'updated_at']
+        delivery_fields = ['id', 'order_id', 'delivery_boy_id', 'assigned_at', 'picked_up_at',
+                           'delivered_at', 'failed_at', 'status', 'notes', 'rating', 'customer_feedback',
+                           'updated_at']
+        written_orders = written_deliveries = 0
+        started = time.monotonic()
+
+        while written_orders < total:
+            size = min(self.batch_size, total - written_orders)
+            orders, deliveries = [], []
+            for status in rng.choices(order_statuses, order_weights, k=size):
+                # A few merchants create most of the orders, and recent orders are more frequent
+                customer_id = customer_ids[int(num_customers * rng.random() ** 3)]
+                created = self.now - timedelta(seconds=int(span * rng.random() ** 1.5))
+                if status == 'delivered':
+                    payment = 'paid' if rng.random() < 0.97 else 'refunded'
+                elif status == 'cancelled':
+                    payment = 'refunded' if rng.random() < 0.4 else 'unpaid'
+                else:
+                    payment = 'paid' if rng.random() < 0.6 else 'unpaid'
+                updated = created + timedelta(hours=rng.randint(0, 72)) if status != 'pending' else created
+                orders.append((order_id, customer_id, f'CO-{order_id:012X}', self.name(), self.address(),
+                               Decimal(rng.randint(200, 50000)) / 100, status, payment,
+                               self.db_datetime(created), self.db_datetime(updated)))
+
+                if courier_ids and (status in ('delivered', 'in_transit') or (
+                        status == 'cancelled' and rng.random() < CANCELLED_AFTER_ASSIGNMENT_SHARE)):
+                    assigned = created + timedelta(minutes=rng.randint(5, 240))
+                    picked_up = delivered = failed = rating = None
+                    if status == 'delivered':
+                        delivery_status = 'delivered'
+                        picked_up = assigned + timedelta(minutes=rng.randint(10, 180))
+                        delivered = picked_up + timedelta(minutes=rng.randint(20, 600))
+                        if rng.random() < RATED_SHARE:
+                            rating = rng.choices(ratings, rating_weights)[0]
+                    elif status == 'cancelled':
+                        delivery_status = 'failed'
+                        failed = assigned + timedelta(minutes=rng.randint(10, 600))
+                    else:
+                        delivery_status = rng.choice(['assigned', 'picked_up', 'in_transit'])
+                        if delivery_status != 'assigned':
+                            picked_up = assigned + timedelta(minutes=rng.randint(10, 180))
+                    deliveries.append((delivery_id, order_id, courier_ids[rng.randrange(len(courier_ids))],
+                                       self.db_datetime(assigned), self.db_datetime(picked_up),
+                                       self.db_datetime(delivered), self.db_datetime(failed), delivery_status, '',
+                                       rating, '', self.db_datetime(delivered or failed or picked_up or assigned)))
+                    delivery_id += 1
+                order_id += 1
+
+            written_orders += self.write_batch(Order, order_fields, orders)
+            if deliveries:
+                written_deliveries += self.write_batch(Delivery, delivery_fields, deliveries)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'Order: {written_orders}/{total} rows, Delivery: {written_deliveries} rows '
+                f'({written_orders / max(elapsed, 1e-6):,.0f} orders/s)'
+            )
+
+    # Storage helpers
+
+    def insert(self, model, fields, rows, total):
+        """Write rows in batches, using COPY on PostgreSQL and executemany elsewhere"""
+        if not total:
+            return
+        started = time.monotonic()
+        written = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                written += self.write_batch(model, fields, batch)
+                batch = []
+        if batch:
+            written += self.write_batch(model, fields, batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{model.__name__}: {written} rows in {elapsed:.1f}s ({written / max(elapsed, 1e-6):,.0f} rows/s)'
+        )
+
+    def write_batch(self, model, fields, batch):
+        quote = connection.ops.quote_name
+        table = model._meta.db_table
+        columns = [model._meta.get_field(name).column for name in fields]
+        with connection.cursor() as cursor:
+            if self.use_copy:
+                buffer = io.StringIO()
+                csv.writer(buffer, quoting=csv.QUOTE_NOTNULL).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY {quote(table)} ({", ".join(map(quote, columns))}) FROM STDIN WITH (FORMAT csv)',
+                    buffer,
+                )
+            else:
+                placeholders = ', '.join(['%s'] * len(columns))
+                cursor.executemany(
+                    f'INSERT INTO {quote(table)} ({", ".join(map(quote, columns))}) VALUES ({placeholders})',
+                    batch,
+                )
+        return len(batch)
+
+    def next_id(self, model):
+        """First free primary key; rows get explicit ids so relations need no RETURNING"""
+        last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+        return (last or 0) + 1
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, UserProfile, DeliveryBoy, Order, Delivery]
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def db_datetime(self, value):
+        """Format a naive UTC datetime the way the backend stores it"""
+        if value is None:
+            return None
+        return f'{value}{self.tz_suffix}'
+
+    def name(self):
+        return f'{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}'
+
+    def phone(self):
+        return f'+1{self.rng.randint(2000000000, 9999999999)}'
+
+    def address(self):
+        return f'{self.rng.randint(1, 999)} {self.rng.choice(STREETS)}\n{self.rng.choice(CITIES)}'
@@ -0,0 +1,441 @@
+"""
+Process-local metrics with a file-backed store shared by all gunicorn workers.
+
+Each process keeps its values in memory and periodically writes them to
+``<METRICS["DIRECTORY"]>/<host>-<pid>.json``. The ``/metrics`` view merges
+every file with the live values of the serving process and renders the
+Prometheus text format, so the numbers are correct whichever worker answers
+the scrape. The directory may be a volume shared with other containers (the
+outbox worker and the scheduler), whose files are told apart by host name.
+
+Counters and histograms of exited workers are kept; gauges only count live
+processes: by pid on this host, and by a file written within STALE_AFTER
+seconds for other hosts, whose pids cannot be checked from here. Gunicorn's
+``child_exit`` hook calls ``Registry.merge_exited()``, which folds an exited
+worker's file into ``archive.json`` and removes it, so the directory does not
+grow with every recycled worker; a process that finds a file of an earlier
+process under its own name (a restarted container) folds it in the same way
+before its first write. Each file carries a random token for its process; the
+archive lists the tokens it has absorbed, so a scrape that still sees the old
+file while it is being folded in does not count it twice.
+"""
+
+import atexit
+import fcntl
+import hmac
+import json
+import math
+import os
+import secrets
+import socket
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+DEFAULT_METRICS = {
+    "ENABLED": True,
+    "DIRECTORY": os.path.join(tempfile.gettempdir(), "courier-metrics"),
+    "FLUSH_INTERVAL": 1.0,
+    "TOKEN": "",
+    "REQUIRE_TOKEN": True,
+    "STALE_AFTER": 60,
+}
+
+ARCHIVE_FILE = "archive.json"
+ARCHIVE_LOCK = "archive.lock"
+ARCHIVE_TOKENS = 100  # Merged-process tokens remembered, far more than can be merged during one scrape
+TOKEN_KEY = "_process"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_metrics_settings():
+    return {**DEFAULT_METRICS, **getattr(settings, "METRICS", {})}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        self.registry.add(self.name, self.key(labels), amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        self.registry.add(self.name, self.key(labels), amount)
+
+    def dec(self, amount=1, **labels):
+        self.registry.add(self.name, self.key(labels), -amount)
+
+    def set(self, value, **labels):
+        self.registry.set(self.name, self.key(labels), value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        self.registry.observe(self.name, self.key(labels), value, self.buckets)
+
+
+class Registry:
+    """Metric definitions plus this process's values"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+        self.pid = os.getpid()
+        self.token = secrets.token_hex(8)
+        self.claimed = False
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        self.values.setdefault(metric.name, {})
+
+    def _check_fork(self):
+        # A forked worker must not report the values it inherited from the master
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.token = secrets.token_hex(8)
+            self.claimed = False
+            self.last_flush = 0.0
+            for series in self.values.values():
+                series.clear()
+
+    def _series(self, name):
+        self._check_fork()
+        return self.values[name]
+
+    def add(self, name, key, amount):
+        with self.lock:
+            series = self._series(name)
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, key, value):
+        with self.lock:
+            self._series(name)[key] = value
+
+    def observe(self, name, key, value, buckets):
+        with self.lock:
+            series = self._series(name)
+            # Per-bucket (non-cumulative) counts followed by sum and count
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(buckets)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            self._check_fork()
+            return {
+                name: [[list(key), value] for key, value in series.items()]
+                for name, series in self.values.items()
+            }
+
+    # File-backed store
+
+    def maybe_flush(self):
+        config = get_metrics_settings()
+        if time.monotonic() - self.last_flush >= config["FLUSH_INTERVAL"]:
+            self.flush(config["DIRECTORY"])
+
+    def flush(self, directory):
+        if not directory:
+            return
+        data = {**self.snapshot(), TOKEN_KEY: self.token}
+        os.makedirs(directory, exist_ok=True)
+        if not self.claimed:
+            # An earlier process with this name (same pid in a restarted container) keeps its totals
+            self.merge_exited(directory, os.getpid(), keep_token=self.token)
+            self.claimed = True
+        write_atomic(os.path.join(directory, process_filename(os.getpid())), data)
+        self.last_flush = time.monotonic()
+
+    def merge(self, merged, data, alive):
+        """Add the values of a process file to {name: {key: value}}, without gauges unless ``alive``"""
+        for name, series in data.items():
+            metric = self.metrics.get(name)
+            if metric is None or (metric.kind == "gauge" and not alive):
+                continue
+            target = merged.setdefault(name, {})
+            for key, value in series:
+                key = tuple(key)
+                if metric.kind == "histogram":
+                    current = target.setdefault(key, [0] * len(value))
+                    target[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target[key] = target.get(key, 0) + value
+        return merged
+
+    def merge_exited(self, directory, pid, keep_token=None):
+        """
+        Fold the counters and histograms of the exited process ``pid`` of this host into the
+        archive, then drop its file; a file carrying ``keep_token`` belongs to the caller and stays
+        """
+        path = os.path.join(directory, process_filename(pid))
+        if not os.path.exists(path):
+            return
+        # Processes of other containers sharing the directory update the archive too
+        with open(os.path.join(directory, ARCHIVE_LOCK), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path) as fh:
+                    data = json.load(fh)
+            except (OSError, ValueError):
+                return
+            if keep_token is not None and data.get(TOKEN_KEY) == keep_token:
+                return
+            archive = read_archive(directory)
+            merged = self.merge(self.merge({}, archive["values"], alive=False), data, alive=False)
+            tokens = archive["tokens"] + ([data[TOKEN_KEY]] if TOKEN_KEY in data else [])
+            write_atomic(os.path.join(directory, ARCHIVE_FILE), {
+                "tokens": tokens[-ARCHIVE_TOKENS:],
+                "values": {
+                    name: [[list(key), value] for key, value in series.items()] for name, series in merged.items()
+                },
+            })
+            os.unlink(path)
+
+    def merge_exited_here(self, directory):
+        """Fold the files of every exited process of this host into the archive (a restarted server)"""
+        prefix = process_filename("").removesuffix(".json")
+        for filename in os.listdir(directory) if os.path.isdir(directory) else []:
+            pid = filename.removeprefix(prefix).removesuffix(".json")
+            if filename.startswith(prefix) and filename.endswith(".json") and pid.isdigit() and not pid_alive(int(pid)):
+                self.merge_exited(directory, int(pid))
+
+    def collect(self):
+        """Merge the values of every process into {name: {key: value}}"""
+        merged = {name: {} for name in self.metrics}
+        sources = [(self.snapshot(), True)]
+        config = get_metrics_settings()
+        directory = config["DIRECTORY"]
+        if directory and os.path.isdir(directory):
+            own = process_filename(os.getpid())
+            for filename in os.listdir(directory):
+                stem, _, ext = filename.partition(".")
+                host, _, pid = stem.rpartition("-")
+                if ext != "json" or not pid.isdigit() or filename == own:
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    if host and host != socket.gethostname():
+                        alive = time.time() - os.path.getmtime(path) < config["STALE_AFTER"]
+                    else:
+                        alive = pid_alive(int(pid))
+                    with open(path) as fh:
+                        sources.append((json.load(fh), alive))
+                except (OSError, ValueError):
+                    continue
+            # Read after the process files: a file folded in meanwhile is then listed in the archive
+            archive = read_archive(directory)
+            sources = [
+                (data, alive) for data, alive in sources
+                if TOKEN_KEY not in data or data[TOKEN_KEY] not in archive["tokens"]
+            ]
+            sources.append((archive["values"], False))
+
+        for data, alive in sources:
+            self.merge(merged, data, alive)
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        merged = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged[name].items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), value):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else format_value(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-2])}")
+                lines.append(f"{name}_count{format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def process_filename(pid):
+    """File of process ``pid`` of this host"""
+    return f"{socket.gethostname()}-{pid}.json"
+
+
+def read_archive(directory):
+    try:
+        with open(os.path.join(directory, ARCHIVE_FILE)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {"tokens": [], "values": {}}
+
+
+def write_atomic(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as fh:
+        json.dump(data, fh)
+    os.replace(temp_path, path)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+request_latency = Histogram(
+    registry, "courier_http_request_duration_seconds",
+    "Request latency by view", ["view", "method", "status"],
+)
+requests_in_flight = Gauge(
+    registry, "courier_http_requests_in_flight", "Requests currently being processed",
+)
+db_time = Counter(
+    registry, "courier_http_request_db_seconds_total", "Time spent in SQL queries by view", ["view"],
+)
+db_queries = Counter(
+    registry, "courier_http_request_db_queries_total", "SQL queries executed by view", ["view"],
+)
+cache_requests = Counter(
+    registry, "courier_cache_requests_total", "Cache lookups by cache and result (hit/miss)",
+    ["cache", "result"],
+)
+order_transitions = Counter(
+    registry, "courier_order_status_transitions_total", "Order status changes",
+    ["from_status", "to_status"],
+)
+delivery_transitions = Counter(
+    registry, "courier_delivery_status_transitions_total", "Delivery status changes",
+    ["from_status", "to_status"],
+)
+payment_actions = Counter(
+    registry, "courier_payment_actions_total", "Payment actions by outcome", ["action", "result"],
+)
+
+outbox_jobs = Counter(
+    registry, "courier_outbox_jobs_total", "Outbox jobs run by the worker, by task and result",
+    ["task", "result"],
+)
+webhook_events = Counter(
+    registry, "courier_webhook_events_total", "Webhook events sent to merchant endpoints, by result",
+    ["result"],
+)
+barcode_filter_lookups = Counter(
+    registry, "courier_barcode_filter_lookups_total",
+    "Tracking lookups by barcode filter result (rejected, passed, false_positive, unavailable)",
+    ["result"],
+)
+barcode_filter_bytes = Gauge(
+    registry, "courier_barcode_filter_bytes", "Memory used by the barcode filters of all processes",
+)
+barcode_filter_items = Gauge(
+    registry, "courier_barcode_filter_items", "Barcodes in the filter snapshot, summed over processes",
+)
+password_hash_queue_time = Histogram(
+    registry, "courier_password_hash_queue_seconds",
+    "Time password hashes wait for a free hashing slot, by operation", ["operation"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+password_hash_rejected = Counter(
+    registry, "courier_password_hash_rejected_total",
+    "Password hashes refused because no slot freed up within PASSWORD_POOL_WAIT, by operation", ["operation"],
+)
+
+queue_claims = Counter(
+    registry, "courier_queue_claims_total",
+    "Orders in the courier pull queue by outcome (claimed, requeued, taken, released)", ["result"],
+)
+
+scheduler_runs = Counter(
+    registry, "courier_scheduler_job_runs_total",
+    "Scheduled job runs by job and result (success, error, deferred to the off-peak window)", ["job", "result"],
+)
+scheduler_duration = Histogram(
+    registry, "courier_scheduler_job_duration_seconds", "Run time of scheduled jobs", ["job"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0),
+)
+
+
+def record_cache_lookup(cache, hit):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def flush_at_exit():
+    try:
+        registry.flush(get_metrics_settings()["DIRECTORY"])
+    except OSError:
+        pass
+
+
+atexit.register(flush_at_exit)
+
+
+def metrics_view(request):
+    """Expose all metrics in the Prometheus text format"""
+    config = get_metrics_settings()
+    token = config["TOKEN"]
+    if not token and config["REQUIRE_TOKEN"]:
+        return HttpResponseForbidden("Set METRICS_TOKEN to expose metrics")
+    supplied = request.headers.get("Authorization", "").encode()
+    if token and not hmac.compare_digest(supplied, f"Bearer {token}".encode()):
+        return HttpResponseForbidden("Invalid metrics token")
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,311 @@
+import heapq
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+
+from . import hashing, metrics, profiling
+
+
+logger = logging.getLogger("courier.sql")
+
+DEFAULT_SQL_INSTRUMENTATION = {
+    "ENABLED": True,
+    "SERVER_TIMING": True,
+    "SLOW_REQUEST_MS": 500,
+    "SLOW_QUERY_COUNT": 50,
+    "SLOWEST_QUERIES": 5,
+    "LOG_SAMPLE_RATE": 0.0,
+    "REPEATED_QUERIES": "off",
+    "REPEATED_QUERY_THRESHOLD": 5,
+}
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)", re.IGNORECASE)
+
+
+def get_instrumentation_settings():
+    return {**DEFAULT_SQL_INSTRUMENTATION, **getattr(settings, "SQL_INSTRUMENTATION", {})}
+
+
+def normalize_sql(sql):
+    """Reduce a statement to its shape so identical queries group together"""
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    return _IN_LIST.sub("IN (...)", sql)
+
+
+class RepeatedQueriesError(Exception):
+    """Raised in strict mode when a request runs the same query once per row"""
+
+
+def query_origin():
+    """
+    Where the current query comes from: the innermost frame in this project's
+    code and the innermost template line being rendered, either may be None.
+    """
+    base_dir = str(settings.BASE_DIR)
+    location = template = None
+    frame = sys._getframe(2)
+    while frame is not None and (location is None or template is None):
+        code = frame.f_code
+        if code.co_name == "render_annotated" and template is None:
+            node = frame.f_locals.get("self")
+            origin, token = getattr(node, "origin", None), getattr(node, "token", None)
+            if origin is not None and token is not None:
+                template = f"{origin.template_name or origin.name}:{token.lineno}"
+        elif (
+            location is None
+            and code.co_filename.startswith(base_dir)
+            and "site-packages" not in code.co_filename
+            and code.co_filename != __file__
+        ):
+            location = f"{os.path.relpath(code.co_filename, base_dir)}:{frame.f_lineno} in {code.co_name}"
+        frame = frame.f_back
+    return location, template
+
+
+class RepeatedQueries:
+    """Statements grouped by shape and origin, to find queries run once per row (N+1)"""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.groups = {}
+
+    def record(self, sql):
+        key = (normalize_sql(sql), *query_origin())
+        self.groups[key] = self.groups.get(key, 0) + 1
+
+    def offenders(self):
+        return [
+            {"count": count, "sql": sql, "location": location, "template": template}
+            for (sql, location, template), count in sorted(self.groups.items(), key=lambda item: -item[1])
+            if count >= self.threshold
+        ]
+
+
+class QueryStats:
+    """Queries executed during one request, recorded by a connection execute wrapper"""
+
+    def __init__(self, keep_slowest, repeated=None):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest = []  # min-heap of (duration, sequence, sql)
+        self.repeated = repeated
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            entry = (elapsed, self.count, sql)
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, entry)
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+            if self.repeated is not None:
+                self.repeated.record(sql)
+
+    def slowest_statements(self):
+        return [
+            {"ms": round(duration * 1000, 2), "sql": normalize_sql(sql)}
+            for duration, _, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Record query count, DB time and the slowest statements of every request.
+
+    Timings are reported in a ``Server-Timing`` header; requests over the
+    configured thresholds are logged with their normalized SQL and a sample of
+    all requests is logged as structured JSON lines.
+
+    With REPEATED_QUERIES set to "log" (staging) or "raise" (tests), statements
+    are also grouped by shape and origin (code line and template line), and a
+    shape run REPEATED_QUERY_THRESHOLD or more times from the same place, the
+    signature of a relation loaded once per row, is logged or raised as
+    RepeatedQueriesError.
+    """
+
+    def __init__(self, get_response):
+        config = get_instrumentation_settings()
+        if not config["ENABLED"]:
+            raise MiddlewareNotUsed("SQL instrumentation is disabled")
+        self.get_response = get_response
+        self.server_timing = config["SERVER_TIMING"]
+        self.slow_request_ms = config["SLOW_REQUEST_MS"]
+        self.slow_query_count = config["SLOW_QUERY_COUNT"]
+        self.keep_slowest = config["SLOWEST_QUERIES"]
+        self.sample_rate = config["LOG_SAMPLE_RATE"]
+        self.repeated_queries = config["REPEATED_QUERIES"]
+        self.repeated_threshold = config["REPEATED_QUERY_THRESHOLD"]
+
+    def __call__(self, request):
+        repeated = RepeatedQueries(self.repeated_threshold) if self.repeated_queries != "off" else None
+        stats = QueryStats(self.keep_slowest, repeated)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = stats.duration * 1000
+        request.query_stats = stats
+        if repeated is not None:
+            self.report_repeated(request, repeated.offenders())
+
+        if self.server_timing:
+            response["Server-Timing"] = (
+                f'db;dur={db_ms:.2f};desc="{stats.count} queries", '
+                f"app;dur={total_ms - db_ms:.2f}, total;dur={total_ms:.2f}"
+            )
+
+        slow = total_ms >= self.slow_request_ms or stats.count >= self.slow_query_count
+        if slow or (self.sample_rate and random.random() < self.sample_rate):
+            record = {
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "total_ms": round(total_ms, 2),
+                "db_ms": round(db_ms, 2),
+                "queries": stats.count,
+            }
+            if slow:
+                record["slowest"] = stats.slowest_statements()
+                logger.warning("slow request %s", json.dumps(record), extra={"sql_stats": record})
+            else:
+                logger.info("request %s", json.dumps(record), extra={"sql_stats": record})
+
+        return response
+
+    def report_repeated(self, request, offenders):
+        if not offenders:
+            return
+        record = {"method": request.method, "path": request.path, "repeated": offenders}
+        if self.repeated_queries == "raise":
+            raise RepeatedQueriesError(f"Repeated queries in {request.method} {request.path}: {json.dumps(offenders)}")
+        logger.warning("repeated queries %s", json.dumps(record), extra={"sql_stats": record})
+
+
+class MetricsMiddleware:
+    """
+    Record latency, in-flight requests and DB time for every request.
+
+    Must sit before QueryInstrumentationMiddleware so ``request.query_stats``
+    is available when the response comes back through.
+    """
+
+    def __init__(self, get_response):
+        if not metrics.get_metrics_settings()["ENABLED"]:
+            raise MiddlewareNotUsed("Metrics are disabled")
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.requests_in_flight.dec()
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        metrics.request_latency.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        stats = getattr(request, "query_stats", None)
+        if stats is not None:
+            metrics.db_time.inc(stats.duration, view=view)
+            metrics.db_queries.inc(stats.count, view=view)
+        metrics.registry.maybe_flush()
+        return response
+
+
+class PasswordHashingBusyMiddleware:
+    """
+    Answer 503 with Retry-After when a password hash got no slot (see ``courier.hashing``).
+
+    DRF re-raises exceptions that are not APIExceptions, so this covers API
+    token logins as well as the Django login forms.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, hashing.PasswordHashingBusy):
+            return None
+        if request.path.startswith("/api/"):
+            response = JsonResponse({"detail": str(exception)}, status=503)
+        else:
+            response = HttpResponse(str(exception), status=503, content_type="text/plain")
+        response["Retry-After"] = str(exception.retry_after)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile single requests on demand (see ``courier.profiling``).
+
+    Must come after AuthenticationMiddleware so the ``?__profile=1`` flag can
+    be restricted to admins.
+    """
+
+    def __init__(self, get_response):
+        self.config = profiling.get_profiling_settings()
+        if not self.config["ENABLED"]:
+            raise MiddlewareNotUsed("Profiling is disabled")
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from .admin_views import is_admin
+
+        if not profiling.should_profile(request, self.config, is_admin):
+            return self.get_response(request)
+
+        # Profiling is best effort: a request is never failed because it could not be profiled
+        profiler = profiling.create_profiler(self.config)
+        try:
+            active = profiler.start()
+            if not active:
+                profiling.logger.info("profiling skipped for %s %s: profiler busy", request.method, request.path)
+        except Exception:
+            profiling.logger.exception("could not start profiling %s %s", request.method, request.path)
+            active = False
+        if not active:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        try:
+            name = profiling.save_profile(profiler, request, elapsed_ms, self.config["DIRECTORY"])
+        except OSError:
+            profiling.logger.exception("could not save the profile of %s %s", request.method, request.path)
+            return response
+        response["X-Courier-Profile-Id"] = name
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courier', '0006_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('in_transit', 'In Transit'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('payment_status', models.CharField(choices=[('unpaid', 'Unpaid'), ('paid', 'Paid'), ('refunded', 'Refunded')], max_length=20)),
+                ('orders', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'status', 'payment_status'), name='daily_order_stats_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCourierStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('assigned', models.IntegerField(default=0)),
+                ('delivered', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('delivery_boy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='courier.deliveryboy')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'delivery_boy'), name='daily_courier_stats_uniq')],
+            },
+        ),
+    ]
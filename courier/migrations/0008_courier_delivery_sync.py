@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courier', '0007_reporting_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_id', models.BigIntegerField()),
+                ('reason', models.CharField(choices=[('reassigned', 'Reassigned')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='accepted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['delivery_boy', 'updated_at', 'id'], name='delivery_courier_sync_idx'),
+        ),
+        migrations.AddField(
+            model_name='deliverytombstone',
+            name='delivery_boy',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to='courier.deliveryboy'),
+        ),
+        migrations.AddIndex(
+            model_name='deliverytombstone',
+            index=models.Index(fields=['delivery_boy', 'created_at', 'id'], name='tombstone_courier_sync_idx'),
+        ),
+    ]
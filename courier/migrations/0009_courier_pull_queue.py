@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 04:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courier', '0008_courier_delivery_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='claim_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_orders', to='courier.deliveryboy'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Expand step of the move to integer codes, see courier/enum_migration.py
+
+from django.db import migrations, models
+
+from courier import enum_migration
+
+
+def create_triggers(apps, schema_editor):
+    enum_migration.create_triggers(schema_editor)
+
+
+def drop_triggers(apps, schema_editor):
+    enum_migration.drop_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courier', '0009_courier_pull_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_status_code',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='role_code',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryboy',
+            name='vehicle_type_code',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,44 @@
+# Expand step of the move to integer codes, see courier/enum_migration.py. The indexes on the code columns
+# are built without blocking writes on PostgreSQL (CREATE INDEX CONCURRENTLY, outside a transaction).
+
+from django.db import migrations, models
+
+
+INDEXES = [
+    ('order', models.Index(fields=['status_code', '-created_at', '-id'], name='order_status_code_idx')),
+    ('delivery', models.Index(fields=['status_code', '-assigned_at', '-id'], name='delivery_status_code_idx')),
+]
+
+
+def add_indexes(apps, schema_editor):
+    for model_name, index in INDEXES:
+        model = apps.get_model('courier', model_name)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+
+def remove_indexes(apps, schema_editor):
+    for model_name, index in INDEXES:
+        model = apps.get_model('courier', model_name)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('courier', '0010_enum_codes_expand'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_indexes, remove_indexes)],
+            state_operations=[migrations.AddIndex(model_name=model_name, index=index) for model_name, index in INDEXES],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courier', '0012_scheduled_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxjob',
+            name='dedupe_key',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='outboxjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('task', 'dedupe_key'), name='outbox_pending_dedupe_uniq'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courier', '0013_outbox_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archiveddelivery',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
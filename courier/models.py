@@ -1,6 +1,12 @@
+import secrets
 import uuid
-from django.db import models
+from decimal import Decimal
+
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import metrics, order_cache
 
 
 class Order(models.Model):
@@ -17,6 +23,13 @@ class Order(models.Model):
         ("refunded", "Refunded"),
     ]
 
+    STATUS_TRANSITIONS = {
+        'pending': ['in_transit', 'cancelled'],
+        'in_transit': ['delivered', 'cancelled'],
+        'delivered': [],  # Final state
+        'cancelled': []   # Final state
+    }
+
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="orders")
     barcode = models.CharField(max_length=100, unique=True)
     receiver_name = models.CharField(max_length=100)
@@ -26,16 +39,61 @@ class Order(models.Model):
     payment_status = models.CharField(
         max_length=20, choices=PAYMENT_STATUS_CHOICES, default="unpaid"
     )
+    # Integer codes of the two statuses, filled by database triggers (see courier/enum_migration.py)
+    status_code = models.PositiveSmallIntegerField(null=True, editable=False)
+    payment_status_code = models.PositiveSmallIntegerField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Lease of a pending order in the courier pull queue (see courier/pull_queue.py)
+    claimed_by = models.ForeignKey(
+        'DeliveryBoy', on_delete=models.SET_NULL, null=True, blank=True, related_name='claimed_orders'
+    )
+    claim_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Seek pagination of the admin order list, unfiltered and by status
+            models.Index(fields=["-created_at", "-id"], name="order_created_id_idx"),
+            models.Index(fields=["status", "-created_at", "-id"], name="order_status_created_idx"),
+            # The same on the status code, for the release that reads the codes
+            models.Index(fields=["status_code", "-created_at", "-id"], name="order_status_code_idx"),
+        ]
 
     def __str__(self):
         return f"{self.barcode} ({self.status})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        order = super().from_db(db, field_names, values)
+        order._rollup_state = order.rollup_state()
+        return order
+
     def save(self, *args, **kwargs):
         if not self.barcode:
             self.barcode = self.generate_barcode()
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        previous = None if adding else getattr(self, '_rollup_state', None)
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            state = self.rollup_state()
+            # Instances loaded with deferred rollup fields cannot tell what changed
+            if state != previous and (adding or previous is not None):
+                DailyOrderStats.increment(DailyOrderStats.add_change({}, previous, state))
+            order_cache.invalidate([self.customer_id])
+        self._rollup_state = state
+        if adding:
+            from .barcode_filter import remember
+            remember(self.barcode)
+
+    def delete(self, *args, **kwargs):
+        order_cache.invalidate([self.customer_id])
+        return super().delete(*args, **kwargs)
+
+    def rollup_state(self):
+        """Key and amount of this order in DailyOrderStats, or None while those fields are deferred"""
+        if any(name not in self.__dict__ for name in ('created_at', 'status', 'payment_status', 'amount')):
+            return None
+        return DailyOrderStats.state(self.created_at, self.status, self.payment_status, self.amount)
 
     def generate_barcode(self):
         """Generate a unique barcode for the order"""
@@ -43,37 +101,57 @@ class Order(models.Model):
 
     def can_update_status(self, new_status):
         """Check if status transition is valid"""
-        valid_transitions = {
-            'pending': ['in_transit', 'cancelled'],
-            'in_transit': ['delivered', 'cancelled'],
-            'delivered': [],  # Final state
-            'cancelled': []   # Final state
-        }
-        return new_status in valid_transitions.get(self.status, [])
+        return new_status in self.STATUS_TRANSITIONS.get(self.status, [])
+
+    def lock_for_update(self):
+        """Lock this order's row and take its current status and payment status from it
+
+        Must run inside a transaction. A concurrent transition that committed
+        since this instance was loaded is seen here, so the caller validates
+        against the row as it is and save() counts the rollup delta from it.
+        """
+        row = Order.objects.select_for_update().values(
+            'created_at', 'status', 'payment_status', 'amount'
+        ).get(pk=self.pk)
+        self.status, self.payment_status = row['status'], row['payment_status']
+        self._rollup_state = DailyOrderStats.state(
+            row['created_at'], row['status'], row['payment_status'], row['amount']
+        )
 
     def update_status(self, new_status):
         """Update order status with validation"""
-        if self.can_update_status(new_status):
+        with transaction.atomic():
+            self.lock_for_update()
+            if not self.can_update_status(new_status):
+                return False
+            old_status = self.status
             self.status = new_status
             self.save()
-            return True
-        return False
+            if old_status != 'pending':  # Only orders past pending can have a delivery
+                Delivery.touch_orders([self.pk])
+            WebhookDelivery.record([WebhookDelivery.order_event(
+                self.pk, self.customer_id, self.barcode, old_status, new_status
+            )])
+        metrics.order_transitions.inc(from_status=old_status, to_status=new_status)
+        return True
 
     def mark_as_paid(self):
         """Mark order as paid"""
-        if self.payment_status == 'unpaid':
-            self.payment_status = 'paid'
-            self.save()
-            return True
-        return False
+        return self._change_payment('pay', 'unpaid', 'paid')
 
     def refund_payment(self):
         """Process refund"""
-        if self.payment_status == 'paid':
-            self.payment_status = 'refunded'
-            self.save()
-            return True
-        return False
+        return self._change_payment('refund', 'paid', 'refunded')
+
+    def _change_payment(self, action, expected, new_status):
+        with transaction.atomic(savepoint=False):
+            self.lock_for_update()
+            changed = self.payment_status == expected
+            if changed:
+                self.payment_status = new_status
+                self.save()
+        metrics.payment_actions.inc(action=action, result='success' if changed else 'rejected')
+        return changed
 
     @property
     def is_deliverable(self):
@@ -91,6 +169,7 @@ class UserProfile(models.Model):
 
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='customer')
+    role_code = models.PositiveSmallIntegerField(null=True, editable=False)  # See courier/enum_migration.py
     phone = models.CharField(max_length=15, blank=True)
     address = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
@@ -122,6 +201,7 @@ class DeliveryBoy(models.Model):
         ('van', 'Van'),
         ('truck', 'Truck'),
     ], blank=True)
+    vehicle_type_code = models.PositiveSmallIntegerField(null=True, editable=False)  # See courier/enum_migration.py
     vehicle_number = models.CharField(max_length=20, blank=True)
     license_number = models.CharField(max_length=20, blank=True)
     current_location = models.CharField(max_length=255, blank=True)
@@ -157,40 +237,509 @@ class Delivery(models.Model):
         ('failed', 'Failed'),
     ]
 
+    STATUS_TRANSITIONS = {
+        'assigned': ['picked_up', 'failed'],
+        'picked_up': ['in_transit', 'delivered', 'failed'],
+        'in_transit': ['delivered', 'failed'],
+        'delivered': [],  # Final state
+        'failed': []      # Final state
+    }
+
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='delivery')
     delivery_boy = models.ForeignKey(DeliveryBoy, on_delete=models.CASCADE, related_name='deliveries')
     assigned_at = models.DateTimeField(auto_now_add=True)
     picked_up_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='assigned')
+    status_code = models.PositiveSmallIntegerField(null=True, editable=False)  # See courier/enum_migration.py
     notes = models.TextField(blank=True)
     rating = models.PositiveIntegerField(null=True, blank=True, choices=[(i, i) for i in range(1, 6)])
     customer_feedback = models.TextField(blank=True)
+    accepted_at = models.DateTimeField(null=True, blank=True)  # Courier acknowledged the assignment
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Seek pagination of the admin delivery list, unfiltered and by status
+            models.Index(fields=["-assigned_at", "-id"], name="delivery_assigned_id_idx"),
+            models.Index(fields=["status", "-assigned_at", "-id"], name="delivery_status_assigned_idx"),
+            models.Index(fields=["status_code", "-assigned_at", "-id"], name="delivery_status_code_idx"),
+            # Courier app delta sync: a courier's deliveries changed after a cursor
+            models.Index(fields=["delivery_boy", "updated_at", "id"], name="delivery_courier_sync_idx"),
+        ]
+
     def __str__(self):
         return f"Delivery {self.order.barcode} by {self.delivery_boy.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        delivery = super().from_db(db, field_names, values)
+        delivery._rollup_status = delivery.__dict__.get('status')
+        return delivery
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        previous = None if adding else getattr(self, '_rollup_status', None)
+        if self.status == 'failed' and self.failed_at is None:
+            # The day the rollups count the failure on, which later updates must not move
+            self.failed_at = timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = [*kwargs['update_fields'], 'failed_at']
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if adding:
+                events = ['assigned'] + ([self.status] if self.status != 'assigned' else [])
+            elif previous is not None and self.status != previous:
+                events = [self.status]
+            else:
+                events = []
+            DailyCourierStats.increment(DailyCourierStats.add_events({}, self.delivery_boy_id, events))
+        self._rollup_status = self.status
+
+    def status_event(self, from_status):
+        """Webhook event for a change from ``from_status`` to the current status"""
+        return WebhookDelivery.delivery_event(
+            self.pk, self.order_id, self.order.customer_id, self.order.barcode, from_status, self.status
+        )
+
+    @classmethod
+    def touch_orders(cls, order_ids):
+        """Bump the deliveries of changed orders so courier apps sync the new order status"""
+        cls.objects.filter(order_id__in=order_ids).update(updated_at=timezone.now())
+
+    def mark_accepted(self):
+        """Courier acknowledged the assignment"""
+        if self.status == 'assigned' and self.accepted_at is None:
+            self.accepted_at = timezone.now()
+            self.save(update_fields=['accepted_at', 'updated_at'])
+            return True
+        return False
+
     def mark_picked_up(self):
         """Mark delivery as picked up"""
         if self.status == 'assigned':
             self.status = 'picked_up'
-            self.picked_up_at = models.DateTimeField(auto_now=True)
-            self.save()
+            self.picked_up_at = timezone.now()
+            with transaction.atomic():
+                self.save()
+                WebhookDelivery.record([self.status_event('assigned')])
+            metrics.delivery_transitions.inc(from_status='assigned', to_status='picked_up')
             return True
         return False
 
     def mark_delivered(self, rating=None, feedback=None):
         """Mark delivery as completed"""
         if self.status in ['picked_up', 'in_transit']:
+            old_status = self.status
             self.status = 'delivered'
-            self.delivered_at = models.DateTimeField(auto_now=True)
+            self.delivered_at = timezone.now()
             if rating:
                 self.rating = rating
             if feedback:
                 self.customer_feedback = feedback
-            self.save()
-            self.delivery_boy.update_delivery_count()
-            self.delivery_boy.calculate_rating()
+            with transaction.atomic():
+                self.save()
+                # Courier totals are recomputed by the outbox worker, off the request path
+                OutboxJob.enqueue('refresh_courier_stats', delivery_boy_ids=[self.delivery_boy_id])
+                WebhookDelivery.record([self.status_event(old_status)])
+            metrics.delivery_transitions.inc(from_status=old_status, to_status='delivered')
             return True
         return False
+
+    def mark_failed(self, notes=None):
+        """Mark an unfinished delivery as failed"""
+        if 'failed' in self.STATUS_TRANSITIONS[self.status]:
+            old_status = self.status
+            self.status = 'failed'
+            if notes:
+                self.notes = notes
+            with transaction.atomic():
+                self.save()
+                WebhookDelivery.record([self.status_event(old_status)])
+            metrics.delivery_transitions.inc(from_status=old_status, to_status='failed')
+            return True
+        return False
+
+    def reassign(self, delivery_boy):
+        """Hand an unfinished delivery to another courier; the previous one gets a tombstone"""
+        if not self.STATUS_TRANSITIONS[self.status] or delivery_boy.pk == self.delivery_boy_id:
+            return False
+        old_status, previous = self.status, self.delivery_boy_id
+        self.delivery_boy = delivery_boy
+        self.status = 'assigned'
+        self.assigned_at = timezone.now()
+        self.accepted_at = self.picked_up_at = None
+        self._rollup_status = 'assigned'  # Counted below for the new courier, whatever the old status
+        with transaction.atomic():
+            self.save()
+            DailyCourierStats.increment(DailyCourierStats.add_events({}, delivery_boy.pk, ['assigned']))
+            DeliveryTombstone.objects.create(delivery_id=self.pk, delivery_boy_id=previous, reason='reassigned')
+            if old_status != 'assigned':
+                WebhookDelivery.record([self.status_event(old_status)])
+        if old_status != 'assigned':
+            metrics.delivery_transitions.inc(from_status=old_status, to_status='assigned')
+        return True
+
+
+class DeliveryTombstone(models.Model):
+    """A delivery that left a courier's list, reported to their app by the next delta sync"""
+    REASON_CHOICES = [
+        ('reassigned', 'Reassigned'),
+    ]
+
+    delivery_id = models.BigIntegerField()  # Not a foreign key: the delivery may be gone later
+    delivery_boy = models.ForeignKey(DeliveryBoy, on_delete=models.CASCADE, related_name='tombstones')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["delivery_boy", "created_at", "id"], name="tombstone_courier_sync_idx"),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a request sent with an Idempotency-Key header"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # sha256 of method, path and body
+    status_code = models.PositiveSmallIntegerField(null=True)  # null while the request runs
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
+
+
+class OutboxJob(models.Model):
+    """Side effect recorded in the same transaction as the change that caused it"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),  # Gave up after OUTBOX["MAX_ATTEMPTS"]
+    ]
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    dedupe_key = models.CharField(max_length=100, null=True, blank=True)  # See enqueue_once()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Claim query of the worker: due jobs in id order
+            models.Index(fields=['status', 'run_after', 'id'], name='outbox_due_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'dedupe_key'], condition=models.Q(status='pending'),
+                                    name='outbox_pending_dedupe_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, task, **payload):
+        """Record a job; it only becomes visible to the worker when the caller's transaction commits"""
+        return cls.objects.create(task=task, payload=payload)
+
+    @classmethod
+    def enqueue_once(cls, task, payloads):
+        """
+        Make sure a pending ``task`` job exists for every ``{dedupe_key: payload}``,
+        reusing the pending job of a key when there is one.
+
+        The reused jobs stay locked until the caller's transaction commits, so a
+        worker cannot start one before the changes it has to see are visible; a
+        job that a worker claimed meanwhile is no longer pending and gets a
+        successor.
+        """
+        missing = dict(payloads)
+        while missing:
+            pending = cls.objects.select_for_update().filter(task=task, status='pending', dedupe_key__in=missing)
+            for key in pending.values_list('dedupe_key', flat=True):
+                del missing[key]
+            if missing:
+                cls.objects.bulk_create(
+                    [cls(task=task, dedupe_key=key, payload=payload) for key, payload in missing.items()],
+                    ignore_conflicts=True,  # Another transaction created it first; lock it on the next pass
+                )
+
+
+class ScheduledJob(models.Model):
+    """Next run and leader lease of a periodic job run by `manage.py run_scheduler` (see courier/scheduler.py)"""
+    name = models.CharField(max_length=100, unique=True)
+    next_run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=255, blank=True)  # host:pid of the scheduler running it
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_finished_at = models.DateTimeField(null=True, blank=True)
+    last_duration = models.FloatField(null=True, blank=True)
+    last_result = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.name} (next run {self.next_run_at:%Y-%m-%d %H:%M:%S})"
+
+
+def generate_webhook_secret():
+    return secrets.token_hex(32)
+
+
+class WebhookEndpoint(models.Model):
+    """Merchant URL that receives the status changes of a customer's orders"""
+    EVENT_CHOICES = [
+        ('order.status_changed', 'Order status changed'),
+        ('delivery.status_changed', 'Delivery status changed'),
+    ]
+
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='webhook_endpoints')
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64, default=generate_webhook_secret)
+    events = models.JSONField(default=list, blank=True)  # Empty means every event
+    is_active = models.BooleanField(default=True)
+    max_concurrency = models.PositiveSmallIntegerField(default=2)  # Parallel requests per worker process
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'is_active'], name='webhook_endpoint_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.url} ({self.customer.username})"
+
+    def wants(self, event_type):
+        return not self.events or event_type in self.events
+
+
+class WebhookDelivery(models.Model):
+    """One event waiting to be POSTed to a webhook endpoint"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('failed', 'Failed'),  # Gave up after WEBHOOKS["MAX_ATTEMPTS"]
+    ]
+
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE, related_name='deliveries')
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Batch query of the sender: an endpoint's pending events in id order
+            models.Index(fields=['endpoint', 'status', 'id'], name='webhook_delivery_batch_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.pk} ({self.status})"
+
+    @staticmethod
+    def order_event(order_id, customer_id, barcode, from_status, to_status):
+        return customer_id, 'order.status_changed', {
+            'order_id': order_id, 'barcode': barcode, 'from_status': from_status, 'status': to_status,
+        }
+
+    @staticmethod
+    def delivery_event(delivery_id, order_id, customer_id, barcode, from_status, to_status):
+        return customer_id, 'delivery.status_changed', {
+            'delivery_id': delivery_id, 'order_id': order_id, 'barcode': barcode,
+            'from_status': from_status, 'status': to_status,
+        }
+
+    @classmethod
+    def record(cls, events):
+        """
+        Queue ``(customer_id, event_type, data)`` events for the customers' active
+        endpoints and make sure each endpoint has one pending send job. Like
+        OutboxJob.enqueue() this must run in the transaction that made the change.
+        """
+        events = list(events)
+        if not events:
+            return []
+        endpoints = list(WebhookEndpoint.objects.filter(
+            customer_id__in={customer_id for customer_id, _, _ in events}, is_active=True
+        ).only('id', 'customer_id', 'events'))
+        if not endpoints:
+            return []
+
+        occurred_at = timezone.now().isoformat()
+        rows = [
+            cls(endpoint=endpoint, event_type=event_type,
+                payload={'type': event_type, 'occurred_at': occurred_at, 'data': data})
+            for customer_id, event_type, data in events
+            for endpoint in endpoints
+            if endpoint.customer_id == customer_id and endpoint.wants(event_type)
+        ]
+        cls.objects.bulk_create(rows)
+        OutboxJob.enqueue_once('send_webhooks', {
+            f'endpoint:{pk}': {'endpoint_id': pk} for pk in sorted({row.endpoint_id for row in rows})
+        })
+        return rows
+
+
+class ArchivedOrder(models.Model):
+    """Delivered or cancelled order moved out of the hot table (see courier.archive)"""
+    id = models.BigIntegerField(primary_key=True)  # Same id as the original Order
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    barcode = models.CharField(max_length=100, unique=True)
+    receiver_name = models.CharField(max_length=100)
+    receiver_address = models.TextField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Customer order history
+            models.Index(fields=['customer', '-created_at'], name='archived_order_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.barcode} ({self.status}, archived)"
+
+
+class ArchivedDelivery(models.Model):
+    """Delivery of an archived order"""
+    id = models.BigIntegerField(primary_key=True)  # Same id as the original Delivery
+    order = models.OneToOneField(ArchivedOrder, on_delete=models.CASCADE, related_name='delivery')
+    delivery_boy = models.ForeignKey(
+        DeliveryBoy, on_delete=models.SET_NULL, null=True, related_name='archived_deliveries'
+    )
+    assigned_at = models.DateTimeField()
+    picked_up_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Delivery.STATUS_CHOICES)
+    notes = models.TextField(blank=True)
+    rating = models.PositiveIntegerField(null=True, blank=True)
+    customer_feedback = models.TextField(blank=True)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived delivery {self.order_id} ({self.status})"
+
+
+class Rollup(models.Model):
+    """Counters keyed by KEY_FIELDS, changed only through increment()"""
+    KEY_FIELDS = ()
+    COUNTER_FIELDS = ()
+    INCREMENT_BATCH = 500
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def increment(cls, deltas):
+        """
+        Add ``{key: counter deltas}`` to the matching rows, creating missing
+        ones, with INSERT ... ON CONFLICT DO UPDATE (PostgreSQL and SQLite).
+        Keys are applied in sorted order so concurrent writers do not deadlock.
+        """
+        rows = [key + tuple(values) for key, values in sorted(deltas.items()) if any(values)]
+        if not rows:
+            return
+        quote = connection.ops.quote_name
+        table = quote(cls._meta.db_table)
+        fields = [cls._meta.get_field(name) for name in cls.KEY_FIELDS + cls.COUNTER_FIELDS]
+        keys = ', '.join(quote(field.column) for field in fields[:len(cls.KEY_FIELDS)])
+        counters = [quote(field.column) for field in fields[len(cls.KEY_FIELDS):]]
+        placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), cls.INCREMENT_BATCH):
+                batch = rows[start:start + cls.INCREMENT_BATCH]
+                cursor.execute(
+                    f"INSERT INTO {table} ({keys}, {', '.join(counters)}) "
+                    f"VALUES {', '.join([placeholder] * len(batch))} "
+                    f"ON CONFLICT ({keys}) DO UPDATE SET "
+                    + ', '.join(f"{column} = {table}.{column} + excluded.{column}" for column in counters),
+                    [
+                        field.get_db_prep_value(value, connection)
+                        for row in batch for field, value in zip(fields, row)
+                    ],
+                )
+
+
+class DailyOrderStats(Rollup):
+    """Orders created per day, by their current status and payment status (see courier.rollups)"""
+    KEY_FIELDS = ('day', 'status', 'payment_status')
+    COUNTER_FIELDS = ('orders', 'amount')
+
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'payment_status'], name='daily_order_stats_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.status}/{self.payment_status}: {self.orders}"
+
+    @staticmethod
+    def state(created_at, status, payment_status, amount):
+        return timezone.localdate(created_at), status, payment_status, Decimal(str(amount))
+
+    @staticmethod
+    def add_change(deltas, old, new):
+        """Accumulate one order moving from state ``old`` to ``new`` (None for none) into ``deltas``"""
+        for state, sign in ((old, -1), (new, 1)):
+            if state is not None:
+                *key, amount = state
+                orders, total = deltas.get(tuple(key), (0, Decimal('0')))
+                deltas[tuple(key)] = (orders + sign, total + sign * amount)
+        return deltas
+
+
+class DailyCourierStats(Rollup):
+    """Deliveries assigned to, delivered and failed by each courier per day (see courier.rollups)"""
+    KEY_FIELDS = ('day', 'delivery_boy')
+    COUNTER_FIELDS = ('assigned', 'delivered', 'failed')
+
+    day = models.DateField()
+    delivery_boy = models.ForeignKey(DeliveryBoy, on_delete=models.CASCADE, related_name='daily_stats')
+    assigned = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'delivery_boy'], name='daily_courier_stats_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} courier {self.delivery_boy_id}: {self.delivered}/{self.assigned}"
+
+    @classmethod
+    def add_events(cls, deltas, delivery_boy_id, statuses, day=None, count=1):
+        """Accumulate ``count`` deliveries of a courier reaching each of ``statuses`` into ``deltas``"""
+        key = (day or timezone.localdate(), delivery_boy_id)
+        for status in statuses:
+            if status in cls.COUNTER_FIELDS:
+                counters = list(deltas.get(key, (0,) * len(cls.COUNTER_FIELDS)))
+                counters[cls.COUNTER_FIELDS.index(status)] += count
+                deltas[key] = tuple(counters)
+        return deltas
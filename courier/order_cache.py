@@ -0,0 +1,96 @@
+"""
+Per-customer cache of the order list.
+
+A customer's order list only changes when one of their orders does, so the
+serialized list is cached under the customer's list version, a counter in the
+shared cache that every order create, transition, payment change and archival
+bumps with an atomic ``incr``. A bump makes the old page unreachable instead
+of deleting it; it simply ages out of the cache. The version doubles as the
+response's ``ETag``, so a client that already holds the current list gets a
+``304 Not Modified`` without its page being read at all.
+
+Versions are bumped twice: when the order is written, and again once its
+transaction commits. The second bump discards a page that a concurrent
+request built from the data before the commit. Readers read the version
+before the orders, so a page is never older than the version it is stored
+under. A version that was evicted restarts from the clock rather than from
+one, so it never matches a page cached before the eviction. Writes that
+bypass the model methods (raw queryset updates) are only picked up after
+TIMEOUT seconds.
+
+Versions must be shared by every process that serves the list, so the cache
+is only enabled by default with a shared cache (REDIS_URL): with per-process
+caches a bump in one worker is invisible to the others, which would keep
+serving the old page and answering 304 to its ETag.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import metrics
+
+
+DEFAULT_ORDER_LIST_CACHE = {
+    "ENABLED": False,
+    "TIMEOUT": 300,
+}
+
+
+def get_order_list_cache_settings():
+    return {**DEFAULT_ORDER_LIST_CACHE, **getattr(settings, "ORDER_LIST_CACHE", {})}
+
+
+def version_key(customer_id):
+    return f"courier:order-list-version:{customer_id}"
+
+
+def page_key(customer_id, version):
+    return f"courier:order-list:{customer_id}:{version}"
+
+
+def get_version(customer_id):
+    """Current list version of ``customer_id``, created on first use"""
+    key = version_key(customer_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def etag(customer_id, version):
+    # Weak: the JSON and browsable renderings of a version are different bytes
+    return f'W/"orders-{customer_id}-{version}"'
+
+
+def cached_list(customer_id, version, build):
+    """The list stored under ``version``, or ``build()`` stored there"""
+    config = get_order_list_cache_settings()
+    key = page_key(customer_id, version)
+    data = cache.get(key)
+    metrics.record_cache_lookup("order_list", data is not None)
+    if data is None:
+        data = build()
+        cache.set(key, data, config["TIMEOUT"])
+    return data
+
+
+def bump(customer_ids):
+    for customer_id in customer_ids:
+        key = version_key(customer_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def invalidate(customer_ids):
+    """Bump the list versions of ``customer_ids`` now and again after the current transaction commits"""
+    customer_ids = set(customer_ids)
+    if not customer_ids or not get_order_list_cache_settings()["ENABLED"]:
+        return
+    bump(customer_ids)
+    transaction.on_commit(lambda: bump(customer_ids))
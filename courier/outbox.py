@@ -0,0 +1,208 @@
+"""
+Transactional outbox processed by ``manage.py run_worker``.
+
+State changes record follow-up work with ``OutboxJob.enqueue()`` inside their
+own transaction, so a job exists exactly when the change was committed. The
+worker claims due jobs in batches (``FOR UPDATE SKIP LOCKED`` on PostgreSQL,
+so several workers never claim the same row), leases them for LEASE_SECONDS,
+runs them on a thread pool, deletes the ones that succeed and reschedules
+failures with exponential backoff. Jobs whose worker died are picked up again
+once their lease expires. An attempt is counted when a job is leased, not when
+it fails, so a job that keeps killing its worker gives up after MAX_ATTEMPTS
+like one that keeps raising. A handler that cannot start its work yet raises
+Deferred: the job goes back to pending without using up that attempt.
+``OutboxJob.enqueue_once()`` keeps at most one pending job per task and
+dedupe key.
+"""
+
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import OutboxJob
+
+
+logger = logging.getLogger("courier.outbox")
+
+DEFAULT_OUTBOX = {
+    "BATCH_SIZE": 50,
+    "THREADS": 4,
+    "POLL_INTERVAL": 1.0,
+    "LEASE_SECONDS": 300,
+    "MAX_ATTEMPTS": 8,
+    "BACKOFF_BASE": 2.0,
+    "BACKOFF_MAX": 3600,
+}
+
+TASKS = {}
+
+
+def get_outbox_settings():
+    return {**DEFAULT_OUTBOX, **getattr(settings, "OUTBOX", {})}
+
+
+class Deferred(Exception):
+    """Raised by a handler that could not start its work; the job runs again after ``delay`` seconds"""
+
+    def __init__(self, message, delay):
+        super().__init__(message)
+        self.delay = delay
+
+
+def task(name, atomic=True):
+    """
+    Register ``func(**payload)`` as the handler of jobs named ``name``.
+
+    Handlers run in one transaction unless ``atomic=False``, which is meant for
+    handlers that wait on the network and manage their own short transactions.
+    """
+
+    def register(func):
+        func.outbox_atomic = atomic
+        TASKS[name] = func
+        return func
+
+    return register
+
+
+def backoff_delay(attempts, config):
+    return min(config["BACKOFF_BASE"] ** attempts, config["BACKOFF_MAX"])
+
+
+def claim_jobs(config):
+    """Lease up to BATCH_SIZE due jobs to this worker, counting an attempt for each"""
+    now = timezone.now()
+    due = Q(status="pending", run_after__lte=now) | Q(status="running", locked_until__lt=now)
+    with transaction.atomic():
+        jobs = list(
+            OutboxJob.objects.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+            .filter(due)
+            .order_by("id")[:config["BATCH_SIZE"]]
+        )
+        # Expired leases whose worker died during the last allowed attempt
+        crashed = [job for job in jobs if job.status == "running" and job.attempts >= config["MAX_ATTEMPTS"]]
+        if crashed:
+            OutboxJob.objects.filter(pk__in=[job.pk for job in crashed]).update(
+                status="failed", locked_until=None, last_error="Lease expired: the worker running the job stopped",
+            )
+            jobs = [job for job in jobs if job not in crashed]
+        if jobs:
+            OutboxJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status="running",
+                attempts=F("attempts") + 1,
+                locked_until=now + timedelta(seconds=config["LEASE_SECONDS"]),
+            )
+    for job in crashed:
+        logger.error("outbox job %s (%s) gave up: its worker stopped on every attempt", job.pk, job.task)
+        metrics.outbox_jobs.inc(task=job.task, result="gave_up")
+    for job in jobs:
+        job.attempts += 1
+    return jobs
+
+
+def run_job(job):
+    """Run one job; returns None on success, the Deferred it raised, or the formatted error"""
+    try:
+        handler = TASKS.get(job.task)
+        if handler is None:
+            raise LookupError(f"Unknown outbox task {job.task!r}")
+        if getattr(handler, "outbox_atomic", True):
+            with transaction.atomic():
+                handler(**job.payload)
+        else:
+            handler(**job.payload)
+        return None
+    except Deferred as e:
+        logger.info("outbox job %s (%s) deferred: %s", job.pk, job.task, e)
+        return e
+    except Exception:
+        logger.exception("outbox job %s (%s) failed", job.pk, job.task)
+        return traceback.format_exc()
+
+
+def run_job_in_thread(job):
+    # Pool threads keep their own connection, subject to CONN_MAX_AGE like request threads
+    close_old_connections()
+    try:
+        return run_job(job)
+    finally:
+        close_old_connections()
+
+
+def finish_jobs(jobs, errors, config):
+    """Delete succeeded jobs and reschedule or give up on failed ones"""
+    succeeded = [job.pk for job, error in zip(jobs, errors) if error is None]
+    if succeeded:
+        OutboxJob.objects.filter(pk__in=succeeded).delete()
+
+    now = timezone.now()
+    for job, error in zip(jobs, errors):
+        if isinstance(error, Deferred):
+            metrics.outbox_jobs.inc(task=job.task, result="deferred")
+            # The job never ran, so the attempt counted by its claim is handed back
+            reschedule(job, status="pending", attempts=job.attempts - 1,
+                       run_after=now + timedelta(seconds=error.delay), locked_until=None)
+            continue
+        metrics.outbox_jobs.inc(task=job.task, result="success" if error is None else "error")
+        if error is None:
+            continue
+        attempts = job.attempts  # Counted when the job was claimed
+        gave_up = attempts >= config["MAX_ATTEMPTS"]
+        reschedule(
+            job,
+            status="failed" if gave_up else "pending",
+            attempts=attempts,
+            run_after=now + timedelta(seconds=backoff_delay(attempts, config)),
+            locked_until=None,
+            last_error=error[-4000:],
+        )
+        if gave_up:
+            metrics.outbox_jobs.inc(task=job.task, result="gave_up")
+
+
+def reschedule(job, **fields):
+    try:
+        with transaction.atomic():
+            OutboxJob.objects.filter(pk=job.pk).update(**fields)
+    except IntegrityError:
+        # A pending job with the same dedupe key was enqueued meanwhile and will redo the work
+        OutboxJob.objects.filter(pk=job.pk).delete()
+
+
+def process_batch(executor=None, config=None):
+    """Claim and run one batch; returns the number of jobs processed"""
+    config = config or get_outbox_settings()
+    jobs = claim_jobs(config)
+    if not jobs:
+        return 0
+    if executor is None:
+        errors = [run_job(job) for job in jobs]
+    else:
+        errors = list(executor.map(run_job_in_thread, jobs))
+    finish_jobs(jobs, errors, config)
+    return len(jobs)
+
+
+def drain(executor=None, config=None):
+    """Run every due job, in the current thread unless an executor is given (used by tests and ``run_worker --once``)"""
+    processed = 0
+    while True:
+        count = process_batch(executor, config)
+        if not count:
+            return processed
+        processed += count
+
+
+def make_executor(config):
+    """Thread pool for ``process_batch``; a single thread runs the jobs inline, on the caller's connection"""
+    if config["THREADS"] <= 1:
+        return nullcontext()
+    return ThreadPoolExecutor(max_workers=config["THREADS"], thread_name_prefix="courier-outbox")
@@ -0,0 +1,245 @@
+"""
+Pagination for the custom admin list views that stays fast on very large tables.
+
+Counts come from the PostgreSQL planner statistics (``pg_class.reltuples``)
+for unfiltered lists and from a short-lived cache otherwise, so no page pays
+for an exact ``COUNT(*)`` over a joined queryset. In ``seek`` mode pages are
+addressed by an opaque cursor holding the ordering key of the first/last row
+instead of an OFFSET, so page 5000 costs the same as page 1.
+"""
+
+import base64
+import hashlib
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from functools import cached_property, reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import DateField, DateTimeField, DecimalField, Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+DEFAULT_ADMIN_PAGINATION = {
+    "MODE": "seek",
+    "PER_PAGE": 20,
+    "COUNT_CACHE_TIMEOUT": 60,
+    "ESTIMATE_THRESHOLD": 100000,
+}
+
+
+def get_pagination_settings():
+    return {**DEFAULT_ADMIN_PAGINATION, **getattr(settings, "ADMIN_PAGINATION", {})}
+
+
+def estimated_count(queryset):
+    """
+    Row count for display, as ``(count, is_estimate)``.
+
+    Unfiltered querysets on PostgreSQL use the planner's row estimate once the
+    table is large enough for the exact count to matter; everything else is
+    counted exactly and cached for COUNT_CACHE_TIMEOUT seconds.
+    """
+    config = get_pagination_settings()
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql" and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= config["ESTIMATE_THRESHOLD"]:
+            return row[0], True
+
+    count_query = queryset.order_by().select_related(None)
+    sql, params = count_query.query.sql_with_params()
+    key = "admin-count:" + hashlib.md5(f"{queryset.db}:{sql}:{params!r}".encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = count_query.count()
+        cache.set(key, count, config["COUNT_CACHE_TIMEOUT"])
+        return count, False
+    return count, True
+
+
+class EstimatedCountMixin:
+    """``count`` and ``count_is_estimate`` from estimated_count(), computed once"""
+
+    @cached_property
+    def count_info(self):
+        return estimated_count(self.count_queryset())
+
+    @property
+    def count(self):
+        return self.count_info[0]
+
+    @property
+    def count_is_estimate(self):
+        return self.count_info[1]
+
+
+class EstimatedCountPaginator(EstimatedCountMixin, Paginator):
+    """Django's Paginator (OFFSET based) with an estimated or cached count"""
+
+    def count_queryset(self):
+        return self.object_list
+
+    def page_window(self, number, on_each_side=2):
+        """Page numbers around ``number``, without materialising the full page_range"""
+        return range(max(1, number - on_each_side), min(self.num_pages, number + on_each_side) + 1)
+
+
+class SeekPage:
+    """One page of a SeekPaginator; iterates over its objects like a Django Page"""
+
+    is_seek = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def next_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[-1]) if self.has_next_page else None
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[0]) if self.has_previous_page else None
+
+
+class SeekPaginator(EstimatedCountMixin):
+    """
+    Keyset pagination over ``ordering``, which must end in a unique field.
+
+    ``get_page(after=cursor)`` returns the rows following the cursor and
+    ``get_page(before=cursor)`` the rows preceding it.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = [
+            (name.lstrip("-"), name.startswith("-")) for name in ordering
+        ]
+
+    def count_queryset(self):
+        return self.queryset
+
+    def encode_cursor(self, obj):
+        return self.encode_values([getattr(obj, name) for name, _ in self.ordering])
+
+    def encode_values(self, values):
+        values = [serialize(value) for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        """Ordering values stored in a cursor, or None if it is malformed"""
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            return None
+        fields = [self.queryset.model._meta.get_field(name) for name, _ in self.ordering]
+        try:
+            return [deserialize(field, value) for field, value in zip(fields, values)]
+        except (ValueError, TypeError, ArithmeticError):
+            return None
+
+    def seek_filter(self, values, forward):
+        """Rows strictly after (forward) or before the given ordering values"""
+        clauses = []
+        for index, (name, descending) in enumerate(self.ordering):
+            lookup = "lt" if descending == forward else "gt"
+            equal = [Q(**{prev: value}) for (prev, _), value in zip(self.ordering[:index], values)]
+            clauses.append(reduce(and_, equal + [Q(**{f"{name}__{lookup}": values[index]})]))
+        return reduce(or_, clauses)
+
+    def order_by(self, forward):
+        return [
+            f"-{name}" if descending == forward else name for name, descending in self.ordering
+        ]
+
+    def get_page(self, after=None, before=None):
+        cursor_values = self.decode_cursor(after or before) if (after or before) else None
+        forward = not (before and cursor_values is not None)
+        queryset = self.queryset.order_by(*self.order_by(forward))
+        if cursor_values is not None:
+            queryset = queryset.filter(self.seek_filter(cursor_values, forward))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            return SeekPage(rows, self, has_next=has_more, has_previous=cursor_values is not None)
+        rows.reverse()
+        return SeekPage(rows, self, has_next=True, has_previous=has_more)
+
+
+def serialize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def deserialize(field, value):
+    if value is None:
+        return None
+    if isinstance(field, DateTimeField):
+        parsed = parse_datetime(value)
+    elif isinstance(field, DateField):
+        parsed = parse_date(value)
+    elif isinstance(field, DecimalField):
+        parsed = Decimal(value)
+    else:
+        return field.to_python(value)
+    if parsed is None:
+        raise ValueError(f"Invalid cursor value {value!r}")
+    return parsed
+
+
+def paginate(request, queryset, ordering):
+    """
+    Paginate an admin list according to ADMIN_PAGINATION["MODE"].
+
+    Returns a page object plus the current filters as a query string for the
+    pagination links (without page/cursor parameters).
+    """
+    config = get_pagination_settings()
+    params = request.GET.copy()
+    for name in ("page", "after", "before"):
+        params.pop(name, None)
+
+    if config["MODE"] == "seek":
+        paginator = SeekPaginator(queryset, config["PER_PAGE"], ordering)
+        page = paginator.get_page(after=request.GET.get("after"), before=request.GET.get("before"))
+    else:
+        paginator = EstimatedCountPaginator(queryset.order_by(*ordering), config["PER_PAGE"])
+        page = paginator.get_page(request.GET.get("page"))
+        page.page_window = paginator.page_window(page.number)
+    return page, params.urlencode()
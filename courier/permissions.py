@@ -0,0 +1,17 @@
+from rest_framework.permissions import BasePermission
+
+from .roles import get_role
+
+
+class IsAdminRole(BasePermission):
+    """Users whose profile role is admin"""
+
+    def has_permission(self, request, view):
+        return get_role(request) == "admin"
+
+
+class IsDeliveryBoyRole(BasePermission):
+    """Users whose profile role is delivery_boy"""
+
+    def has_permission(self, request, view):
+        return get_role(request) == "delivery_boy"
@@ -0,0 +1,227 @@
+"""
+On-demand request profiling.
+
+A request is profiled when an admin adds ``?__profile=1``, when it carries a
+valid signed ``X-Courier-Profile`` header (usable from API clients that are
+not logged into the admin; it is bound to the admin who issued it and stops
+working once they lose the role), or when it is picked by the global sample
+rate.
+The sampling profiler writes collapsed stacks (``.folded``) that flamegraph.pl
+and speedscope read directly; the ``cprofile`` mode writes pstats files.
+"""
+
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+
+
+logger = logging.getLogger("courier.profiling")
+
+DEFAULT_PROFILING = {
+    "ENABLED": False,
+    "DIRECTORY": os.path.join(tempfile.gettempdir(), "courier-profiles"),
+    "MODE": "sampling",
+    "SAMPLE_INTERVAL": 0.001,
+    "SAMPLE_RATE": 0.0,
+    "TOKEN_MAX_AGE": 3600,
+    "KEEP": 200,
+}
+
+PROFILE_QUERY_FLAG = "__profile"
+PROFILE_HEADER = "X-Courier-Profile"
+TOKEN_SALT = "courier.profiling"
+
+PROFILE_NAME = re.compile(r"^[\w.-]+\.(folded|prof)$")
+
+# cProfile hooks the whole interpreter (sys.monitoring on 3.12+), so only one
+# session can run per process; concurrent profiled requests skip profiling
+_cprofile_lock = threading.Lock()
+
+
+def get_profiling_settings():
+    return {**DEFAULT_PROFILING, **getattr(settings, "PROFILING", {})}
+
+
+def make_profile_token(user):
+    """Signed value for the X-Courier-Profile header of ``user``, valid for TOKEN_MAX_AGE seconds"""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(str(user.pk))
+
+
+def profile_token_user_id(token):
+    """Id of the user a valid token was issued to, or None"""
+    try:
+        value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=get_profiling_settings()["TOKEN_MAX_AGE"]
+        )
+    except signing.BadSignature:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def valid_profile_token(token, request, is_admin):
+    """The token's user must still be an admin, and be the one logged in if anyone is"""
+    user_id = profile_token_user_id(token)
+    if user_id is None:
+        return False
+    if request.user.is_authenticated:
+        return request.user.pk == user_id and is_admin(request.user)
+    user = User.objects.filter(pk=user_id, is_active=True).select_related("profile").first()
+    return user is not None and is_admin(user)
+
+
+class SamplingProfiler:
+    """Sample the stack of one thread from a background thread"""
+
+    extension = "folded"
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="courier-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as fh:
+            for stack, count in self.samples.most_common():
+                fh.write(f"{stack} {count}\n")
+
+
+class CProfileProfiler:
+    """Deterministic profile of every call, written as a pstats file"""
+
+    extension = "prof"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        """Begin profiling; False when another cProfile session (or profiling tool) is active"""
+        if not _cprofile_lock.acquire(blocking=False):
+            return False
+        try:
+            self.profile.enable()
+        except ValueError:  # Another tool holds the profiler hook
+            _cprofile_lock.release()
+            return False
+        return True
+
+    def stop(self):
+        try:
+            self.profile.disable()
+        finally:
+            _cprofile_lock.release()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+def create_profiler(config):
+    if config["MODE"] == "cprofile":
+        return CProfileProfiler()
+    return SamplingProfiler(config["SAMPLE_INTERVAL"])
+
+
+def profile_filename(request, elapsed_ms, extension):
+    path = re.sub(r"[^\w-]+", "_", request.path.strip("/")) or "root"
+    return f"{datetime.now():%Y%m%dT%H%M%S%f}-{request.method}-{path[:60]}-{elapsed_ms:.0f}ms.{extension}"
+
+
+def save_profile(profiler, request, elapsed_ms, directory):
+    os.makedirs(directory, exist_ok=True)
+    name = profile_filename(request, elapsed_ms, profiler.extension)
+    profiler.write(os.path.join(directory, name))
+    prune_profiles(directory, get_profiling_settings()["KEEP"])
+    return name
+
+
+def prune_profiles(directory, keep):
+    profiles = sorted(stat_profiles(directory), key=lambda item: item[1].st_mtime, reverse=True)
+    for path, _ in profiles[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def list_profile_paths(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, name) for name in os.listdir(directory) if PROFILE_NAME.match(name)
+    ]
+
+
+def stat_profiles(directory):
+    """(path, stat) of each stored profile, skipping files another process pruned since the listing"""
+    profiles = []
+    for path in list_profile_paths(directory):
+        try:
+            profiles.append((path, os.stat(path)))
+        except FileNotFoundError:
+            pass
+    return profiles
+
+
+def recent_profiles(limit=50):
+    """Newest profiles first, as dicts for the admin listing"""
+    directory = get_profiling_settings()["DIRECTORY"]
+    profiles = [
+        {
+            "name": os.path.basename(path),
+            "size": stat.st_size,
+            "created_at": datetime.fromtimestamp(stat.st_mtime),
+        }
+        for path, stat in stat_profiles(directory)
+    ]
+    profiles.sort(key=lambda profile: profile["created_at"], reverse=True)
+    return profiles[:limit]
+
+
+def profile_path(name):
+    """Absolute path of a stored profile, or None for unknown or unsafe names"""
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(get_profiling_settings()["DIRECTORY"], name)
+    return path if os.path.isfile(path) else None
+
+
+def should_profile(request, config, is_admin):
+    token = request.headers.get(PROFILE_HEADER)
+    if token and valid_profile_token(token, request, is_admin):
+        return True
+    if request.GET.get(PROFILE_QUERY_FLAG) and is_admin(request.user):
+        return True
+    return bool(config["SAMPLE_RATE"]) and random.random() < config["SAMPLE_RATE"]
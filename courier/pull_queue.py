@@ -0,0 +1,123 @@
+"""
+Pull queue of pending orders for couriers that assign themselves.
+
+A courier claims up to MAX_CLAIMS of the oldest pending, unassigned orders.
+A claim is a lease: the order stays pending and is reserved for that courier
+for LEASE_SECONDS, during which the courier either takes it (which assigns it
+exactly like the admin does) or releases it. An order whose lease ran out is
+claimable again, so orders held by a courier that went offline return to the
+queue without any cleanup job.
+
+On PostgreSQL the candidates are selected ``FOR UPDATE SKIP LOCKED``, so
+couriers claiming at the same time get different orders instead of waiting
+for each other's rows. SQLite has no row locks; there the claim is a single
+UPDATE guarded by the same conditions as the selection, run outside a
+transaction (a transaction that reads and then writes fails rather than waits
+when two claimers collide there), and an order taken by a concurrent claimer
+in between is simply not part of the result.
+"""
+
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import bulk, metrics
+from .models import Order
+
+
+DEFAULT_COURIER_QUEUE = {
+    "LEASE_SECONDS": 120,
+    "MAX_CLAIMS": 10,
+}
+
+
+def get_courier_queue_settings():
+    return {**DEFAULT_COURIER_QUEUE, **getattr(settings, "COURIER_QUEUE", {})}
+
+
+def claimable(now):
+    """Pending orders without a delivery that nobody holds a live lease on"""
+    return Order.objects.filter(
+        Q(claimed_by__isnull=True) | Q(claim_expires_at__lte=now),
+        status="pending", delivery__isnull=True,
+    )
+
+
+def held_claims(delivery_boy, now):
+    return Order.objects.filter(claimed_by=delivery_boy, claim_expires_at__gt=now, status="pending")
+
+
+def candidates(now, count):
+    """Oldest claimable orders as (pk, previous holder); locked, skipping rows other claimers hold"""
+    return list(
+        claimable(now)
+        .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked, of=("self",))
+        .order_by("created_at", "id")
+        .values_list("pk", "claimed_by_id")[:count]
+    )
+
+
+def claim(delivery_boy, count, config=None):
+    """
+    Top the courier's live claims up to ``count`` orders (at most MAX_CLAIMS)
+    and return all of them, oldest first. Retrying a claim therefore never
+    reserves more orders than asked for.
+    """
+    config = config or get_courier_queue_settings()
+    now = timezone.now()
+    expires = now + timedelta(seconds=config["LEASE_SECONDS"])
+    atomic = transaction.atomic() if connection.features.has_select_for_update else nullcontext()
+    with atomic:
+        wanted = min(count, config["MAX_CLAIMS"]) - held_claims(delivery_boy, now).count()
+        rows = candidates(now, wanted) if wanted > 0 else []
+        if rows:
+            claimed = requeued = 0
+            # Orders whose previous claim expired get their own UPDATE, so only those updated count as requeued
+            for expired in (False, True):
+                pks = [pk for pk, holder in rows if (holder is not None) is expired]
+                if pks:
+                    updated = claimable(now).filter(pk__in=pks).update(
+                        claimed_by=delivery_boy, claim_expires_at=expires,
+                    )
+                    claimed += updated
+                    requeued += updated if expired else 0
+            metrics.queue_claims.inc(claimed, result="claimed")
+            if requeued:
+                metrics.queue_claims.inc(requeued, result="requeued")
+    return list(held_claims(delivery_boy, now).order_by("created_at", "id"))
+
+
+def take(delivery_boy, order_ids):
+    """Assign the orders the courier holds a live claim on to it; returns the BulkResult"""
+    with transaction.atomic():
+        held = set(
+            held_claims(delivery_boy, timezone.now())
+            .select_for_update(of=("self",))
+            .filter(pk__in=order_ids)
+            .values_list("pk", flat=True)
+        )
+        result = bulk.BulkResult()
+        if held:
+            result = bulk.assign_orders([pk for pk in order_ids if pk in held], delivery_boy)
+        if result.updated:
+            Order.objects.filter(pk__in=result.updated).update(claimed_by=None, claim_expires_at=None)
+    for pk in order_ids:
+        if pk not in held:
+            result.skipped[pk] = "not claimed"
+    if result.updated:
+        metrics.queue_claims.inc(len(result.updated), result="taken")
+    return result
+
+
+def release(delivery_boy, order_ids):
+    """Give claimed orders back to the queue; returns how many were released"""
+    released = Order.objects.filter(pk__in=order_ids, claimed_by=delivery_boy, status="pending").update(
+        claimed_by=None, claim_expires_at=None,
+    )
+    if released:
+        metrics.queue_claims.inc(released, result="released")
+    return released
@@ -0,0 +1,77 @@
+"""
+Per-session cache of the logged-in user's role.
+
+The admin views only need ``profile.role``, so it is kept in the session next
+to the auth data instead of being fetched with an extra query on every
+request. Each user has a role version in the shared cache which is bumped
+whenever their profile is saved through the admin forms; a session whose
+stored version no longer matches reloads the role. Entries also expire after
+ROLE_CACHE["TIMEOUT"] seconds, which bounds staleness when the cache is
+process-local.
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+
+from . import metrics
+from .models import UserProfile
+
+
+DEFAULT_ROLE_CACHE = {
+    "ENABLED": True,
+    "TIMEOUT": 300,
+}
+
+ROLE_SESSION_KEY = "_courier_role"
+
+
+def get_role_cache_settings():
+    return {**DEFAULT_ROLE_CACHE, **getattr(settings, "ROLE_CACHE", {})}
+
+
+def role_version_key(user_id):
+    return f"courier:role-version:{user_id}"
+
+
+def get_role(request):
+    """Role of ``request.user`` ("admin", "customer", ...), or None without a profile"""
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    config = get_role_cache_settings()
+    # Token-authenticated API requests have no login session to keep the role in
+    if not config["ENABLED"] or request.session.get(SESSION_KEY) != str(user.pk):
+        return UserProfile.objects.filter(user=user).values_list("role", flat=True).first()
+
+    version = cache.get(role_version_key(user.pk), 0)
+    cached = request.session.get(ROLE_SESSION_KEY)
+    if (
+        cached
+        and cached["user"] == user.pk
+        and cached["version"] == version
+        and cached["expires"] > time.time()
+    ):
+        metrics.record_cache_lookup("session_role", True)
+        return cached["role"]
+
+    metrics.record_cache_lookup("session_role", False)
+    role = UserProfile.objects.filter(user=user).values_list("role", flat=True).first()
+    request.session[ROLE_SESSION_KEY] = {
+        "user": user.pk,
+        "role": role,
+        "version": version,
+        "expires": time.time() + config["TIMEOUT"],
+    }
+    return role
+
+
+def invalidate_role(user):
+    """Make every session of ``user`` reload its role on the next request"""
+    key = role_version_key(user.pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
@@ -0,0 +1,151 @@
+"""
+Pre-aggregated reporting tables.
+
+DailyOrderStats counts the orders created each day by their current status
+and payment status, with their summed amount; DailyCourierStats counts the
+deliveries each courier was assigned, delivered and failed per day. Both are
+kept current by the writes that change orders and deliveries (Order.save,
+Delivery.save and the set-based actions in courier.bulk) with one upsert per
+write, so reports never aggregate the order tables. ``rebuild()`` (and
+``manage.py rebuild_rollups``) recomputes any date range from the hot and
+archived tables, e.g. after a bulk import or to backfill history.
+"""
+
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import (
+    ArchivedDelivery, ArchivedOrder, DailyCourierStats, DailyOrderStats, Delivery, Order,
+)
+
+
+MAX_REPORT_DAYS = 5 * 366
+
+
+def day_bounds(start, end):
+    """Aware datetimes covering the local days ``start`` to ``end`` inclusive"""
+    return (
+        timezone.make_aware(datetime.combine(start, time.min)),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+
+
+def rebuild(start, end):
+    """Recompute both rollups for the days ``start`` to ``end`` inclusive"""
+    lower, upper = day_bounds(start, end)
+    order_deltas = {}
+    for model in (Order, ArchivedOrder):
+        rows = (
+            model.objects.filter(created_at__gte=lower, created_at__lt=upper)
+            .annotate(day=TruncDate("created_at"))
+            .values("day", "status", "payment_status")
+            .annotate(count=Count("pk"), total=Sum("amount"))
+            .order_by()
+        )
+        for row in rows:
+            key = (row["day"], row["status"], row["payment_status"])
+            orders, amount = order_deltas.get(key, (0, Decimal("0")))
+            order_deltas[key] = (orders + row["count"], amount + row["total"])
+
+    courier_deltas = {}
+    for model in (Delivery, ArchivedDelivery):
+        deliveries = model.objects.filter(delivery_boy__isnull=False)
+        # Deliveries that failed before failed_at existed fall back to their last update
+        for status, timestamp, extra in (
+            ("assigned", F("assigned_at"), Q()),
+            ("delivered", F("delivered_at"), Q(status="delivered")),
+            ("failed", Coalesce("failed_at", "updated_at"), Q(status="failed")),
+        ):
+            rows = (
+                deliveries.filter(extra)
+                .alias(at=timestamp)
+                .filter(at__gte=lower, at__lt=upper)
+                .annotate(day=TruncDate("at"))
+                .values("day", "delivery_boy")
+                .annotate(count=Count("pk"))
+                .order_by()
+            )
+            for row in rows:
+                DailyCourierStats.add_events(
+                    courier_deltas, row["delivery_boy"], [status], day=row["day"], count=row["count"]
+                )
+
+    with transaction.atomic():
+        DailyOrderStats.objects.filter(day__range=(start, end)).delete()
+        DailyCourierStats.objects.filter(day__range=(start, end)).delete()
+        DailyOrderStats.increment(order_deltas)
+        DailyCourierStats.increment(courier_deltas)
+    return len(order_deltas), len(courier_deltas)
+
+
+def success_rate(delivered, failed):
+    return round(delivered / (delivered + failed), 4) if delivered + failed else None
+
+
+def daily_report(start, end):
+    """One entry per day from ``start`` to ``end``, read from the rollups only"""
+    days = {}
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        days[day] = {
+            "day": day, "orders": 0, "amount": Decimal("0"), "revenue": Decimal("0"), "by_status": {},
+            "deliveries": {"assigned": 0, "delivered": 0, "failed": 0},
+        }
+
+    for row in DailyOrderStats.objects.filter(day__range=(start, end)).values(
+        "day", "status", "payment_status", "orders", "amount"
+    ):
+        entry = days[row["day"]]
+        entry["orders"] += row["orders"]
+        entry["amount"] += row["amount"]
+        if row["payment_status"] == "paid":
+            entry["revenue"] += row["amount"]
+        entry["by_status"][row["status"]] = entry["by_status"].get(row["status"], 0) + row["orders"]
+
+    for row in (
+        DailyCourierStats.objects.filter(day__range=(start, end))
+        .values("day")
+        .annotate(assigned=Sum("assigned"), delivered=Sum("delivered"), failed=Sum("failed"))
+        .order_by()
+    ):
+        days[row["day"]]["deliveries"] = {name: row[name] for name in DailyCourierStats.COUNTER_FIELDS}
+
+    for entry in days.values():
+        entry["deliveries"]["success_rate"] = success_rate(
+            entry["deliveries"]["delivered"], entry["deliveries"]["failed"]
+        )
+    return list(days.values())
+
+
+def courier_report(start, end):
+    """Totals per courier over ``start`` to ``end``, busiest first"""
+    rows = (
+        DailyCourierStats.objects.filter(day__range=(start, end))
+        .values("delivery_boy", "delivery_boy__user__username")
+        .annotate(assigned=Sum("assigned"), delivered=Sum("delivered"), failed=Sum("failed"))
+        .order_by("-delivered", "delivery_boy")
+    )
+    return [
+        {
+            "delivery_boy_id": row["delivery_boy"],
+            "username": row["delivery_boy__user__username"],
+            "assigned": row["assigned"],
+            "delivered": row["delivered"],
+            "failed": row["failed"],
+            "success_rate": success_rate(row["delivered"], row["failed"]),
+        }
+        for row in rows
+    ]
+
+
+def order_totals():
+    """All-time order count and delivered count, for the dashboard"""
+    return DailyOrderStats.objects.aggregate(
+        total=Sum("orders", default=0),
+        delivered=Sum("orders", filter=Q(status="delivered"), default=0),
+    )
@@ -0,0 +1,83 @@
+"""Periodic jobs run by ``manage.py run_scheduler`` (see courier.scheduler)"""
+
+import logging
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.utils import timezone
+
+from .archive import archive_orders
+from .barcode_filter import get_barcode_filter_settings, rebuild as rebuild_barcode_filter
+from .bulk import refresh_courier_stats
+from .idempotency import purge_expired
+from .models import Delivery, DeliveryBoy
+from .rollups import rebuild as rebuild_rollups
+from .scheduler import get_scheduler_settings, job
+from .sync import purge_tombstones
+
+
+logger = logging.getLogger("courier.scheduler")
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+
+
+@job("purge_idempotency_keys", every=HOUR)
+def purge_idempotency_keys_job():
+    return purge_expired()
+
+
+@job("detect_stuck_deliveries", every=5 * MINUTE)
+def detect_stuck_deliveries_job():
+    """Warn about deliveries still waiting to be picked up STUCK_DELIVERY_MINUTES after assignment"""
+    minutes = get_scheduler_settings()["STUCK_DELIVERY_MINUTES"]
+    stuck = Delivery.objects.filter(status="assigned", assigned_at__lt=timezone.now() - timedelta(minutes=minutes))
+    count = stuck.count()
+    if count:
+        oldest = list(stuck.order_by("assigned_at", "id").values_list("pk", flat=True)[:20])
+        logger.warning("%d deliveries assigned for over %d minutes, oldest: %s", count, minutes, oldest)
+    return count
+
+
+@job("archive_orders", every=15 * MINUTE, off_peak=True, lease=HOUR)
+def archive_orders_job():
+    # A bounded number of batches per run; the next runs of the window continue
+    return archive_orders(max_batches=get_scheduler_settings()["ARCHIVE_MAX_BATCHES"])
+
+
+@job("reconcile_courier_stats", every=DAY, off_peak=True, lease=HOUR)
+def reconcile_courier_stats_job():
+    """Recompute every courier's delivery total and rating, a batch of couriers per UPDATE"""
+    batch_size = get_scheduler_settings()["RECONCILE_BATCH_SIZE"]
+    last = reconciled = 0
+    while True:
+        ids = list(DeliveryBoy.objects.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return reconciled
+        refresh_courier_stats(ids)
+        reconciled += len(ids)
+        last = ids[-1]
+
+
+@job("rebuild_rollups", every=DAY, off_peak=True, lease=HOUR)
+def rebuild_rollups_job():
+    """Recompute the reporting rollups of the last ROLLUP_DAYS days, catching writes that bypassed the models"""
+    today = timezone.localdate()
+    rebuild_rollups(today - timedelta(days=get_scheduler_settings()["ROLLUP_DAYS"] - 1), today)
+
+
+@job("rebuild_barcode_filter", every=get_barcode_filter_settings()["REBUILD_INTERVAL"], lease=HOUR)
+def rebuild_barcode_filter_job():
+    """Publish a fresh tracking barcode filter snapshot; web processes only load it (see courier/barcode_filter.py)"""
+    if get_barcode_filter_settings()["ENABLED"]:
+        return rebuild_barcode_filter().count
+
+
+@job("purge_delivery_tombstones", every=DAY, off_peak=True, lease=HOUR)
+def purge_delivery_tombstones_job():
+    return purge_tombstones()
+
+
+@job("clear_expired_sessions", every=DAY, off_peak=True, lease=HOUR)
+def clear_expired_sessions_job():
+    import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
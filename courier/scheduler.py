@@ -0,0 +1,199 @@
+"""
+Periodic maintenance jobs run by ``manage.py run_scheduler``.
+
+Jobs are declared with the ``@job`` decorator (see courier/scheduled_jobs.py)
+and each has a ScheduledJob row holding its next run time and a lease. Every
+scheduler replica polls the due jobs and tries to take each one with a single
+guarded UPDATE (due, and not leased or the lease expired); the replica whose
+UPDATE matched the row is the leader for that run and the others skip it, so
+a job runs on exactly one replica however many are started. A replica that
+dies mid-run leaves the lease behind, and the job is taken over once it
+expires, so the lease of a job must exceed its longest run.
+
+The next run is scheduled when a run ends, ``every`` seconds later give or
+take JITTER (a fraction of the interval), so replicas and jobs do not fire in
+lockstep. Jobs marked ``off_peak`` only start between OFF_PEAK_START and
+OFF_PEAK_END (local hours); one that comes due outside that window is moved
+to a random point early in the next window. Heavy jobs work in batches with
+a bounded amount of work per run and rely on their interval to finish.
+"""
+
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .models import ScheduledJob
+
+
+logger = logging.getLogger("courier.scheduler")
+
+DEFAULT_SCHEDULER = {
+    "POLL_INTERVAL": 5.0,
+    "JITTER": 0.1,
+    "OFF_PEAK_START": 1,
+    "OFF_PEAK_END": 5,
+    "DISABLED_JOBS": [],
+    "INTERVALS": {},
+    "STUCK_DELIVERY_MINUTES": 120,
+    "ARCHIVE_MAX_BATCHES": 20,
+    "RECONCILE_BATCH_SIZE": 500,
+    "ROLLUP_DAYS": 2,
+}
+
+JOBS = {}
+
+
+def get_scheduler_settings():
+    return {**DEFAULT_SCHEDULER, **getattr(settings, "SCHEDULER", {})}
+
+
+class Job:
+    def __init__(self, name, func, every, off_peak, lease):
+        self.name = name
+        self.func = func
+        self.every = every
+        self.off_peak = off_peak
+        self.lease = lease
+
+
+def job(name, every, off_peak=False, lease=600):
+    """
+    Register ``func()`` to run every ``every`` seconds on one scheduler replica.
+
+    ``lease`` is how long, in seconds, a run may take before another replica
+    assumes its scheduler died and runs the job again. ``func`` may return a
+    number of items handled, which is logged and kept as the job's last result.
+    """
+
+    def register(func):
+        JOBS[name] = Job(name, func, every, off_peak, lease)
+        return func
+
+    return register
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enabled_jobs(config):
+    return [job for name, job in sorted(JOBS.items()) if name not in config["DISABLED_JOBS"]]
+
+
+def interval(job, config):
+    return config["INTERVALS"].get(job.name, job.every)
+
+
+def in_off_peak(moment, config):
+    start, end = config["OFF_PEAK_START"], config["OFF_PEAK_END"]
+    hour = timezone.localtime(moment).hour
+    if start == end:
+        return True  # No window configured
+    return start <= hour < end if start < end else hour >= start or hour < end
+
+
+def off_peak_start(moment, config):
+    """First start of the off-peak window after ``moment``"""
+    local = timezone.localtime(moment)
+    start = local.replace(hour=config["OFF_PEAK_START"], minute=0, second=0, microsecond=0)
+    return start if start > local else start + timedelta(days=1)
+
+
+def in_next_window(after, config, rng=random):
+    """Random time early in the first off-peak window after ``after``"""
+    window = (config["OFF_PEAK_END"] - config["OFF_PEAK_START"]) % 24 * 3600
+    return off_peak_start(after, config) + timedelta(seconds=rng.uniform(0, window * config["JITTER"]))
+
+
+def next_run(job, after, config, rng=random):
+    """Jittered next run time of ``job`` after ``after``, moved into an off-peak window if it needs one"""
+    every = interval(job, config)
+    at = after + timedelta(seconds=every * (1 + rng.uniform(-config["JITTER"], config["JITTER"])))
+    if job.off_peak and not in_off_peak(at, config):
+        # The window on the day the run falls due, so a daily job does not slip a day
+        at = in_next_window(max(after, at - timedelta(days=1)), config, rng)
+    return at
+
+
+def ensure_jobs(config=None, rng=random):
+    """Create the rows of registered jobs that have none yet, first runs spread over a fraction of their interval"""
+    config = config or get_scheduler_settings()
+    now = timezone.now()
+    rows = []
+    for job in enabled_jobs(config):
+        first = now + timedelta(seconds=rng.uniform(0, interval(job, config) * config["JITTER"]))
+        if job.off_peak and not in_off_peak(first, config):
+            first = in_next_window(now, config, rng)
+        rows.append(ScheduledJob(name=job.name, next_run_at=first))
+    ScheduledJob.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def acquire(job, worker, now, force=False):
+    """Lease ``job`` to ``worker`` if it is due (or ``force``) and no live lease exists; True if this worker won"""
+    due = Q() if force else Q(next_run_at__lte=now)
+    return ScheduledJob.objects.filter(
+        due, Q(locked_until__isnull=True) | Q(locked_until__lte=now), name=job.name,
+    ).update(locked_by=worker, locked_until=now + timedelta(seconds=job.lease), last_started_at=now) == 1
+
+
+def finish(job, worker, config, next_run_at=None, **fields):
+    """Schedule the next run and release the lease, unless another replica took the job over meanwhile"""
+    ScheduledJob.objects.filter(name=job.name, locked_by=worker).update(
+        next_run_at=next_run_at or next_run(job, timezone.now(), config), locked_by="", locked_until=None, **fields,
+    )
+
+
+def run_job(job, worker, config):
+    """Run a job this worker holds the lease of and record the outcome; returns True on success"""
+    started = time.monotonic()
+    try:
+        result = job.func()
+    except Exception:
+        logger.exception("scheduled job %s failed", job.name)
+        error = traceback.format_exc()
+        result = None
+    else:
+        error = ""
+    duration = time.monotonic() - started
+
+    metrics.scheduler_duration.observe(duration, job=job.name)
+    metrics.scheduler_runs.inc(job=job.name, result="error" if error else "success")
+    fields = {"last_finished_at": timezone.now(), "last_duration": duration, "last_error": error[-4000:]}
+    if not error:
+        fields["last_result"] = "" if result is None else str(result)
+        logger.info("scheduled job %s done in %.1fs%s", job.name, duration,
+                    "" if result is None else f": {result}")
+    finish(job, worker, config, **fields)
+    return not error
+
+
+def run_due(config=None, worker=None, only=None):
+    """
+    Run every due job this replica wins the lease of; returns the names run.
+    ``only`` runs the named jobs now, due or not, unless another replica is running them.
+    """
+    config = config or get_scheduler_settings()
+    worker = worker or worker_name()
+    ran = []
+    for job in enabled_jobs(config):
+        if only is not None and job.name not in only:
+            continue
+        now = timezone.now()
+        if not acquire(job, worker, now, force=only is not None):
+            continue
+        if job.off_peak and only is None and not in_off_peak(now, config):
+            metrics.scheduler_runs.inc(job=job.name, result="deferred")
+            finish(job, worker, config, next_run_at=in_next_window(now, config))
+            continue
+        run_job(job, worker, config)
+        ran.append(job.name)
+    return ran
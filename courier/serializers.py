@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Order
+from . import webhooks
+from .models import ArchivedOrder, Delivery, DeliveryBoy, DeliveryTombstone, Order, WebhookEndpoint
 from django.contrib.auth.models import User
 
 
@@ -39,5 +40,96 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = '__all__'
+        # Courier queue leases and the integer code columns are internal
+        exclude = ['claimed_by', 'claim_expires_at', 'status_code', 'payment_status_code']
         read_only_fields = ['customer', 'barcode', 'created_at', 'updated_at']
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    """Same fields as OrderSerializer plus archived_at"""
+    class Meta:
+        model = ArchivedOrder
+        fields = '__all__'
+
+
+class TrackingSerializer(serializers.Serializer):
+    """Public tracking view of an order or archived order: no customer, receiver or amount"""
+    barcode = serializers.CharField()
+    status = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    updated_at = serializers.DateTimeField()
+    archived_at = serializers.DateTimeField(required=False)  # Archived orders only
+
+
+class CourierUserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'first_name', 'last_name')
+
+
+class AvailableDeliveryBoySerializer(serializers.ModelSerializer):
+    user = CourierUserSerializer(read_only=True)
+
+    class Meta:
+        model = DeliveryBoy
+        fields = ('id', 'user', 'vehicle_type', 'vehicle_number', 'current_location')
+
+
+class OrderStatusBatchItemSerializer(serializers.Serializer):
+    """One entry of a batch status update, addressed by order id or barcode"""
+    id = serializers.IntegerField(required=False, min_value=1)
+    barcode = serializers.CharField(required=False, max_length=100)
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+    timestamp = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('id') and not attrs.get('barcode'):
+            raise serializers.ValidationError("Either id or barcode is required")
+        return attrs
+
+
+class WebhookEndpointSerializer(serializers.ModelSerializer):
+    events = serializers.ListField(
+        child=serializers.ChoiceField(choices=WebhookEndpoint.EVENT_CHOICES), required=False
+    )
+    max_concurrency = serializers.IntegerField(min_value=1, max_value=10, required=False)
+
+    class Meta:
+        model = WebhookEndpoint
+        fields = ('id', 'url', 'events', 'is_active', 'max_concurrency', 'secret', 'created_at')
+        read_only_fields = ['secret', 'created_at']
+
+    def validate_url(self, value):
+        error = webhooks.url_error(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
+
+class CourierDeliverySerializer(serializers.ModelSerializer):
+    """A delivery as the courier app shows it, with the order details needed on the road"""
+    barcode = serializers.CharField(source='order.barcode', read_only=True)
+    receiver_name = serializers.CharField(source='order.receiver_name', read_only=True)
+    receiver_address = serializers.CharField(source='order.receiver_address', read_only=True)
+    amount = serializers.DecimalField(source='order.amount', max_digits=10, decimal_places=2, read_only=True)
+    order_status = serializers.CharField(source='order.status', read_only=True)
+
+    class Meta:
+        model = Delivery
+        fields = ('id', 'order_id', 'barcode', 'receiver_name', 'receiver_address', 'amount', 'order_status',
+                  'status', 'assigned_at', 'accepted_at', 'picked_up_at', 'delivered_at', 'notes', 'updated_at')
+
+
+class QueuedOrderSerializer(serializers.ModelSerializer):
+    """A pending order claimed from the courier pull queue, with the end of its lease"""
+    class Meta:
+        model = Order
+        fields = ('id', 'barcode', 'receiver_name', 'receiver_address', 'amount', 'created_at', 'claim_expires_at')
+
+
+class DeliveryTombstoneSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='delivery_id', read_only=True)
+
+    class Meta:
+        model = DeliveryTombstone
+        fields = ('id', 'reason')
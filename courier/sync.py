@@ -0,0 +1,124 @@
+"""
+Delta sync of a courier's deliveries for the mobile app.
+
+The app keeps a local copy of its deliveries and calls the sync endpoint
+with the cursor from its previous sync. The answer holds the deliveries that
+changed since then (``Delivery.updated_at``, read through the
+``delivery_courier_sync_idx`` index) and tombstones for the deliveries that
+were taken away from the courier, so an idle courier's sync transfers
+nothing but a new cursor.
+
+A cursor is two seek cursors, one over ``(updated_at, id)`` of the
+deliveries and one over ``(created_at, id)`` of the tombstones. Once a
+stream is exhausted its cursor moves to SETTLE_SECONDS before the sync
+started rather than to its last row: a transaction that stamped a row
+earlier but committed after the sync read is still picked up next time, at
+the cost of resending the last few seconds of changes. Tombstones are kept
+for TOMBSTONE_DAYS; older cursors are refused and the app must start over.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Delivery, DeliveryTombstone
+from .pagination import SeekPaginator
+
+
+DEFAULT_COURIER_SYNC = {
+    "PAGE_SIZE": 200,
+    "SETTLE_SECONDS": 5,
+    "TOMBSTONE_DAYS": 30,
+}
+
+ACTIVE_STATUSES = [status for status, targets in Delivery.STATUS_TRANSITIONS.items() if targets]
+
+DELIVERY_FIELDS = (
+    "id", "order_id", "delivery_boy_id", "status", "assigned_at", "accepted_at", "picked_up_at", "delivered_at",
+    "notes", "updated_at", "order__barcode", "order__receiver_name", "order__receiver_address",
+    "order__amount", "order__status",
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorExpired(ValueError):
+    pass
+
+
+def get_courier_sync_settings():
+    return {**DEFAULT_COURIER_SYNC, **getattr(settings, "COURIER_SYNC", {})}
+
+
+def courier_deliveries(delivery_boy):
+    return Delivery.objects.filter(delivery_boy=delivery_boy).select_related("order").only(*DELIVERY_FIELDS)
+
+
+def active_deliveries(delivery_boy):
+    return courier_deliveries(delivery_boy).filter(status__in=ACTIVE_STATUSES).order_by("assigned_at", "id")
+
+
+def read_stream(queryset, time_field, cursor, page_size, settled, start=None, oldest=None):
+    """
+    The rows after ``cursor`` (or after ``start`` without one), the cursor to
+    continue from and whether rows are left.
+    """
+    paginator = SeekPaginator(queryset, page_size, (time_field, "id"))
+    after = start
+    if cursor:
+        after = paginator.decode_cursor(cursor)
+        if after is None:
+            raise InvalidCursor("Malformed sync cursor")
+        if oldest is not None and after[0] < oldest:
+            raise CursorExpired("Sync cursor is older than the kept tombstones")
+
+    queryset = queryset.order_by(time_field, "id")
+    if after:
+        queryset = queryset.filter(paginator.seek_filter(after, forward=True))
+    rows = list(queryset[:page_size + 1])
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, paginator.encode_cursor(rows[-1]), True
+    # Everything up to now was read, but not necessarily everything that will commit with an older stamp
+    return rows, paginator.encode_values(max(after, [settled, 0]) if after else [settled, 0]), False
+
+
+def changes_since(delivery_boy, cursor=None, config=None):
+    """Deliveries changed and tombstones created since ``cursor``, the next cursor and whether more is left"""
+    config = config or get_courier_sync_settings()
+    now = timezone.now()
+    settled = now - timedelta(seconds=config["SETTLE_SECONDS"])
+    delivery_cursor, _, tombstone_cursor = (cursor or "").partition(".")
+    if cursor and not (delivery_cursor and tombstone_cursor):
+        raise InvalidCursor("Malformed sync cursor")
+
+    deliveries, delivery_cursor, more_deliveries = read_stream(
+        courier_deliveries(delivery_boy), "updated_at", delivery_cursor, config["PAGE_SIZE"], settled,
+    )
+    # A first sync has nothing to remove yet, so its tombstones start now
+    removed, tombstone_cursor, more_tombstones = read_stream(
+        DeliveryTombstone.objects.filter(delivery_boy=delivery_boy).only("id", "delivery_id", "reason", "created_at"),
+        "created_at", tombstone_cursor, config["PAGE_SIZE"], settled,
+        start=[settled, 0], oldest=now - timedelta(days=config["TOMBSTONE_DAYS"]),
+    )
+    return {
+        "deliveries": deliveries,
+        "removed": removed,
+        "cursor": f"{delivery_cursor}.{tombstone_cursor}",
+        "has_more": more_deliveries or more_tombstones,
+    }
+
+
+def purge_tombstones(days=None, batch_size=5000):
+    """Delete tombstones older than TOMBSTONE_DAYS in batches; returns the number of rows removed"""
+    days = get_courier_sync_settings()["TOMBSTONE_DAYS"] if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    removed = 0
+    while True:
+        pks = list(DeliveryTombstone.objects.filter(created_at__lt=cutoff).values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return removed
+        removed += DeliveryTombstone.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,15 @@
+"""Handlers for outbox jobs (see courier.outbox)"""
+
+from .bulk import refresh_courier_stats
+from .outbox import task
+from .webhooks import send_pending
+
+
+@task("refresh_courier_stats")
+def refresh_courier_stats_task(delivery_boy_ids):
+    refresh_courier_stats(delivery_boy_ids)
+
+
+@task("send_webhooks", atomic=False)
+def send_webhooks_task(endpoint_id):
+    send_pending(endpoint_id)
@@ -1,3 +1,2245 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import os
+import platform
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    archive, barcode_filter, bulk, enum_migration, hashing, metrics, order_cache, outbox, profiling, pull_queue, rollups, scheduler, webhooks,
+)
+from .cache_backends import BoundedLocMemCache
+from .forms import UserProfileForm
+from .middleware import QueryInstrumentationMiddleware, RepeatedQueriesError, normalize_sql
+from .pagination import SeekPaginator
+from .models import (
+    ArchivedDelivery, ArchivedOrder, DailyCourierStats, DailyOrderStats, Delivery, DeliveryBoy, DeliveryTombstone,
+    IdempotencyKey, Order, OutboxJob, ScheduledJob, UserProfile, WebhookDelivery, WebhookEndpoint,
+)
+
+
+# Number of timed calls per endpoint (plus one warm-up and one traced call)
+BENCHMARK_ITERATIONS = int(os.getenv("BENCHMARK_ITERATIONS", "10"))
+
+# Latency budgets are multiplied by this factor so slow CI machines can relax them
+BENCHMARK_LATENCY_FACTOR = float(os.getenv("BENCHMARK_LATENCY_FACTOR", "1.0"))
+
+# Directory the JSON report is written to; set to an empty string to disable
+BENCHMARK_REPORT_DIR = os.getenv(
+    "BENCHMARK_REPORT_DIR", str(Path(settings.BASE_DIR) / "benchmark_reports")
+)
+
+# Per-endpoint budgets: max SQL queries per call, p95 latency (ms), peak allocated memory (KiB).
+# Query counts do not depend on machine speed, so they are the tight guard; latency
+# budgets are generous and only catch gross regressions. The benchmarks also run the
+# repeated query (N+1) detector in strict mode.
+BUDGETS = {
+    "api_root": {"queries": 0, "p95_ms": 50, "peak_kib": 512},
+    "register": {"queries": 3, "p95_ms": 2000, "peak_kib": 1024},
+    "token_obtain_pair": {"queries": 1, "p95_ms": 2000, "peak_kib": 1024},
+    "token_refresh": {"queries": 1, "p95_ms": 50, "peak_kib": 512},
+    "orders_list": {"queries": 1, "p95_ms": 150, "peak_kib": 2048},
+    "orders_list_not_modified": {"queries": 1, "p95_ms": 50, "peak_kib": 512},
+    "orders_create_replay": {"queries": 2, "p95_ms": 50, "peak_kib": 512},
+    "orders_create": {"queries": 3, "p95_ms": 100, "peak_kib": 1024},
+    "order_status_update": {"queries": 8, "p95_ms": 100, "peak_kib": 1024},
+    "order_payment_update": {"queries": 5, "p95_ms": 100, "peak_kib": 1024},
+    "track_order": {"queries": 1, "p95_ms": 50, "peak_kib": 512},
+    "track_batch": {"queries": 1, "p95_ms": 200, "peak_kib": 1024},
+    "track_order_during_logins": {"queries": 1, "p95_ms": 100, "peak_kib": 512},
+    "login_page": {"queries": 0, "p95_ms": 100, "peak_kib": 1024},
+    "login": {"queries": 9, "p95_ms": 2000, "peak_kib": 1024},
+    "logout": {"queries": 4, "p95_ms": 100, "peak_kib": 512},
+    "admin_dashboard": {"queries": 3, "p95_ms": 200, "peak_kib": 2048},
+    "admin_users": {"queries": 3, "p95_ms": 200, "peak_kib": 2048},
+    "admin_users_create": {"queries": 2, "p95_ms": 200, "peak_kib": 2048},
+    "admin_users_edit": {"queries": 4, "p95_ms": 200, "peak_kib": 2048},
+    "admin_users_delete": {"queries": 13, "p95_ms": 200, "peak_kib": 1024},
+    "admin_delivery_boys": {"queries": 3, "p95_ms": 300, "peak_kib": 2048},
+    "admin_delivery_boys_create": {"queries": 2, "p95_ms": 200, "peak_kib": 2048},
+    "admin_delivery_boys_edit": {"queries": 6, "p95_ms": 200, "peak_kib": 2048},
+    "admin_delivery_boys_delete": {"queries": 20, "p95_ms": 200, "peak_kib": 1024},
+    "admin_orders": {"queries": 3, "p95_ms": 300, "peak_kib": 2048},
+    "admin_assign_delivery": {"queries": 5, "p95_ms": 200, "peak_kib": 2048},
+    "admin_deliveries": {"queries": 3, "p95_ms": 300, "peak_kib": 2048},
+    "admin_update_delivery_status": {"queries": 7, "p95_ms": 200, "peak_kib": 2048},
+    "admin_profiles": {"queries": 2, "p95_ms": 200, "peak_kib": 2048},
+    "admin_orders_bulk": {"queries": 12, "p95_ms": 200, "peak_kib": 2048},
+    "admin_deliveries_bulk": {"queries": 7, "p95_ms": 200, "peak_kib": 2048},
+    "available_delivery_boys": {"queries": 3, "p95_ms": 200, "peak_kib": 2048},
+    "order_status_batch": {"queries": 8, "p95_ms": 200, "peak_kib": 2048},
+    "delivery_assign": {"queries": 12, "p95_ms": 200, "peak_kib": 1024},
+    "courier_deliveries": {"queries": 4, "p95_ms": 100, "peak_kib": 1024},
+    "courier_sync": {"queries": 5, "p95_ms": 100, "peak_kib": 512},
+    "courier_sync_full": {"queries": 5, "p95_ms": 200, "peak_kib": 2048},
+    "metrics": {"queries": 0, "p95_ms": 100, "peak_kib": 1024},
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class EndpointBenchmarkTests(TestCase):
+    """
+    Exercise every API and admin endpoint against a seeded dataset and enforce
+    per-endpoint query, latency and memory budgets.
+    """
+
+    NUM_CUSTOMERS = 50
+    NUM_DELIVERY_BOYS = 25
+    NUM_ORDERS = 600
+    NUM_DELIVERIES = 300
+
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        # One real password hash is enough; every seeded user shares it
+        cls.password = "bench-pass-123"
+        cls.admin = User.objects.create_user("bench-admin", "admin@example.com", cls.password)
+        UserProfile.objects.create(user=cls.admin, role="admin")
+        password_hash = cls.admin.password
+
+        users = User.objects.bulk_create([
+            User(username=f"customer{i}", email=f"customer{i}@example.com",
+                 first_name="Customer", last_name=str(i), password=password_hash)
+            for i in range(cls.NUM_CUSTOMERS)
+        ] + [
+            User(username=f"courier{i}", email=f"courier{i}@example.com",
+                 first_name="Courier", last_name=str(i), password=password_hash)
+            for i in range(cls.NUM_DELIVERY_BOYS)
+        ])
+        customers = users[:cls.NUM_CUSTOMERS]
+        couriers = users[cls.NUM_CUSTOMERS:]
+
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=user, role="customer", phone="555-0100") for user in customers]
+            + [UserProfile(user=user, role="delivery_boy", phone="555-0200") for user in couriers]
+        )
+        delivery_boys = DeliveryBoy.objects.bulk_create([
+            DeliveryBoy(user=user, vehicle_type=("bike", "car", "van", "truck")[i % 4],
+                        vehicle_number=f"V-{i:04d}", license_number=f"L-{i:04d}")
+            for i, user in enumerate(couriers)
+        ])
+
+        statuses = ["pending"] * 4 + ["in_transit"] * 3 + ["delivered"] * 2 + ["cancelled"]
+        payments = ["paid"] * 3 + ["unpaid"]
+        orders = Order.objects.bulk_create([
+            Order(customer=customers[i % len(customers)], barcode=f"CO-BENCH{i:06d}",
+                  receiver_name=f"Receiver {i}", receiver_address=f"{i} Benchmark Street\nTestville",
+                  amount=Decimal("10.00") + i % 90, status=statuses[i % len(statuses)],
+                  payment_status=payments[i % len(payments)])
+            for i in range(cls.NUM_ORDERS)
+        ])
+        shipped = [order for order in orders if order.status != "pending"][:cls.NUM_DELIVERIES]
+        Delivery.objects.bulk_create([
+            Delivery(order=order, delivery_boy=delivery_boys[i % len(delivery_boys)],
+                     status="delivered" if order.status == "delivered" else "picked_up",
+                     rating=(i % 5) + 1 if order.status == "delivered" else None)
+            for i, order in enumerate(shipped)
+        ])
+
+        cls.customer = customers[0]
+        cls.delivery_boy = delivery_boys[0]
+        cls.pending_order = Order.objects.filter(status="pending").first()
+        cls.delivery = Delivery.objects.filter(status="picked_up").first()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if BENCHMARK_REPORT_DIR and cls.results:
+            write_report(cls.results)
+
+    def setUp(self):
+        # Keep /metrics independent of the files left behind by earlier test runs
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        # Every endpoint must be free of per-row (N+1) queries
+        override = override_settings(
+            METRICS={"DIRECTORY": metrics_dir.name, "REQUIRE_TOKEN": False},
+            SQL_INSTRUMENTATION={"REPEATED_QUERIES": "raise"},
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        # Seeded orders were bulk created, which does not bump cached order list versions
+        cache.clear()
+        self.admin_client = Client()
+        self.admin_client.force_login(self.admin)
+        refresh = RefreshToken.for_user(self.customer)
+        self.refresh_token = str(refresh)
+        self.api_client = Client(HTTP_AUTHORIZATION=f"Bearer {refresh.access_token}")
+
+    def benchmark(self, name, call, expected_status=200):
+        """
+        Run ``call(i)`` for a warm-up, the timed iterations and one traced call.
+
+        ``i`` is a distinct integer per call so endpoints that mutate state can
+        use a fresh fixture each time.
+        """
+        runs = BENCHMARK_ITERATIONS
+        response = call(0)
+        self.assertEqual(response.status_code, expected_status, f"{name}: unexpected status")
+
+        latencies, query_counts = [], []
+        for i in range(1, runs + 1):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = call(i)
+                latencies.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(queries))
+            self.assertEqual(response.status_code, expected_status, f"{name}: unexpected status")
+
+        tracemalloc.start()
+        try:
+            call(runs + 1)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            "iterations": runs,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(max(latencies), 3),
+            "queries": max(query_counts),
+            "peak_kib": round(peak / 1024, 1),
+            "budget": BUDGETS[name],
+        }
+        self.results[name] = result
+
+        budget = BUDGETS[name]
+        self.assertLessEqual(
+            result["queries"], budget["queries"], f"{name}: query budget exceeded"
+        )
+        self.assertLessEqual(
+            result["p95_ms"], budget["p95_ms"] * BENCHMARK_LATENCY_FACTOR,
+            f"{name}: p95 latency budget exceeded",
+        )
+        self.assertLessEqual(
+            result["peak_kib"], budget["peak_kib"], f"{name}: memory budget exceeded"
+        )
+        return result
+
+    def next_page_url(self, path):
+        """URL of the second page of an admin list, following its seek cursor"""
+        page = self.admin_client.get(path).context["page_obj"]
+        separator = "&" if "?" in path else "?"
+        return f"{path}{separator}after={page.next_cursor}"
+
+    def fresh_orders(self, count, **fields):
+        """Create ``count`` orders for the API customer, one per benchmark call"""
+        defaults = {"receiver_name": "Fixture", "receiver_address": "1 Fixture Road",
+                    "amount": Decimal("25.00"), "customer": self.customer}
+        defaults.update(fields)
+        return Order.objects.bulk_create([
+            Order(barcode=f"CO-FIX{time.perf_counter_ns()}{i}", **defaults)
+            for i in range(count)
+        ])
+
+    def fresh_users(self, count):
+        return User.objects.bulk_create([
+            User(username=f"fixture-{time.perf_counter_ns()}-{i}") for i in range(count)
+        ])
+
+    def fresh_delivery_boys(self, count):
+        return DeliveryBoy.objects.bulk_create([
+            DeliveryBoy(user=user) for user in self.fresh_users(count)
+        ])
+
+    # API endpoints
+
+    def test_api_root(self):
+        self.benchmark("api_root", lambda i: self.api_client.get("/api/v1/"))
+
+    def test_register(self):
+        self.benchmark("register", lambda i: self.client.post(
+            "/api/v1/register/",
+            {"username": f"new-user-{i}", "email": f"new{i}@example.com", "password": "s3cret-pass"},
+        ), expected_status=201)
+
+    def test_token_obtain_pair(self):
+        self.benchmark("token_obtain_pair", lambda i: self.client.post(
+            "/api/v1/token/", {"username": self.customer.username, "password": self.password},
+        ))
+
+    def test_token_refresh(self):
+        self.benchmark("token_refresh", lambda i: self.client.post(
+            "/api/v1/token/refresh/", {"refresh": self.refresh_token},
+        ))
+
+    @override_settings(ORDER_LIST_CACHE={"ENABLED": True})  # As with REDIS_URL in production
+    def test_orders_list(self):
+        self.benchmark("orders_list", lambda i: self.api_client.get("/api/v1/orders/"))
+
+    @override_settings(ORDER_LIST_CACHE={"ENABLED": True})
+    def test_orders_list_not_modified(self):
+        etag = self.api_client.get("/api/v1/orders/")["ETag"]
+        self.benchmark("orders_list_not_modified", lambda i: self.api_client.get(
+            "/api/v1/orders/", HTTP_IF_NONE_MATCH=etag,
+        ), expected_status=304)
+
+    def test_orders_create(self):
+        self.benchmark("orders_create", lambda i: self.api_client.post(
+            "/api/v1/orders/",
+            {"receiver_name": "Bench", "receiver_address": "2 Bench Road", "amount": "12.50"},
+        ), expected_status=201)
+
+    def test_orders_create_replay(self):
+        payload = {"receiver_name": "Bench", "receiver_address": "3 Retry Road", "amount": "9.99"}
+        self.benchmark("orders_create_replay", lambda i: self.api_client.post(
+            "/api/v1/orders/", payload, HTTP_IDEMPOTENCY_KEY="bench-retry",
+        ), expected_status=201)
+
+    def test_order_status_update(self):
+        orders = self.fresh_orders(BENCHMARK_ITERATIONS + 2)
+        self.benchmark("order_status_update", lambda i: self.api_client.patch(
+            f"/api/v1/orders/{orders[i].pk}/status/",
+            json.dumps({"status": "in_transit"}), content_type="application/json",
+        ))
+
+    def test_order_payment_update(self):
+        orders = self.fresh_orders(BENCHMARK_ITERATIONS + 2)
+        self.benchmark("order_payment_update", lambda i: self.api_client.patch(
+            f"/api/v1/orders/{orders[i].pk}/payment/",
+            json.dumps({"action": "pay"}), content_type="application/json",
+        ))
+
+    def test_metrics(self):
+        self.benchmark("metrics", lambda i: self.client.get("/metrics"))
+
+    def test_track_order(self):
+        self.benchmark("track_order", lambda i: self.client.get(
+            f"/api/v1/track/{self.pending_order.barcode}/"
+        ))
+
+    def test_track_order_during_logins(self):
+        # Tracking while four threads verify passwords back to back, as during a login storm
+        stop = threading.Event()
+
+        def log_in():
+            while not stop.is_set():
+                check_password(self.password, self.admin.password)
+
+        threads = [threading.Thread(target=log_in) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            self.benchmark("track_order_during_logins", lambda i: self.client.get(
+                f"/api/v1/track/{self.pending_order.barcode}/"
+            ))
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def test_track_batch(self):
+        barcodes = list(Order.objects.order_by("id").values_list("barcode", flat=True)[:100])
+        self.benchmark("track_batch", lambda i: self.client.post(
+            "/api/v1/track/", {"barcodes": barcodes}, content_type="application/json",
+        ))
+
+    # Authentication pages
+
+    def test_login_page(self):
+        self.benchmark("login_page", lambda i: self.client.get("/accounts/login/"))
+
+    def test_login(self):
+        self.benchmark("login", lambda i: Client().post(
+            "/accounts/login/", {"username": self.admin.username, "password": self.password},
+        ), expected_status=302)
+
+    def test_logout(self):
+        clients = []
+        for _ in range(BENCHMARK_ITERATIONS + 2):
+            client = Client()
+            client.force_login(self.admin)
+            clients.append(client)
+        self.benchmark("logout", lambda i: clients[i].get("/accounts/logout/"), expected_status=302)
+
+    # Custom admin views
+
+    def test_admin_dashboard(self):
+        self.benchmark("admin_dashboard", lambda i: self.admin_client.get("/admin/dashboard/"))
+
+    def test_admin_users(self):
+        url = self.next_page_url("/admin/users/")
+        self.benchmark("admin_users", lambda i: self.admin_client.get(url))
+
+    def test_admin_users_create(self):
+        self.benchmark("admin_users_create", lambda i: self.admin_client.get("/admin/users/create/"))
+
+    def test_admin_users_edit(self):
+        self.benchmark("admin_users_edit", lambda i: self.admin_client.get(
+            f"/admin/users/{self.customer.pk}/edit/"
+        ))
+
+    def test_admin_users_delete(self):
+        users = self.fresh_users(BENCHMARK_ITERATIONS + 2)
+        self.benchmark("admin_users_delete", lambda i: self.admin_client.post(
+            f"/admin/users/{users[i].pk}/delete/"
+        ), expected_status=302)
+
+    def test_admin_delivery_boys(self):
+        self.benchmark("admin_delivery_boys", lambda i: self.admin_client.get("/admin/delivery-boys/"))
+
+    def test_admin_delivery_boys_create(self):
+        self.benchmark("admin_delivery_boys_create", lambda i: self.admin_client.get(
+            "/admin/delivery-boys/create/"
+        ))
+
+    def test_admin_delivery_boys_edit(self):
+        self.benchmark("admin_delivery_boys_edit", lambda i: self.admin_client.get(
+            f"/admin/delivery-boys/{self.delivery_boy.pk}/edit/"
+        ))
+
+    def test_admin_delivery_boys_delete(self):
+        delivery_boys = self.fresh_delivery_boys(BENCHMARK_ITERATIONS + 2)
+        self.benchmark("admin_delivery_boys_delete", lambda i: self.admin_client.post(
+            f"/admin/delivery-boys/{delivery_boys[i].pk}/delete/"
+        ), expected_status=302)
+
+    def test_admin_orders(self):
+        url = self.next_page_url("/admin/orders/?status=delivered")
+        self.benchmark("admin_orders", lambda i: self.admin_client.get(url))
+
+    def test_admin_assign_delivery(self):
+        self.benchmark("admin_assign_delivery", lambda i: self.admin_client.get(
+            f"/admin/orders/{self.pending_order.pk}/assign/"
+        ))
+
+    def test_admin_deliveries(self):
+        url = self.next_page_url("/admin/deliveries/")
+        self.benchmark("admin_deliveries", lambda i: self.admin_client.get(url))
+
+    def test_admin_update_delivery_status(self):
+        self.benchmark("admin_update_delivery_status", lambda i: self.admin_client.get(
+            f"/admin/deliveries/{self.delivery.pk}/update/"
+        ))
+
+    def test_admin_profiles(self):
+        self.benchmark("admin_profiles", lambda i: self.admin_client.get("/admin/profiles/"))
+
+    def test_admin_orders_bulk(self):
+        orders = self.fresh_orders(20 * (BENCHMARK_ITERATIONS + 2))
+        self.benchmark("admin_orders_bulk", lambda i: self.admin_client.post("/admin/orders/bulk/", {
+            "action": "assign", "delivery_boy": self.delivery_boy.pk,
+            "order_ids": [order.pk for order in orders[i * 20:(i + 1) * 20]],
+        }), expected_status=302)
+
+    def test_admin_deliveries_bulk(self):
+        orders = self.fresh_orders(20 * (BENCHMARK_ITERATIONS + 2), status="in_transit")
+        deliveries = Delivery.objects.bulk_create([
+            Delivery(order=order, delivery_boy=self.delivery_boy) for order in orders
+        ])
+        self.benchmark("admin_deliveries_bulk", lambda i: self.admin_client.post("/admin/deliveries/bulk/", {
+            "status": "picked_up", "delivery_ids": [d.pk for d in deliveries[i * 20:(i + 1) * 20]],
+        }), expected_status=302)
+
+    def test_order_status_batch(self):
+        orders = self.fresh_orders(50 * (BENCHMARK_ITERATIONS + 2))
+        self.benchmark("order_status_batch", lambda i: self.api_client.post("/api/v1/orders/status/batch/", {
+            "updates": [{"barcode": order.barcode, "status": "in_transit"} for order in orders[i * 50:(i + 1) * 50]],
+        }, content_type="application/json"))
+
+    def test_available_delivery_boys(self):
+        self.benchmark("available_delivery_boys", lambda i: self.admin_client.get(
+            "/api/v1/delivery-boys/available/"
+        ))
+
+    def courier_client(self):
+        return Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.delivery_boy.user).access_token}")
+
+    def test_courier_deliveries(self):
+        client = self.courier_client()
+        self.benchmark("courier_deliveries", lambda i: client.get("/api/v1/courier/deliveries/"))
+
+    def test_courier_sync(self):
+        # What an idle courier's app sends every few seconds: nothing changed since the last sync
+        client = self.courier_client()
+        with override_settings(COURIER_SYNC={"SETTLE_SECONDS": 0}):
+            cursor = client.get("/api/v1/courier/sync/").json()["cursor"]
+            self.benchmark("courier_sync", lambda i: client.get("/api/v1/courier/sync/", {"cursor": cursor}))
+
+    def test_courier_sync_full(self):
+        client = self.courier_client()
+        self.benchmark("courier_sync_full", lambda i: client.get("/api/v1/courier/sync/"))
+
+    def test_delivery_assign(self):
+        orders = self.fresh_orders(BENCHMARK_ITERATIONS + 2)
+        self.benchmark("delivery_assign", lambda i: self.admin_client.post("/api/v1/deliveries/assign/", {
+            "order_id": orders[i].pk, "delivery_boy_id": self.delivery_boy.pk,
+        }))
+
+
+class BulkActionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("bulk-admin", "admin@example.com", "pass")
+        UserProfile.objects.create(user=cls.admin, role="admin")
+        cls.customer = User.objects.create_user("bulk-customer", "c@example.com", "pass")
+        UserProfile.objects.create(user=cls.customer, role="customer")
+        courier_user = User.objects.create_user("bulk-courier", "d@example.com", "pass", first_name="Dana")
+        cls.courier = DeliveryBoy.objects.create(user=courier_user, vehicle_type="bike")
+        busy_user = User.objects.create_user("busy-courier", "e@example.com", "pass")
+        DeliveryBoy.objects.create(user=busy_user, is_available=False)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def make_orders(self, statuses):
+        return [
+            Order.objects.create(customer=self.customer, receiver_name="R", receiver_address="A",
+                                 amount=Decimal("5.00"), status=status)
+            for status in statuses
+        ]
+
+    def test_assign_orders_validates_each_row_with_constant_queries(self):
+        pending = self.make_orders(["pending"] * 5)
+        delivered, = self.make_orders(["delivered"])
+        Delivery.objects.create(order=pending[0], delivery_boy=self.courier)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = bulk.assign_orders([o.pk for o in pending] + [delivered.pk, 999999], self.courier)
+        self.assertLessEqual(len(queries), 9)
+
+        self.assertEqual(result.updated, [o.pk for o in pending[1:]])
+        self.assertEqual(result.skipped, {
+            pending[0].pk: "already assigned",
+            delivered.pk: "cannot change from delivered",
+            999999: "not found",
+        })
+        self.assertEqual(Order.objects.filter(status="in_transit").count(), 4)
+        self.assertEqual(self.courier.deliveries.count(), 5)
+
+    def test_bulk_delivered_sets_timestamps_and_courier_stats(self):
+        orders = self.make_orders(["in_transit"] * 3)
+        deliveries = [
+            Delivery.objects.create(order=order, delivery_boy=self.courier, status=status, rating=rating)
+            for order, status, rating in zip(orders, ["picked_up", "in_transit", "assigned"], [4, 5, None])
+        ]
+        result = bulk.update_deliveries([d.pk for d in deliveries], "delivered")
+
+        self.assertEqual(result.updated, [deliveries[0].pk, deliveries[1].pk])
+        self.assertIn(deliveries[2].pk, result.skipped)
+        self.assertEqual(Delivery.objects.filter(status="delivered", delivered_at__isnull=False).count(), 2)
+        self.assertEqual(outbox.drain(), 1)
+        self.courier.refresh_from_db()
+        self.assertEqual(self.courier.total_deliveries, 3)
+        self.assertEqual(self.courier.rating, Decimal("4.50"))
+        with self.assertRaises(ValueError):
+            bulk.update_deliveries([deliveries[2].pk], "assigned")
+
+    def test_single_delivery_transitions_store_datetimes(self):
+        order, = self.make_orders(["in_transit"])
+        delivery = Delivery.objects.create(order=order, delivery_boy=self.courier)
+        self.assertTrue(delivery.mark_picked_up())
+        self.assertTrue(delivery.mark_delivered(rating=5))
+        delivery.refresh_from_db()
+        self.assertIsNotNone(delivery.picked_up_at)
+        self.assertGreaterEqual(delivery.delivered_at, delivery.picked_up_at)
+
+    def test_admin_bulk_cancel_returns_to_filtered_list(self):
+        orders = self.make_orders(["pending", "in_transit", "cancelled"])
+        response = self.client.post("/admin/orders/bulk/", {
+            "action": "cancel", "order_ids": [o.pk for o in orders], "next": "/admin/orders/?status=pending",
+        })
+        self.assertRedirects(response, "/admin/orders/?status=pending", fetch_redirect_response=False)
+        self.assertEqual(Order.objects.filter(status="cancelled").count(), 3)
+        self.assertEqual(
+            [str(m) for m in response.wsgi_request._messages],
+            ["2 orders cancelled.", f"1 skipped: #{orders[2].pk} (cannot change from cancelled)"],
+        )
+
+    def test_admin_bulk_rejects_offsite_next(self):
+        order, = self.make_orders(["pending"])
+        response = self.client.post("/admin/orders/bulk/", {
+            "action": "cancel", "order_ids": [order.pk], "next": "https://evil.example.com/",
+        })
+        self.assertRedirects(response, "/admin/orders/", fetch_redirect_response=False)
+
+    def test_available_delivery_boys_endpoint(self):
+        response = self.client.get("/api/v1/delivery-boys/available/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([boy["id"] for boy in response.json()], [self.courier.pk])
+        self.assertEqual(response.json()[0]["user"]["first_name"], "Dana")
+
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get("/api/v1/delivery-boys/available/").status_code, 403)
+
+    def test_assign_endpoint_accepts_the_dashboard_form(self):
+        pending, delivered = self.make_orders(["pending", "delivered"])
+        response = self.client.post("/api/v1/deliveries/assign/", {
+            "order_id": pending.pk, "delivery_boy_id": self.courier.pk, "notes": "Fragile",
+        })
+        self.assertEqual(response.json(), {"success": True, "updated": [pending.pk], "skipped": {}})
+        self.assertEqual(Delivery.objects.get(order=pending).notes, "Fragile")
+
+        response = self.client.post("/api/v1/deliveries/assign/", {
+            "order_ids": [delivered.pk], "delivery_boy_id": self.courier.pk,
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()["success"])
+
+    def test_admin_marks_only_unfinished_deliveries_failed(self):
+        delivered, assigned = self.make_orders(["delivered", "in_transit"])
+        finished = Delivery.objects.create(order=delivered, delivery_boy=self.courier, status="delivered")
+        open_delivery = Delivery.objects.create(order=assigned, delivery_boy=self.courier)
+
+        self.client.post(f"/admin/deliveries/{finished.pk}/update/", {"status": "failed", "notes": "Lost"})
+        finished.refresh_from_db()
+        self.assertEqual((finished.status, finished.notes), ("delivered", ""))
+
+        self.client.post(f"/admin/deliveries/{open_delivery.pk}/update/", {"status": "failed", "notes": "Lost"})
+        open_delivery.refresh_from_db()
+        self.assertEqual((open_delivery.status, open_delivery.notes), ("failed", "Lost"))
+        self.assertIsNotNone(open_delivery.failed_at)
+
+
+class OrderStatusBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user("batch-customer", "c@example.com", "pass")
+        cls.other = User.objects.create_user("batch-other", "o@example.com", "pass")
+
+    def setUp(self):
+        self.client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.customer).access_token}")
+
+    def make_order(self, customer=None, status="pending"):
+        return Order.objects.create(customer=customer or self.customer, receiver_name="R",
+                                    receiver_address="A", amount=Decimal("5.00"), status=status)
+
+    def post(self, updates):
+        return self.client.post("/api/v1/orders/status/batch/", {"updates": updates}, content_type="application/json")
+
+    def test_replays_events_in_timestamp_order_with_grouped_updates(self):
+        first, second, delivered = self.make_order(), self.make_order(), self.make_order(status="delivered")
+        foreign = self.make_order(customer=self.other)
+        later = (timezone.now() + timedelta(minutes=5)).isoformat()
+        earlier = (timezone.now() + timedelta(minutes=1)).isoformat()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([
+                {"id": first.pk, "status": "delivered", "timestamp": later},
+                {"barcode": first.barcode, "status": "in_transit", "timestamp": earlier},
+                {"id": second.pk, "status": "cancelled"},
+                {"id": delivered.pk, "status": "in_transit"},
+                {"id": foreign.pk, "status": "cancelled"},
+                {"status": "cancelled"},
+                {"id": second.pk, "status": "cancelled"},
+            ])
+        self.assertEqual(response.status_code, 200)
+        outcomes = [result["outcome"] for result in response.json()["results"]]
+        self.assertEqual(outcomes, ["updated", "updated", "updated", "invalid_transition",
+                                    "not_found", "invalid", "unchanged"])
+        self.assertEqual(response.json()["updated"], 3)
+        # User and role lookups, savepoint, one locking SELECT, one UPDATE per resulting status,
+        # the webhook endpoint lookup and the rollup upsert
+        self.assertLessEqual(len(queries), 9)
+
+        self.assertEqual(Order.objects.get(pk=first.pk).status, "delivered")
+        self.assertEqual(Order.objects.get(pk=second.pk).status, "cancelled")
+        self.assertEqual(Order.objects.get(pk=foreign.pk).status, "pending")
+
+    def test_events_older_than_the_last_change_are_stale(self):
+        order = self.make_order()
+        past = (timezone.now() - timedelta(hours=1)).isoformat()
+        response = self.post([{"id": order.pk, "status": "cancelled", "timestamp": past}])
+        self.assertEqual(response.json()["results"][0]["outcome"], "stale")
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "pending")
+
+    def test_rejects_malformed_and_oversized_batches(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([{"id": 1, "status": "pending"}] * 1001).status_code, 400)
+
+
+class IdempotencyKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user("retrying", "r@example.com", "pass")
+
+    def setUp(self):
+        self.client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.customer).access_token}")
+        self.payload = {"receiver_name": "R", "receiver_address": "1 Retry Road", "amount": "10.00"}
+
+    def create(self, key, payload=None):
+        return self.client.post("/api/v1/orders/", payload or self.payload, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_create_replays_the_stored_response(self):
+        first = self.create("key-1")
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.create("key-1")
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 1)
+        # User lookup for the token plus the indexed key lookup
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(self.create("key-2").status_code, 201)
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 2)
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self.create("key-1")
+        response = self.create("key-1", {**self.payload, "amount": "99.00"})
+        self.assertEqual(response.status_code, 422)
+
+    def test_payment_retry_does_not_report_already_paid(self):
+        order = Order.objects.create(customer=self.customer, receiver_name="R", receiver_address="A",
+                                     amount=Decimal("5.00"))
+        responses = [
+            self.client.patch(f"/api/v1/orders/{order.pk}/payment/", {"action": "pay"},
+                              content_type="application/json", HTTP_IDEMPOTENCY_KEY="pay-1")
+            for _ in range(2)
+        ]
+        self.assertEqual([r.status_code for r in responses], [200, 200])
+        self.assertEqual(responses[1].json()["payment_status"], "paid")
+
+    def test_expired_keys_are_rerun_and_purged(self):
+        self.create("key-1")
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertNotIn("Idempotent-Replayed", self.create("key-1"))
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = io.StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1 expired", out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = User.objects.create_user("outbox-customer")
+        cls.courier = DeliveryBoy.objects.create(user=User.objects.create_user("outbox-courier"))
+        order = Order.objects.create(customer=customer, receiver_name="R", receiver_address="A",
+                                     amount=Decimal("5.00"), status="in_transit")
+        cls.delivery = Delivery.objects.create(order=order, delivery_boy=cls.courier, status="picked_up")
+
+    def setUp(self):
+        outbox.TASKS["flaky"] = self.flaky
+        self.addCleanup(outbox.TASKS.pop, "flaky")
+
+    def flaky(self, fail):
+        if fail:
+            raise RuntimeError("downstream unavailable")
+
+    def test_mark_delivered_defers_courier_stats_to_the_worker(self):
+        self.assertTrue(self.delivery.mark_delivered(rating=4))
+        self.courier.refresh_from_db()
+        self.assertEqual(self.courier.total_deliveries, 0)
+
+        out = io.StringIO()
+        # One thread runs inline: pool threads have their own connections, outside the test's transaction
+        call_command("run_worker", "--once", "--threads", "1", stdout=out)
+        self.assertIn("Processed 1 outbox jobs", out.getvalue())
+        self.courier.refresh_from_db()
+        self.assertEqual((self.courier.total_deliveries, self.courier.rating), (1, Decimal("4.00")))
+        self.assertFalse(OutboxJob.objects.exists())
+
+    def test_failed_jobs_back_off_and_eventually_give_up(self):
+        job = OutboxJob.enqueue("flaky", fail=True)
+        config = {**outbox.get_outbox_settings(), "MAX_ATTEMPTS": 2}
+        with self.assertLogs("courier.outbox", "ERROR"):
+            self.assertEqual(outbox.process_batch(config=config), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("pending", 1))
+        self.assertIn("downstream unavailable", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(outbox.process_batch(config=config), 0)
+
+        OutboxJob.objects.update(run_after=timezone.now())
+        with self.assertLogs("courier.outbox", "ERROR"):
+            outbox.process_batch(config=config)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+
+    def test_jobs_with_an_expired_lease_are_reclaimed(self):
+        OutboxJob.objects.create(task="flaky", payload={"fail": False}, status="running",
+                                 locked_until=timezone.now() - timedelta(seconds=1))
+        OutboxJob.objects.create(task="flaky", payload={"fail": False}, status="running",
+                                 locked_until=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(OutboxJob.objects.get().status, "running")
+
+    def test_jobs_that_keep_killing_their_worker_give_up(self):
+        config = {**outbox.get_outbox_settings(), "MAX_ATTEMPTS": 2}
+        job = OutboxJob.enqueue("flaky", fail=False)
+        for _ in range(2):
+            # The worker dies mid-run: the lease is taken but never finished
+            self.assertEqual([claimed.pk for claimed in outbox.claim_jobs(config)], [job.pk])
+            OutboxJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.claim_jobs(config), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+        self.assertIn("Lease expired", job.last_error)
+
+    def test_run_worker_once_uses_the_thread_and_batch_options(self):
+        for _ in range(3):
+            OutboxJob.enqueue("flaky", fail=False)
+        out = io.StringIO()
+        with mock.patch.object(outbox, "process_batch", wraps=outbox.process_batch) as process_batch:
+            call_command("run_worker", "--once", "--threads", "2", "--batch-size", "2", stdout=out)
+        self.assertIn("Processed 3 outbox jobs", out.getvalue())
+        executor, config = process_batch.call_args.args
+        self.assertEqual((executor._max_workers, config["BATCH_SIZE"]), (2, 2))
+        self.assertEqual(process_batch.call_count, 3)  # Batches of 2, 1, then an empty one
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        jobs = {
+            "tick": scheduler.Job("tick", lambda: self.calls.append("tick") or 3, every=60, off_peak=False, lease=60),
+            "nightly": scheduler.Job("nightly", lambda: self.calls.append("nightly"), every=86400, off_peak=True,
+                                     lease=600),
+            "broken": scheduler.Job("broken", self.broken, every=60, off_peak=False, lease=60),
+        }
+        patcher = mock.patch.dict(scheduler.JOBS, jobs, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Off-peak is the next hour, so "nightly" is never in its window during the test
+        hour = timezone.localtime().hour
+        self.config = {
+            **scheduler.get_scheduler_settings(), "OFF_PEAK_START": (hour + 1) % 24, "OFF_PEAK_END": (hour + 2) % 24,
+        }
+        scheduler.ensure_jobs(self.config)
+        ScheduledJob.objects.update(next_run_at=timezone.now())
+
+    def broken(self):
+        raise RuntimeError("maintenance failed")
+
+    def test_each_due_job_runs_on_one_replica_until_its_lease_expires(self):
+        tick = scheduler.JOBS["tick"]
+        now = timezone.now()
+        self.assertTrue(scheduler.acquire(tick, "replica-a", now))
+        self.assertFalse(scheduler.acquire(tick, "replica-b", now))
+        self.assertTrue(scheduler.acquire(tick, "replica-b", now + timedelta(seconds=61)))  # replica-a died
+
+        with self.assertLogs("courier.scheduler", "INFO"):
+            self.assertEqual(scheduler.run_due(self.config, worker="replica-c", only=["nightly"]), ["nightly"])
+        with self.assertLogs("courier.scheduler", "ERROR"):
+            self.assertEqual(scheduler.run_due(self.config, worker="replica-c"), ["broken"])
+        self.assertEqual(self.calls, ["nightly"])
+
+    def test_runs_record_their_outcome_and_reschedule_with_jitter(self):
+        with self.assertLogs("courier.scheduler", "INFO"):
+            self.assertEqual(scheduler.run_due(self.config, worker="replica-a"), ["broken", "tick"])
+        self.assertEqual(self.calls, ["tick"])  # "nightly" is outside its window
+        rows = {row.name: row for row in ScheduledJob.objects.all()}
+        self.assertEqual((rows["tick"].last_result, rows["tick"].locked_by, rows["tick"].last_error), ("3", "", ""))
+        self.assertIn("maintenance failed", rows["broken"].last_error)
+        now = timezone.now()
+        for name in ("tick", "broken"):
+            self.assertLess(abs((rows[name].next_run_at - now).total_seconds() - 60), 7)
+        self.assertTrue(scheduler.in_off_peak(rows["nightly"].next_run_at, self.config))
+        self.assertGreater(rows["nightly"].next_run_at, now)
+        self.assertEqual(scheduler.run_due(self.config, worker="replica-a"), [])
+
+        body = metrics.registry.render()
+        self.assertIn('courier_scheduler_job_runs_total{job="nightly",result="deferred"}', body)
+        self.assertIn('courier_scheduler_job_duration_seconds_count{job="tick"}', body)
+
+
+
+class ScheduledJobTests(TestCase):
+    def test_reconcile_courier_stats_and_detect_stuck_deliveries(self):
+        courier = DeliveryBoy.objects.create(user=User.objects.create_user("scheduled-rider"), total_deliveries=9)
+        order = Order.objects.create(customer=User.objects.create_user("scheduled-shop"), receiver_name="R",
+                                     receiver_address="A", amount=Decimal("5.00"), status="in_transit")
+        delivery = Delivery.objects.create(order=order, delivery_boy=courier)
+        Delivery.objects.filter(pk=delivery.pk).update(assigned_at=timezone.now() - timedelta(hours=3))
+
+        out = io.StringIO()
+        with self.assertLogs("courier.scheduler", "WARNING") as logs:
+            call_command("run_scheduler", "--job", "reconcile_courier_stats", "--job", "detect_stuck_deliveries",
+                         stdout=out)
+        self.assertIn("Ran detect_stuck_deliveries, reconcile_courier_stats", out.getvalue())
+        self.assertIn(f"oldest: [{delivery.pk}]", "\n".join(logs.output))
+        courier.refresh_from_db()
+        self.assertEqual(courier.total_deliveries, 1)
+        self.assertEqual(ScheduledJob.objects.get(name="detect_stuck_deliveries").last_result, "1")
+
+
+class StubWebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like a real merchant endpoint
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((self.client_address, dict(self.headers), body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(WEBHOOKS={"ALLOW_PRIVATE_URLS": True})  # The stub endpoint listens on loopback
+class WebhookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user("merchant")
+        cls.orders = [
+            Order.objects.create(customer=cls.customer, receiver_name="R", receiver_address="A",
+                                 amount=Decimal("5.00"))
+            for _ in range(3)
+        ]
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubWebhookHandler)
+        self.server.received, self.server.statuses = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(webhooks.pool.clear)
+        self.endpoint = WebhookEndpoint.objects.create(
+            customer=self.customer, url=f"http://127.0.0.1:{self.server.server_port}/hooks?source=courier"
+        )
+
+    def received_events(self, index):
+        return json.loads(self.server.received[index][2])["events"]
+
+    def test_transitions_are_batched_signed_and_sent_over_pooled_connections(self):
+        self.orders[0].update_status("in_transit")
+        bulk.cancel_orders([self.orders[1].pk])
+        self.assertEqual(OutboxJob.objects.filter(task="send_webhooks").count(), 1)  # One per endpoint
+
+        outbox.drain()
+        self.assertEqual(len(self.server.received), 1)
+        address, headers, body = self.server.received[0]
+        timestamp, signature = [part.split("=", 1)[1] for part in headers["X-Courier-Signature"].split(",")]
+        expected = hmac.new(self.endpoint.secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256)
+        self.assertEqual(signature, expected.hexdigest())
+        self.assertEqual(
+            [(event["type"], event["data"]["order_id"], event["data"]["status"]) for event in self.received_events(0)],
+            [("order.status_changed", self.orders[0].pk, "in_transit"),
+             ("order.status_changed", self.orders[1].pk, "cancelled")],
+        )
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+        self.orders[2].update_status("cancelled")
+        outbox.drain()
+        self.assertEqual(len(self.server.received), 2)
+        # The second request reused the keep-alive connection of the first
+        self.assertEqual(self.server.received[1][0], address)
+
+    def test_jobs_deferred_by_a_busy_endpoint_keep_their_attempts(self):
+        self.orders[0].update_status("in_transit")
+        slots = webhooks.endpoint_slots(self.endpoint)
+        for _ in range(self.endpoint.max_concurrency):
+            slots.acquire()
+        try:
+            with self.settings(WEBHOOKS={"TIMEOUT": 0.01}), self.assertNoLogs("courier.outbox", "ERROR"):
+                self.assertEqual(outbox.drain(), 1)
+        finally:
+            for _ in range(self.endpoint.max_concurrency):
+                slots.release()
+        job = OutboxJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.last_error), ("pending", 0, ""))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(self.server.received, [])
+
+        OutboxJob.objects.update(run_after=timezone.now())
+        outbox.drain()
+        self.assertEqual(len(self.server.received), 1)
+        self.assertFalse(OutboxJob.objects.exists())
+
+    def test_failed_batches_are_retried_with_backoff(self):
+        self.server.statuses = [500]
+        self.orders[0].update_status("in_transit")
+        with self.assertLogs("courier.outbox", "ERROR"):
+            outbox.drain()
+        event = WebhookDelivery.objects.get()
+        self.assertEqual((event.status, event.attempts, event.last_error), ("pending", 1, "HTTP 500"))
+        self.assertGreater(OutboxJob.objects.get().run_after, timezone.now())
+
+        OutboxJob.objects.update(run_after=timezone.now())
+        outbox.drain()
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(self.received_events(0), self.received_events(1))
+        self.assertFalse(WebhookDelivery.objects.exists())
+        self.assertFalse(OutboxJob.objects.exists())
+
+    def test_events_are_queued_only_for_subscribed_active_endpoints(self):
+        WebhookEndpoint.objects.create(customer=self.customer, url="http://127.0.0.1:9/off", is_active=False)
+        WebhookEndpoint.objects.create(customer=self.customer, url="http://127.0.0.1:9/deliveries",
+                                       events=["delivery.status_changed"])
+        WebhookEndpoint.objects.create(customer=User.objects.create_user("other-merchant"),
+                                       url="http://127.0.0.1:9/other")
+        self.orders[0].update_status("in_transit")
+        self.assertEqual(list(WebhookDelivery.objects.values_list("endpoint", flat=True)), [self.endpoint.pk])
+
+    def test_merchants_manage_only_their_own_endpoints(self):
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.customer).access_token}")
+        response = client.post("/api/v1/webhooks/", {"url": "https://merchant.example.com/hooks",
+                                                     "events": ["order.status_changed"]},
+                               content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["secret"]), 64)
+        self.assertEqual(len(client.get("/api/v1/webhooks/").json()), 2)
+
+        other = User.objects.create_user("nosy-merchant")
+        other_client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(other).access_token}")
+        self.assertEqual(other_client.get(f"/api/v1/webhooks/{response.json()['id']}/").status_code, 404)
+        self.assertEqual(
+            other_client.post("/api/v1/webhooks/", {"url": "ftp://example.com/"},
+                              content_type="application/json").status_code,
+            400,
+        )
+
+    @override_settings(WEBHOOKS={"ALLOW_PRIVATE_URLS": False})
+    def test_endpoints_must_be_on_public_addresses(self):
+        # An endpoint whose host resolves to the internal network by the time it is sent to is not contacted
+        self.orders[0].update_status("in_transit")
+        with self.assertLogs("courier.outbox", "ERROR"):
+            outbox.drain()
+        self.assertEqual(self.server.received, [])
+        self.assertIn("not a public address", WebhookDelivery.objects.get().last_error)
+
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.customer).access_token}")
+
+        def resolving_to(address):
+            family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            return mock.patch.object(webhooks.socket, "getaddrinfo",
+                                     return_value=[(family, socket.SOCK_STREAM, 6, "", (address, 443))])
+
+        for address in ["127.0.0.1", "10.0.0.5", "192.168.1.1", "169.254.169.254", "100.64.0.1", "::1",
+                        "fd00:ec2::254", "::ffff:10.0.0.5"]:
+            with resolving_to(address):
+                response = client.post("/api/v1/webhooks/", {"url": "https://merchant.example.com/hooks"},
+                                       content_type="application/json")
+            self.assertEqual(response.status_code, 400, address)
+            self.assertIn("public", response.json()["url"][0])
+        with resolving_to("93.184.216.34"):
+            response = client.post("/api/v1/webhooks/", {"url": "https://merchant.example.com/hooks"},
+                                   content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+
+    def test_a_failed_send_job_yields_to_a_newer_pending_one(self):
+        self.server.statuses = [500]
+        self.orders[0].update_status("in_transit")
+        job = OutboxJob.objects.get()
+        claimed = outbox.claim_jobs(outbox.get_outbox_settings())
+        self.orders[1].update_status("in_transit")  # The first job is running, so a second one is queued
+        self.assertEqual(OutboxJob.objects.filter(status="pending").count(), 1)
+
+        with self.assertLogs("courier.outbox", "ERROR"):
+            outbox.finish_jobs(claimed, [outbox.run_job(claimed[0])], outbox.get_outbox_settings())
+        self.assertFalse(OutboxJob.objects.filter(pk=job.pk).exists())
+        outbox.drain()
+        self.assertFalse(WebhookDelivery.objects.exists())
+        self.assertFalse(OutboxJob.objects.exists())
+
+
+class OrderArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user("archived-customer")
+        cls.courier = DeliveryBoy.objects.create(user=User.objects.create_user("archived-courier"))
+        cls.orders = {
+            status: Order.objects.create(customer=cls.customer, receiver_name="R", receiver_address="A",
+                                         amount=Decimal("5.00"), status=status)
+            for status in ["delivered", "cancelled", "in_transit"]
+        }
+        Delivery.objects.create(order=cls.orders["delivered"], delivery_boy=cls.courier,
+                                status="delivered", rating=4)
+        cls.recent = Order.objects.create(customer=cls.customer, receiver_name="R", receiver_address="A",
+                                          amount=Decimal("5.00"), status="delivered")
+        Order.objects.exclude(pk=cls.recent.pk).update(updated_at=timezone.now() - timedelta(days=120))
+
+    def test_old_finished_orders_move_in_resumable_batches(self):
+        self.assertEqual(archive.archive_orders(batch_size=1, max_batches=1), 1)
+        self.assertEqual(ArchivedOrder.objects.count(), 1)
+
+        out = io.StringIO()
+        call_command("archive_orders", stdout=out)
+        self.assertIn("Archived 1 orders", out.getvalue())
+        self.assertEqual(
+            set(ArchivedOrder.objects.values_list("pk", flat=True)),
+            {self.orders["delivered"].pk, self.orders["cancelled"].pk},
+        )
+        self.assertEqual(
+            set(Order.objects.values_list("pk", flat=True)), {self.orders["in_transit"].pk, self.recent.pk}
+        )
+        archived = ArchivedDelivery.objects.get()
+        self.assertEqual((archived.order_id, archived.rating), (self.orders["delivered"].pk, 4))
+        self.assertFalse(Delivery.objects.exists())
+
+    def test_tracking_history_and_courier_stats_read_the_archive(self):
+        archive.archive_orders()
+        response = Client().get(f"/api/v1/track/{self.orders['delivered'].barcode}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "delivered")
+        self.assertIn("archived_at", response.json())
+
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.customer).access_token}")
+        listed = [order["id"] for order in client.get("/api/v1/orders/").json()]
+        self.assertEqual(sorted(listed), sorted(order.pk for order in [*self.orders.values(), self.recent]))
+
+        bulk.refresh_courier_stats()
+        self.courier.refresh_from_db()
+        self.assertEqual((self.courier.total_deliveries, self.courier.rating), (1, Decimal("4.00")))
+
+    @override_settings(ARCHIVE={"LIST_LIMIT": 1})
+    def test_archived_history_is_bounded_in_the_list_and_paged_separately(self):
+        archive.archive_orders()
+        newest = ArchivedOrder.objects.order_by("-created_at", "-id").first()
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.customer).access_token}")
+        listed = [order["id"] for order in client.get("/api/v1/orders/").json()]
+        self.assertEqual(sorted(listed), sorted([self.orders["in_transit"].pk, self.recent.pk, newest.pk]))
+
+        pages, cursor = [], None
+        while True:
+            page = client.get("/api/v1/orders/archived/", {"cursor": cursor} if cursor else {}).json()
+            pages.append([order["id"] for order in page["orders"]])
+            cursor = page["cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages[0], [newest.pk])
+        self.assertEqual(
+            sorted(sum(pages, [])), sorted([self.orders["delivered"].pk, self.orders["cancelled"].pk])
+        )
+        self.assertEqual(client.get("/api/v1/orders/archived/", {"cursor": "bogus"}).status_code, 400)
+
+
+class ReportingRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("report-admin")
+        UserProfile.objects.create(user=cls.admin, role="admin")
+        cls.customer = User.objects.create_user("report-customer")
+        cls.courier = DeliveryBoy.objects.create(user=User.objects.create_user("report-courier"))
+
+    def make_orders(self, count):
+        return [
+            Order.objects.create(customer=self.customer, receiver_name="R", receiver_address="A",
+                                 amount=Decimal("10.00") + i)
+            for i in range(count)
+        ]
+
+    def snapshot(self):
+        return (
+            sorted(DailyOrderStats.objects.filter(orders__gt=0).values_list("day", "status", "payment_status",
+                                                                            "orders", "amount")),
+            sorted(DailyCourierStats.objects.values_list("day", "delivery_boy", "assigned", "delivered", "failed")),
+        )
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        orders = self.make_orders(6)
+        orders[0].mark_as_paid()
+        orders[0].update_status("cancelled")
+        bulk.cancel_orders([orders[1].pk])
+        bulk.assign_orders([o.pk for o in orders[2:5]], self.courier)
+        deliveries = list(Delivery.objects.order_by("order_id").values_list("pk", flat=True))
+        bulk.update_deliveries(deliveries[:2], "picked_up")
+        bulk.update_deliveries(deliveries[:1], "delivered")
+        bulk.update_deliveries(deliveries[2:], "failed")
+        bulk.apply_order_status_batch(Order.objects.all(), [(0, {"id": orders[2].pk, "status": "delivered"})])
+
+        incremental = self.snapshot()
+        today = timezone.localdate()
+        self.assertIn((today, "cancelled", "paid", 1, Decimal("10.00")), incremental[0])
+        self.assertIn((today, self.courier.pk, 3, 1, 1), incremental[1])
+
+        DailyOrderStats.objects.all().delete()
+        DailyCourierStats.objects.all().delete()
+        out = io.StringIO()
+        call_command("rebuild_rollups", stdout=out)
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_stale_instances_cannot_repeat_a_transition(self):
+        WebhookEndpoint.objects.create(customer=self.customer, url="https://example.com/hooks")
+        order = self.make_orders(1)[0]
+        first, second = Order.objects.get(pk=order.pk), Order.objects.get(pk=order.pk)
+        self.assertTrue(first.mark_as_paid())
+        self.assertFalse(second.mark_as_paid())
+        self.assertTrue(first.update_status("in_transit"))
+        self.assertFalse(second.update_status("in_transit"))  # Loaded as pending, but no longer is
+        self.assertEqual((second.status, second.payment_status), ("in_transit", "paid"))
+        self.assertTrue(second.refund_payment())
+        self.assertFalse(first.refund_payment())
+
+        self.assertEqual(WebhookDelivery.objects.count(), 1)
+        incremental = self.snapshot()
+        self.assertEqual(incremental[0], [(timezone.localdate(), "in_transit", "refunded", 1, Decimal("10.00"))])
+        rollups.rebuild(timezone.localdate(), timezone.localdate())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_failures_keep_their_day_when_deliveries_are_updated_later(self):
+        orders = self.make_orders(2)
+        bulk.assign_orders([order.pk for order in orders], self.courier)
+        bulk.update_deliveries([orders[0].delivery.pk], "failed")
+        self.assertTrue(Delivery.objects.get(order=orders[1]).mark_failed())
+        day = timezone.localdate()
+        Delivery.objects.update(failed_at=timezone.now() - timedelta(days=1),
+                                updated_at=timezone.now() - timedelta(days=1))
+        rollups.rebuild(day - timedelta(days=1), day)
+        before = self.snapshot()
+        self.assertIn((day - timedelta(days=1), self.courier.pk, 0, 0, 2), before[1])
+
+        Delivery.touch_orders([order.pk for order in orders])  # Courier sync bump of updated_at
+        rollups.rebuild(day - timedelta(days=1), day)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_created_deliveries_count_one_assignment_each(self):
+        orders = self.make_orders(3)
+        Delivery.objects.create(order=orders[0], delivery_boy=self.courier)
+        Delivery.objects.create(order=orders[1], delivery_boy=self.courier, status="failed")
+        self.assertTrue(Delivery.objects.create(order=orders[2], delivery_boy=self.courier).mark_failed())
+        incremental = self.snapshot()
+        self.assertEqual(incremental[1], [(timezone.localdate(), self.courier.pk, 3, 0, 2)])
+
+        rollups.rebuild(timezone.localdate(), timezone.localdate())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_reports_read_the_rollups_only(self):
+        orders = self.make_orders(2)
+        orders[0].mark_as_paid()
+        bulk.assign_orders([orders[0].pk], self.courier)
+        self.client.force_login(self.admin)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/reports/daily/",
+                                       {"from": (timezone.localdate() - timedelta(days=365)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if '"courier_order"' in q["sql"] or '"courier_delivery"' in q["sql"]])
+        today = response.json()["results"][-1]
+        self.assertEqual(
+            (today["orders"], today["amount"], today["revenue"], today["by_status"]),
+            (2, "21.00", "10.00", {"in_transit": 1, "pending": 1}),
+        )
+        self.assertEqual(today["deliveries"], {"assigned": 1, "delivered": 0, "failed": 0, "success_rate": None})
+
+        couriers = self.client.get("/api/v1/reports/couriers/").json()["results"]
+        self.assertEqual([(c["delivery_boy_id"], c["assigned"]) for c in couriers], [(self.courier.pk, 1)])
+        self.assertEqual(self.client.get("/api/v1/reports/daily/", {"from": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/reports/daily/", {"from": "2000-01-01"}).status_code, 400)
+
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get("/api/v1/reports/daily/").status_code, 403)
+
+
+@override_settings(BARCODE_FILTER={"ENABLED": True, "MIN_CAPACITY": 1000})
+class BarcodeFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user("tracked-customer")
+        cls.orders = [
+            Order.objects.create(customer=cls.customer, receiver_name="R", receiver_address="A",
+                                 amount=Decimal("5.00"), status="delivered")
+            for _ in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.use_new_process()
+        self.addCleanup(setattr, barcode_filter, "process_filter", barcode_filter.process_filter)
+
+    def use_new_process(self):
+        barcode_filter.process_filter = barcode_filter.ProcessFilter()
+
+    def track(self, barcode):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/v1/track/{barcode}/")
+        return response.status_code, len(queries)
+
+    def test_seeded_orders_are_in_the_filter(self):
+        barcode_filter.rebuild()
+        call_command("seed_courier_data", customers=2, couriers=1, orders=20, seed=3, stdout=io.StringIO())
+        seeded = Order.objects.exclude(pk__in=[order.pk for order in self.orders]).first()
+        self.assertEqual(self.track(seeded.barcode)[0], 200)
+
+    def test_unknown_barcodes_are_rejected_without_queries(self):
+        out = io.StringIO()
+        call_command("rebuild_barcode_filter", stdout=out)
+        self.assertIn("3 barcodes", out.getvalue())
+        Order.objects.filter(pk=self.orders[0].pk).update(updated_at=timezone.now() - timedelta(days=365))
+        archive.archive_orders()
+
+        self.use_new_process()  # Loads the published snapshot instead of scanning the tables
+        self.assertEqual(self.track("CO-DOESNOTEXIST"), (404, 0))
+        self.assertEqual(self.track(self.orders[1].barcode)[0], 200)
+        self.assertEqual(self.track(self.orders[0].barcode)[0], 200)
+
+        # Created after the snapshot, by "another process"
+        new = Order.objects.create(customer=self.customer, receiver_name="R", receiver_address="A",
+                                   amount=Decimal("5.00"))
+        self.use_new_process()
+        self.assertEqual(self.track(new.barcode)[0], 200)
+
+    def test_lookups_use_the_database_without_a_trusted_snapshot(self):
+        self.assertEqual(self.track("CO-DOESNOTEXIST")[0], 404)
+        self.assertGreater(self.track("CO-DOESNOTEXIST")[1], 0)
+        self.assertIsNone(cache.get(barcode_filter.SNAPSHOT_KEY))  # Web processes never build the filter
+
+        barcode_filter.rebuild()
+        barcode_filter.process_filter.built_at -= 3600
+        self.assertGreater(self.track("CO-DOESNOTEXIST")[1], 0)
+
+    def test_the_scheduler_publishes_the_snapshot(self):
+        out = io.StringIO()
+        call_command("run_scheduler", job=["rebuild_barcode_filter"], stdout=out)
+        self.assertIn("Ran rebuild_barcode_filter", out.getvalue())
+        self.assertEqual(ScheduledJob.objects.get(name="rebuild_barcode_filter").last_result, "3")
+        self.assertEqual(self.track("CO-DOESNOTEXIST"), (404, 0))
+
+    def test_batch_tracking_skips_unknown_barcodes(self):
+        barcode_filter.rebuild()
+        unknown = [f"CO-UNKNOWN{i}" for i in range(50)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/v1/track/", {"barcodes": unknown + [self.orders[2].barcode]}, content_type="application/json",
+            )
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(list(response.json()["orders"]), [self.orders[2].barcode])
+        self.assertEqual(response.json()["missing"], unknown)
+
+    def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives(self):
+        bloom = barcode_filter.BloomFilter.for_capacity(2000, 0.01)
+        members = [f"CO-{i:012X}" for i in range(2000)]
+        for barcode in members:
+            bloom.add(barcode)
+        self.assertTrue(all(barcode in bloom for barcode in members))
+        false_positives = sum(f"XX-{i:012X}" in bloom for i in range(20000))
+        self.assertLess(false_positives / 20000, 0.02)
+        self.assertAlmostEqual(bloom.expected_false_positive_rate(), 0.01, delta=0.005)
+
+
+class TrackBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = User.objects.create_user("batch-customer")
+        cls.orders = [
+            Order.objects.create(customer=customer, receiver_name=f"R{i}", receiver_address="A",
+                                 amount=Decimal("5.00"), status=status)
+            for i, status in enumerate(["pending", "delivered", "in_transit"])
+        ]
+
+    def post(self, barcodes):
+        return self.client.post("/api/v1/track/", {"barcodes": barcodes}, content_type="application/json")
+
+    def test_returns_tracking_data_by_barcode_and_missing_barcodes(self):
+        Order.objects.filter(pk=self.orders[1].pk).update(updated_at=timezone.now() - timedelta(days=365))
+        archive.archive_orders()
+        barcodes = [order.barcode for order in self.orders]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(["CO-NOPE", *barcodes, barcodes[0]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)  # Hot orders, then the archive for the rest
+        data = response.json()
+        self.assertEqual(list(data["orders"]), barcodes)
+        self.assertEqual(data["missing"], ["CO-NOPE"])
+        self.assertEqual(data["orders"][barcodes[0]], Client().get(f"/api/v1/track/{barcodes[0]}/").json())
+        self.assertEqual(data["orders"][barcodes[1]]["status"], "delivered")
+        self.assertIn("archived_at", data["orders"][barcodes[1]])
+
+    def test_tracking_shows_no_customer_data(self):
+        Order.objects.filter(pk=self.orders[1].pk).update(updated_at=timezone.now() - timedelta(days=365))
+        archive.archive_orders()
+        tracked = self.post([order.barcode for order in self.orders]).json()["orders"].values()
+        self.assertEqual({tuple(sorted(data)) for data in tracked}, {
+            ("barcode", "created_at", "status", "updated_at"),
+            ("archived_at", "barcode", "created_at", "status", "updated_at"),
+        })
+        single = Client().get(f"/api/v1/track/{self.orders[0].barcode}/").json()
+        self.assertNotIn("receiver_address", single)
+        self.assertNotIn("customer", single)
+
+    @override_settings(TRACKING={"MAX_BATCH": 2})
+    def test_rejects_invalid_and_oversized_batches(self):
+        self.assertEqual(self.post(["a", "b", "c"]).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post(["a", 5]).status_code, 400)
+        self.assertEqual(self.client.post("/api/v1/track/", {}, content_type="application/json").status_code, 400)
+        self.assertEqual(self.post(["a", "b"]).json(), {"orders": {}, "missing": ["a", "b"]})
+
+
+class PasswordPoolTests(TestCase):
+    def test_hashes_are_compatible_with_the_stock_hasher(self):
+        encoded = make_password("s3cret-pass")
+        self.assertTrue(encoded.startswith("pbkdf2_sha256$"))
+        stock = PBKDF2PasswordHasher()
+        self.assertTrue(stock.verify("s3cret-pass", encoded))
+        self.assertTrue(check_password("s3cret-pass", stock.encode("s3cret-pass", stock.salt())))
+        self.assertFalse(check_password("wrong", encoded))
+
+    def test_hashing_records_queue_time(self):
+        with tempfile.TemporaryDirectory() as metrics_dir, override_settings(METRICS={"DIRECTORY": metrics_dir}):
+            user = User.objects.create_user("pooled", password="s3cret-pass")
+            self.assertTrue(self.client.post(
+                "/api/v1/token/", {"username": "pooled", "password": "s3cret-pass"},
+            ).json()["access"])
+            self.assertTrue(user.check_password("s3cret-pass"))
+            body = metrics.registry.render()
+        self.assertIn('courier_password_hash_queue_seconds_count{operation="encode"}', body)
+        self.assertIn('courier_password_hash_queue_seconds_count{operation="verify"}', body)
+
+    @override_settings(PASSWORD_POOL={"THREADS": 2, "WAIT": 10})
+    def test_concurrency_is_bounded_by_the_slot_count(self):
+        lock, active, peak = threading.Lock(), [0], [0]
+
+        def slow_hash():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return threading.current_thread().name
+
+        names = []
+        threads = [
+            threading.Thread(target=lambda: names.append(hashing.run("verify", slow_hash))) for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(len(names), 6)
+
+    @override_settings(PASSWORD_POOL={"THREADS": 1, "WAIT": 0})
+    def test_logins_fail_fast_when_every_slot_is_taken(self):
+        User.objects.create_user("stormed", password="s3cret-pass")
+        slots = hashing.get_slots(1)
+        slots.acquire()
+        try:
+            response = self.client.post("/api/v1/token/", {"username": "stormed", "password": "s3cret-pass"})
+        finally:
+            slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(
+            self.client.post("/api/v1/token/", {"username": "stormed", "password": "s3cret-pass"}).status_code, 200,
+        )
+
+    @override_settings(PASSWORD_POOL={"THREADS": 1, "WAIT": 0})
+    def test_session_logins_get_a_503_when_every_slot_is_taken(self):
+        User.objects.create_user("stormed-admin", password="s3cret-pass")
+        slots = hashing.get_slots(1)
+        slots.acquire()
+        try:
+            response = self.client.post("/accounts/login/", {"username": "stormed-admin", "password": "s3cret-pass"})
+        finally:
+            slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(
+            self.client.post("/accounts/login/", {"username": "stormed-admin", "password": "s3cret-pass"}).status_code,
+            302,
+        )
+
+
+@override_settings(COURIER_SYNC={"SETTLE_SECONDS": 0})
+class CourierAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user("shop")
+        cls.couriers = []
+        for name in ("rider", "other-rider"):
+            user = User.objects.create_user(name)
+            UserProfile.objects.create(user=user, role="delivery_boy")
+            cls.couriers.append(DeliveryBoy.objects.create(user=user))
+        cls.orders = [
+            Order.objects.create(customer=cls.customer, receiver_name=f"R{i}", receiver_address="A",
+                                 amount=Decimal("5.00"))
+            for i in range(3)
+        ]
+        bulk.assign_orders([order.pk for order in cls.orders], cls.couriers[0])
+        cls.deliveries = list(Delivery.objects.order_by("id"))
+
+    def client_for(self, user):
+        return Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+
+    def setUp(self):
+        self.api = self.client_for(self.couriers[0].user)
+
+    def act(self, delivery, action, **data):
+        return self.api.post(f"/api/v1/courier/deliveries/{delivery.pk}/{action}/", data,
+                             content_type="application/json")
+
+    def sync(self, client=None, cursor=None):
+        response = (client or self.api).get("/api/v1/courier/sync/", {"cursor": cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_active_deliveries_and_status_actions(self):
+        first, second, third = self.deliveries
+        self.assertIsNotNone(self.act(first, "accept").json()["accepted_at"])
+        self.assertEqual(self.act(first, "accept").status_code, 400)
+        self.assertEqual(self.act(first, "pick-up").json()["status"], "picked_up")
+        self.assertEqual(self.act(first, "deliver").json()["status"], "delivered")
+        failed = self.act(second, "fail", notes="Nobody home").json()
+        self.assertEqual((failed["status"], failed["notes"]), ("failed", "Nobody home"))
+        self.assertEqual(self.act(third, "deliver").status_code, 400)
+        self.assertEqual(self.act(third, "teleport").status_code, 404)
+
+        active = self.api.get("/api/v1/courier/deliveries/").json()
+        self.assertEqual([delivery["id"] for delivery in active], [third.pk])
+        self.assertEqual(active[0]["barcode"], self.orders[2].barcode)
+
+        other = self.client_for(self.couriers[1].user)
+        self.assertEqual(other.get("/api/v1/courier/deliveries/").json(), [])
+        self.assertEqual(other.post(f"/api/v1/courier/deliveries/{third.pk}/pick-up/").status_code, 404)
+        self.assertEqual(self.client_for(self.customer).get("/api/v1/courier/deliveries/").status_code, 403)
+
+    def test_delta_sync_returns_only_changes_and_tombstones(self):
+        first, second, third = self.deliveries
+        initial = self.sync()
+        self.assertEqual({delivery["id"] for delivery in initial["deliveries"]}, {d.pk for d in self.deliveries})
+        self.assertEqual((initial["removed"], initial["has_more"]), ([], False))
+
+        with CaptureQueriesContext(connection) as queries:
+            idle = self.sync(cursor=initial["cursor"])
+        self.assertLessEqual(len(queries), 5)
+        self.assertEqual((idle["deliveries"], idle["removed"]), ([], []))
+
+        self.act(first, "pick-up")
+        self.orders[2].refresh_from_db()
+        self.orders[2].update_status("cancelled")
+        admin = User.objects.create_user("dispatch")
+        UserProfile.objects.create(user=admin, role="admin")
+        response = self.client_for(admin).post(
+            f"/api/v1/deliveries/{second.pk}/reassign/", {"delivery_boy_id": self.couriers[1].pk},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        changed = self.sync(cursor=idle["cursor"])
+        self.assertEqual(
+            {(delivery["id"], delivery["status"], delivery["order_status"]) for delivery in changed["deliveries"]},
+            {(first.pk, "picked_up", "in_transit"), (third.pk, "assigned", "cancelled")},
+        )
+        self.assertEqual(changed["removed"], [{"id": second.pk, "reason": "reassigned"}])
+        self.assertEqual(self.sync(cursor=changed["cursor"])["removed"], [])
+
+        taken_over = self.sync(self.client_for(self.couriers[1].user))
+        self.assertEqual([delivery["id"] for delivery in taken_over["deliveries"]], [second.pk])
+
+    @override_settings(COURIER_SYNC={"SETTLE_SECONDS": 0, "PAGE_SIZE": 2})
+    def test_sync_pages_and_rejects_bad_cursors(self):
+        page = self.sync()
+        self.assertEqual((len(page["deliveries"]), page["has_more"]), (2, True))
+        rest = self.sync(cursor=page["cursor"])
+        self.assertEqual((len(rest["deliveries"]), rest["has_more"]), (1, False))
+
+        self.assertEqual(self.api.get("/api/v1/courier/sync/", {"cursor": "garbage"}).status_code, 400)
+        old = SeekPaginator(DeliveryTombstone.objects.all(), 1, ("created_at", "id")).encode_values(
+            [timezone.now() - timedelta(days=31), 0]
+        )
+        delivery_cursor = rest["cursor"].partition(".")[0]
+        self.assertEqual(
+            self.api.get("/api/v1/courier/sync/", {"cursor": f"{delivery_cursor}.{old}"}).status_code, 410
+        )
+
+    def test_purge_delivery_tombstones(self):
+        self.deliveries[0].reassign(self.couriers[1])
+        self.deliveries[1].reassign(self.couriers[1])
+        DeliveryTombstone.objects.filter(delivery_id=self.deliveries[0].pk).update(
+            created_at=timezone.now() - timedelta(days=31)
+        )
+        out = io.StringIO()
+        call_command("purge_delivery_tombstones", stdout=out)
+        self.assertIn("Deleted 1 delivery tombstones", out.getvalue())
+        self.assertEqual(list(DeliveryTombstone.objects.values_list("delivery_id", flat=True)),
+                         [self.deliveries[1].pk])
+        self.assertFalse(self.deliveries[0].reassign(self.couriers[1]))
+
+
+class CourierQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = User.objects.create_user("queue-shop")
+        cls.couriers = []
+        for name in ("queue-rider", "queue-other-rider"):
+            user = User.objects.create_user(name)
+            UserProfile.objects.create(user=user, role="delivery_boy")
+            cls.couriers.append(DeliveryBoy.objects.create(user=user))
+        cls.orders = [
+            Order.objects.create(customer=customer, receiver_name=f"R{i}", receiver_address="A",
+                                 amount=Decimal("5.00"))
+            for i in range(5)
+        ]
+        bulk.assign_orders([cls.orders[0].pk], cls.couriers[1])
+
+    def post(self, courier, action, **data):
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(courier.user).access_token}")
+        return client.post(f"/api/v1/courier/queue/{action}/", data, content_type="application/json")
+
+    def claimed_ids(self, courier, count):
+        response = self.post(courier, "claim", count=count)
+        self.assertEqual(response.status_code, 200)
+        return [order["id"] for order in response.json()["orders"]]
+
+    def test_couriers_claim_disjoint_orders_oldest_first(self):
+        first = self.claimed_ids(self.couriers[0], 2)
+        self.assertEqual(first, [order.pk for order in self.orders[1:3]])
+        self.assertEqual(self.claimed_ids(self.couriers[0], 2), first)  # A retry reserves nothing more
+        self.assertEqual(self.claimed_ids(self.couriers[1], 5), [order.pk for order in self.orders[3:]])
+        self.assertEqual(self.post(self.couriers[0], "claim", count=11).status_code, 400)
+
+    def test_take_assigns_only_live_claims_and_release_requeues(self):
+        held = self.claimed_ids(self.couriers[0], 3)
+        response = self.post(self.couriers[0], "take", order_ids=[held[0], self.orders[0].pk])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d["order_id"] for d in response.json()["deliveries"]], [held[0]])
+        self.assertEqual(response.json()["skipped"], {str(self.orders[0].pk): "not claimed"})
+        order = Order.objects.get(pk=held[0])
+        self.assertEqual((order.status, order.claimed_by_id), ("in_transit", None))
+        self.assertEqual(order.delivery.delivery_boy, self.couriers[0])
+
+        self.assertEqual(self.post(self.couriers[1], "take", order_ids=[held[1]]).status_code, 400)
+        self.assertEqual(self.post(self.couriers[0], "release", order_ids=held[1:]).json(), {"released": 2})
+        self.assertEqual(self.claimed_ids(self.couriers[1], 2), held[1:])
+
+    def test_expired_leases_are_claimed_again(self):
+        held = self.claimed_ids(self.couriers[0], 4)
+        Order.objects.filter(pk__in=held[:2]).update(claim_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.claimed_ids(self.couriers[1], 2), held[:2])
+        self.assertEqual(self.post(self.couriers[0], "take", order_ids=held[:2]).status_code, 400)
+        self.assertEqual(self.claimed_ids(self.couriers[0], 4), held[2:])
+
+    def test_orders_claimed_concurrently_are_left_out_without_row_locks(self):
+        candidates = pull_queue.candidates
+
+        def raced(now, count):
+            rows = candidates(now, count)
+            # Another courier claims the first candidate between the selection and the update
+            Order.objects.filter(pk=rows[0][0]).update(
+                claimed_by=self.couriers[1], claim_expires_at=timezone.now() + timedelta(minutes=1)
+            )
+            return rows
+
+        with mock.patch.object(pull_queue, "candidates", raced):
+            claimed = pull_queue.claim(self.couriers[0], 2)
+        self.assertEqual([order.pk for order in claimed], [self.orders[2].pk])
+        self.assertEqual(Order.objects.get(pk=self.orders[1].pk).claimed_by, self.couriers[1])
+
+    def test_only_expired_claims_actually_taken_over_count_as_requeued(self):
+        held = self.claimed_ids(self.couriers[0], 2)
+        Order.objects.filter(pk__in=held).update(claim_expires_at=timezone.now() - timedelta(seconds=1))
+        candidates = pull_queue.candidates
+
+        def raced(now, count):
+            rows = candidates(now, count)
+            # The first courier renews one of the expired claims before the update
+            Order.objects.filter(pk=held[0]).update(claim_expires_at=timezone.now() + timedelta(minutes=1))
+            return rows
+
+        def requeued():
+            series = metrics.registry.snapshot()["courier_queue_claims_total"]
+            return dict((tuple(key), value) for key, value in series).get(("requeued",), 0)
+
+        before = requeued()
+        with mock.patch.object(pull_queue, "candidates", raced):
+            pull_queue.claim(self.couriers[1], 2)
+        self.assertEqual(requeued() - before, 1)
+
+    def test_oversized_order_id_lists_are_rejected(self):
+        response = self.post(self.couriers[0], "take", order_ids=list(range(1, bulk.MAX_BULK_SIZE + 2)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("At most", response.json()["error"])
+
+    def test_admin_assignment_locks_the_order(self):
+        admin = User.objects.create_user("queue-admin")
+        UserProfile.objects.create(user=admin, role="admin")
+        self.client.force_login(admin)
+        for order, expected in ((self.orders[1], "admin_deliveries"), (self.orders[0], "admin_orders")):
+            response = self.client.post(f"/admin/orders/{order.pk}/assign/", {"delivery_boy": self.couriers[0].pk})
+            self.assertRedirects(response, reverse(expected), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.get(pk=self.orders[1].pk).delivery.delivery_boy, self.couriers[0])
+        self.assertEqual(Order.objects.get(pk=self.orders[0].pk).delivery.delivery_boy, self.couriers[1])
+
+    def test_leases_are_not_exposed_to_customers(self):
+        self.claimed_ids(self.couriers[0], 1)
+        response = Client().get(f"/api/v1/track/{self.orders[1].barcode}/")
+        self.assertNotIn("claimed_by", response.json())
+
+
+class EnumCodeTests(TestCase):
+    def codes(self, table, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT status_code, payment_status_code FROM {table} WHERE id = %s", [pk])
+            return cursor.fetchone()
+
+    def test_triggers_keep_the_codes_in_sync_with_every_write(self):
+        customer = User.objects.create_user("coded-shop")
+        order = Order.objects.create(customer=customer, receiver_name="R", receiver_address="A",
+                                     amount=Decimal("5.00"), payment_status="paid")
+        self.assertEqual(self.codes("courier_order", order.pk), (1, 2))
+        Order.objects.filter(pk=order.pk).update(status="delivered")  # Set-based writes bypass the models
+        self.assertEqual(self.codes("courier_order", order.pk), (3, 2))
+        order.refresh_from_db()
+        self.assertEqual(order.status, "delivered")  # The strings stay the source of truth in this release
+
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(customer).access_token}")
+        row = client.get("/api/v1/orders/").json()[0]
+        self.assertNotIn("status_code", row)
+        self.assertNotIn("payment_status_code", row)
+
+    def test_backfill_encodes_rows_written_before_the_triggers(self):
+        customer = User.objects.create_user("old-shop")
+        order = Order.objects.create(customer=customer, receiver_name="R", receiver_address="A",
+                                     amount=Decimal("5.00"), status="cancelled")
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE courier_order SET status_code = NULL, payment_status_code = NULL WHERE id = %s",
+                           [order.pk])
+        self.assertEqual(enum_migration.remaining(connection)[("courier_order", "status")], 1)
+
+        out = io.StringIO()
+        call_command("backfill_enum_codes", "--batch-size", "1", stdout=out)
+        self.assertEqual(self.codes("courier_order", order.pk), (4, 1))
+        self.assertFalse(any(enum_migration.remaining(connection).values()))
+        self.assertIn("every row has its codes", out.getvalue())
+
+    def test_migration_codes_match_the_models(self):
+        for table, column, codes in enum_migration.ENCODED_COLUMNS:
+            model = next(m for m in (Order, Delivery, UserProfile, DeliveryBoy) if m._meta.db_table == table)
+            field = model._meta.get_field(column)
+            choices = {value for value, _ in field.choices} | ({""} if field.blank else set())
+            self.assertEqual(set(codes), choices, f"{table}.{column}")
+            self.assertEqual(len(set(codes.values())), len(codes), f"{table}.{column}")
+
+
+class AdminPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user("paged", "paged@example.com", "pass")
+        Order.objects.bulk_create([
+            Order(customer=cls.customer, barcode=f"CO-PAGE{i:04d}", receiver_name="R",
+                  receiver_address="A" * 500, amount=Decimal("1.00"))
+            for i in range(45)
+        ])
+        # Identical timestamps force the id tie-breaker to do its job
+        Order.objects.filter(pk__in=Order.objects.values("pk")[:10]).update(
+            created_at=Order.objects.first().created_at
+        )
+        cls.admin = User.objects.create_user("pager-admin", "admin@example.com", "pass")
+        UserProfile.objects.create(user=cls.admin, role="admin")
+
+    def test_seek_pages_cover_every_row_once_in_both_directions(self):
+        paginator = SeekPaginator(Order.objects.all(), 20, ("-created_at", "-id"))
+        expected = list(Order.objects.order_by("-created_at", "-id").values_list("pk", flat=True))
+
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(after=pages[-1].next_cursor))
+        self.assertEqual([o.pk for page in pages for o in page], expected)
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+
+        back = paginator.get_page(before=pages[2].previous_cursor)
+        self.assertEqual([o.pk for o in back], [o.pk for o in pages[1]])
+        self.assertTrue(back.has_previous())
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        self.client.force_login(self.admin)
+        response = self.client.get("/admin/orders/?after=not-a-cursor")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context["page_obj"].has_previous())
+
+    def test_order_list_defers_address_and_keeps_filters_in_links(self):
+        self.client.force_login(self.admin)
+        response = self.client.get("/admin/orders/?status=pending")
+        order = response.context["page_obj"].object_list[0]
+        self.assertIn("receiver_address", order.get_deferred_fields())
+        self.assertContains(response, "?status=pending&after=")
+        self.assertContains(response, "Orders (45)")
+
+    @override_settings(ADMIN_PAGINATION={"MODE": "offset"})
+    def test_offset_mode_uses_cached_count(self):
+        self.client.force_login(self.admin)
+        self.client.get("/admin/orders/?page=2")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/orders/?page=3")
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries.captured_queries))
+        self.assertContains(response, "Orders (~45)")
+        self.assertEqual(list(response.context["page_obj"].page_window), [1, 2, 3])
+
+
+class AdminRoleCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user("role-admin", "admin@example.com", "pass")
+        UserProfile.objects.create(user=self.admin, role="admin")
+        self.client.force_login(self.admin)
+
+    def profile_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [q["sql"] for q in queries.captured_queries if "courier_userprofile" in q["sql"]]
+
+    def test_role_is_read_from_the_session_after_the_first_request(self):
+        self.assertEqual(len(self.profile_queries("/admin/profiles/")), 1)
+        self.assertEqual(self.profile_queries("/admin/profiles/"), [])
+
+    def test_saving_the_profile_form_revokes_cached_admin_access(self):
+        self.client.get("/admin/profiles/")
+        form = UserProfileForm(
+            {"username": "role-admin", "email": "admin@example.com", "role": "customer"},
+            instance=self.admin,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+
+        response = self.client.get("/admin/profiles/")
+        self.assertRedirects(response, "/accounts/login/?next=/admin/profiles/", fetch_redirect_response=False)
+
+    def test_dashboard_stats_are_fragment_cached(self):
+        self.client.get("/admin/dashboard/")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/dashboard/")
+        self.assertFalse(any("COUNT(" in q["sql"] for q in queries.captured_queries))
+        self.assertContains(response, "Total Orders")
+
+
+@override_settings(ORDER_LIST_CACHE={"ENABLED": True})
+class OrderListCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user("list-customer")
+        self.order = Order.objects.create(
+            customer=self.customer, receiver_name="R", receiver_address="A", amount=Decimal("5.00")
+        )
+        self.client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.customer).access_token}")
+
+    def list_orders(self, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/orders/", headers=headers)
+        return response, len(queries)
+
+    def test_repeat_reads_are_served_from_the_cache_with_an_etag(self):
+        first, _ = self.list_orders()
+        second, queries = self.list_orders()
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(queries, 1)  # The JWT user only
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second["Cache-Control"], "private, no-cache")
+
+        not_modified, queries = self.list_orders(if_none_match=f'"x", {first["ETag"].removeprefix("W/")}')
+        self.assertEqual((not_modified.status_code, not_modified.content, queries), (304, b"", 1))
+        self.assertEqual(not_modified["ETag"], first["ETag"])
+
+        other = User.objects.create_user("other-customer")
+        Order.objects.create(customer=other, receiver_name="R", receiver_address="A", amount=Decimal("1.00"))
+        self.assertEqual(self.list_orders(if_none_match=first["ETag"])[0].status_code, 304)
+
+    def test_every_order_change_invalidates_the_list(self):
+        def archive_order():
+            Order.objects.filter(pk=self.order.pk).update(updated_at=timezone.now() - timedelta(days=365))
+            archive.archive_orders()
+
+        changes = [
+            lambda: self.client.post(
+                "/api/v1/orders/", {"receiver_name": "New", "receiver_address": "B", "amount": "2.00"}
+            ),
+            lambda: self.order.update_status("in_transit"),
+            lambda: self.order.mark_as_paid(),
+            lambda: bulk.cancel_orders([self.order.pk]),
+            archive_order,
+        ]
+        previous, _ = self.list_orders()
+        for change in changes:
+            change()
+            response, _ = self.list_orders(if_none_match=previous["ETag"])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], previous["ETag"])
+            previous = response
+
+        listed = {order["id"]: order for order in previous.json()}
+        self.assertEqual(len(listed), 2)
+        self.assertEqual(
+            (listed[self.order.pk]["status"], listed[self.order.pk]["payment_status"]), ("cancelled", "paid")
+        )
+        self.assertIn("archived_at", listed[self.order.pk])
+
+    def test_a_page_built_before_the_commit_is_discarded_when_it_commits(self):
+        self.list_orders()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.update_status("in_transit")
+            # A concurrent request reads the new version but still sees the uncommitted order as pending
+            version = order_cache.get_version(self.customer.pk)
+            cache.set(order_cache.page_key(self.customer.pk, version), [{"id": self.order.pk, "status": "pending"}])
+        self.assertNotEqual(order_cache.get_version(self.customer.pk), version)
+        self.assertEqual(self.list_orders()[0].json()[0]["status"], "in_transit")
+
+    def test_an_evicted_version_never_restarts_at_an_old_value(self):
+        version = order_cache.get_version(self.customer.pk)
+        cache.delete(order_cache.version_key(self.customer.pk))
+        self.assertGreater(order_cache.get_version(self.customer.pk), version)
+
+    @override_settings(ORDER_LIST_CACHE={"ENABLED": False})
+    def test_disabled_cache_queries_every_time(self):
+        self.list_orders()
+        response, queries = self.list_orders()
+        self.assertEqual(queries, 3)
+        self.assertNotIn("ETag", response)
+
+
+class BoundedLocMemCacheTests(TestCase):
+    def setUp(self):
+        self.cache = BoundedLocMemCache("bounded-test", {"OPTIONS": {"MAX_BYTES": 300, "MAX_ENTRIES": 100}})
+        self.cache.clear()
+
+    def test_least_recently_used_entries_are_evicted_beyond_max_bytes(self):
+        for key in "abc":
+            self.cache.set(key, "x" * 80)
+        self.cache.get("a")
+        self.cache.set("d", "x" * 80)
+        self.assertEqual([key for key in "abcd" if self.cache.get(key) is not None], ["a", "c", "d"])
+        self.assertLessEqual(self.cache.bytes_used, 300)
+
+        self.cache.set("a", "x" * 400)  # Larger than the whole cache
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.delete("c")
+        self.cache.set("counter", 1)
+        self.cache.incr("counter")
+        self.assertEqual(self.cache.bytes_used, sum(len(value) for value in self.cache._cache.values()))
+        self.cache.clear()
+        self.assertEqual(self.cache.bytes_used, 0)
+
+
+class SeedCourierDataCommandTests(TestCase):
+    def test_seeds_related_rows_and_courier_aggregates(self):
+        call_command(
+            "seed_courier_data", customers=20, couriers=5, orders=500, batch_size=128, seed=7,
+            stdout=io.StringIO(),
+        )
+
+        self.assertEqual(Order.objects.count(), 500)
+        self.assertEqual(UserProfile.objects.filter(role="customer").count(), 20)
+        self.assertEqual(DeliveryBoy.objects.count(), 5)
+        self.assertFalse(Delivery.objects.filter(order__status="pending").exists())
+        self.assertEqual(
+            Delivery.objects.filter(status="delivered").count(),
+            Order.objects.filter(status="delivered").count(),
+        )
+        courier = DeliveryBoy.objects.order_by("-total_deliveries").first()
+        self.assertEqual(courier.total_deliveries, courier.deliveries.count())
+        self.assertGreater(courier.rating, 0)
+
+        # Explicit ids must leave the sequences usable for regular inserts
+        order = Order.objects.create(
+            customer=User.objects.filter(profile__role="customer").first(),
+            receiver_name="After seed", receiver_address="Somewhere", amount=Decimal("1.00"),
+        )
+        self.assertGreater(order.pk, 500)
+
+
+class QueryInstrumentationMiddlewareTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("tracker", "tracker@example.com", "pass")
+        self.order = Order.objects.create(
+            customer=user, receiver_name="R", receiver_address="A", amount=Decimal("5.00")
+        )
+
+    def test_server_timing_header_reports_db_time(self):
+        response = self.client.get(f"/api/v1/track/{self.order.barcode}/")
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="1 queries", app;dur=')
+
+    @override_settings(SQL_INSTRUMENTATION={"SLOW_REQUEST_MS": 0})
+    def test_slow_requests_are_logged_with_normalized_sql(self):
+        with self.assertLogs("courier.sql", "WARNING") as logs:
+            Client().get(f"/api/v1/track/{self.order.barcode}/")
+        record = logs.records[0].sql_stats
+        self.assertEqual(record["queries"], 1)
+        self.assertIn("WHERE \"courier_order\".\"barcode\" = ?", record["slowest"][0]["sql"])
+
+    def test_repeated_queries_are_reported_with_their_template_line(self):
+        couriers = DeliveryBoy.objects.bulk_create([
+            DeliveryBoy(user=user) for user in User.objects.bulk_create([
+                User(username=f"n-plus-one-{i}") for i in range(6)
+            ])
+        ])
+        template = Template("{% for courier in couriers %}{{ courier.user.username }}{% endfor %}")
+
+        def render(request):
+            return HttpResponse(template.render(Context({"couriers": DeliveryBoy.objects.order_by("id")})))
+
+        with override_settings(SQL_INSTRUMENTATION={"REPEATED_QUERIES": "raise"}):
+            with self.assertRaisesMessage(RepeatedQueriesError, "auth_user"):
+                QueryInstrumentationMiddleware(render)(RequestFactory().get("/couriers/"))
+
+        with override_settings(SQL_INSTRUMENTATION={"REPEATED_QUERIES": "log"}), \
+                self.assertLogs("courier.sql", "WARNING") as logs:
+            QueryInstrumentationMiddleware(render)(RequestFactory().get("/couriers/"))
+        offender = logs.records[0].sql_stats["repeated"][0]
+        self.assertEqual(offender["count"], len(couriers))
+        self.assertIn('FROM "auth_user" WHERE "auth_user"."id" = ?', offender["sql"])
+        self.assertEqual(offender["template"], "<unknown source>:1")
+        self.assertTrue(offender["location"].startswith("courier/tests.py:"))
+
+        with override_settings(SQL_INSTRUMENTATION={"REPEATED_QUERIES": "raise"}):
+            joined = DeliveryBoy.objects.select_related("user").order_by("id")
+            QueryInstrumentationMiddleware(lambda request: HttpResponse(
+                template.render(Context({"couriers": joined}))
+            ))(RequestFactory().get("/couriers/"))
+
+    @override_settings(SQL_INSTRUMENTATION={"ENABLED": False})
+    def test_disabled_middleware_is_not_installed(self):
+        response = Client().get("/api/v1/")
+        self.assertNotIn("Server-Timing", response)
+
+    def test_normalize_sql_collapses_literals_and_in_lists(self):
+        self.assertEqual(
+            normalize_sql("SELECT *  FROM t WHERE a = 'x' AND b IN (%s, %s, %s) LIMIT 21"),
+            "SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?",
+        )
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.metrics_dir.cleanup)
+        override = override_settings(METRICS={"DIRECTORY": self.metrics_dir.name, "REQUIRE_TOKEN": False})
+        override.enable()
+        self.addCleanup(override.disable)
+        user = User.objects.create_user("merchant", "merchant@example.com", "pass")
+        self.order = Order.objects.create(
+            customer=user, receiver_name="R", receiver_address="A", amount=Decimal("5.00")
+        )
+
+    def sample(self, text, line_prefix):
+        for line in text.splitlines():
+            if line.startswith(line_prefix):
+                return float(line.rsplit(" ", 1)[1])
+        return 0.0
+
+    def test_request_latency_and_business_counters_are_exposed(self):
+        before = self.sample(metrics.registry.render(), 'courier_payment_actions_total{action="pay",result="success"}')
+        self.client.get(f"/api/v1/track/{self.order.barcode}/")
+        self.order.mark_as_paid()
+        self.order.update_status("in_transit")
+
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn("# TYPE courier_http_request_duration_seconds histogram", body)
+        self.assertIn('courier_http_request_duration_seconds_bucket{view="track_order",method="GET",status="200",le="+Inf"}', body)
+        self.assertIn('courier_order_status_transitions_total{from_status="pending",to_status="in_transit"}', body)
+        self.assertEqual(
+            self.sample(body, 'courier_payment_actions_total{action="pay",result="success"}'), before + 1
+        )
+
+    def test_values_from_other_worker_files_are_merged(self):
+        key = ["pending", "cancelled"]
+        own = self.sample(metrics.registry.render(), 'courier_order_status_transitions_total{from_status="pending",to_status="cancelled"}')
+        # One live worker (the parent process) and one that has exited
+        for pid, in_flight in ((os.getppid(), 3), (2 ** 22 + 1, 5)):
+            with open(os.path.join(self.metrics_dir.name, metrics.process_filename(pid)), "w") as fh:
+                json.dump({
+                    "courier_order_status_transitions_total": [[key, 2]],
+                    "courier_http_requests_in_flight": [[[], in_flight]],
+                }, fh)
+
+        body = metrics.registry.render()
+        self.assertEqual(
+            self.sample(body, 'courier_order_status_transitions_total{from_status="pending",to_status="cancelled"}'),
+            own + 4,
+        )
+        # Gauges of exited workers are dropped
+        self.assertEqual(self.sample(body, "courier_http_requests_in_flight "), 3)
+
+    @override_settings(METRICS={"TOKEN": "secret"})
+    def test_metrics_token_is_enforced(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secre").status_code, 403)
+        with mock.patch("courier.metrics.hmac.compare_digest", wraps=hmac.compare_digest) as compare:
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        compare.assert_called_once()
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS={"TOKEN": ""})
+    def test_metrics_are_refused_without_a_token_outside_development(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    def test_exited_workers_are_folded_into_the_archive(self):
+        line = 'courier_order_status_transitions_total{from_status="pending",to_status="cancelled"}'
+        own = self.sample(metrics.registry.render(), line)
+        dead_pid = 2 ** 22 + 1
+        path = os.path.join(self.metrics_dir.name, metrics.process_filename(dead_pid))
+        for token in ("first", "second"):  # The pid is reused by a later process
+            with open(path, "w") as fh:
+                json.dump({"courier_order_status_transitions_total": [[["pending", "cancelled"], 2]],
+                           "courier_http_requests_in_flight": [[[], 5]], "_process": token}, fh)
+            self.assertEqual(self.sample(metrics.registry.render(), line), own + (2 if token == "first" else 4))
+            metrics.registry.merge_exited(self.metrics_dir.name, dead_pid)
+            self.assertFalse(os.path.exists(path))
+
+        body = metrics.registry.render()
+        self.assertEqual(self.sample(body, line), own + 4)
+        self.assertEqual(self.sample(body, "courier_http_requests_in_flight "), 0)
+        self.assertEqual(sorted(os.listdir(self.metrics_dir.name)), ["archive.json", "archive.lock"])
+
+    def test_a_file_being_folded_in_is_not_counted_twice(self):
+        line = 'courier_order_status_transitions_total{from_status="pending",to_status="cancelled"}'
+        own = self.sample(metrics.registry.render(), line)
+        path = os.path.join(self.metrics_dir.name, metrics.process_filename(4194305))
+        with open(path, "w") as fh:
+            json.dump({"courier_order_status_transitions_total": [[["pending", "cancelled"], 2]],
+                       "_process": "dying"}, fh)
+        with mock.patch.object(metrics.os, "unlink"):  # Archive written, file not removed yet
+            metrics.registry.merge_exited(self.metrics_dir.name, 4194305)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.sample(metrics.registry.render(), line), own + 2)
+
+    def test_files_of_other_containers_are_merged_and_their_gauges_expire(self):
+        line = 'courier_order_status_transitions_total{from_status="pending",to_status="cancelled"}'
+        own = self.sample(metrics.registry.render(), line)
+        # Worker and scheduler containers both run as pid 1 in their own namespace
+        for host, age in (("worker-container", 0), ("scheduler-container", 600)):
+            path = os.path.join(self.metrics_dir.name, f"{host}-1.json")
+            with open(path, "w") as fh:
+                json.dump({"courier_order_status_transitions_total": [[["pending", "cancelled"], 1]],
+                           "courier_http_requests_in_flight": [[[], 2]], "_process": host}, fh)
+            os.utime(path, (time.time() - age, time.time() - age))
+
+        body = metrics.registry.render()
+        self.assertEqual(self.sample(body, line), own + 2)
+        self.assertEqual(self.sample(body, "courier_http_requests_in_flight "), 2)  # Only the fresh file
+
+    def test_a_restarted_process_keeps_the_totals_of_its_predecessor(self):
+        line = 'courier_order_status_transitions_total{from_status="pending",to_status="cancelled"}'
+        own = self.sample(metrics.registry.render(), line)
+        path = os.path.join(self.metrics_dir.name, metrics.process_filename(os.getpid()))
+        with open(path, "w") as fh:  # Left by the previous container run with the same pid
+            json.dump({"courier_order_status_transitions_total": [[["pending", "cancelled"], 3]],
+                       "_process": "previous"}, fh)
+        self.addCleanup(setattr, metrics.registry, "claimed", metrics.registry.claimed)
+        metrics.registry.claimed = False
+        metrics.registry.flush(self.metrics_dir.name)
+        self.assertEqual(self.sample(metrics.registry.render(), line), own + 3)
+        metrics.registry.flush(self.metrics_dir.name)
+        self.assertEqual(self.sample(metrics.registry.render(), line), own + 3)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        override = override_settings(PROFILING={"ENABLED": True, "DIRECTORY": self.profile_dir.name})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.admin = User.objects.create_user("profiler-admin", "a@example.com", "pass")
+        UserProfile.objects.create(user=self.admin, role="admin")
+
+    def test_admin_query_flag_writes_folded_profile(self):
+        self.client.force_login(self.admin)
+        response = self.client.get("/admin/dashboard/?__profile=1")
+
+        name = response["X-Courier-Profile-Id"]
+        self.assertTrue(name.endswith(".folded"))
+        self.assertTrue(os.path.isfile(os.path.join(self.profile_dir.name, name)))
+        listing = self.client.get("/admin/profiles/")
+        self.assertContains(listing, name)
+        download = self.client.get(f"/admin/profiles/{name}/")
+        self.assertEqual(download.status_code, 200)
+
+    def test_query_flag_is_ignored_for_non_admins(self):
+        response = self.client.get("/api/v1/?__profile=1")
+        self.assertNotIn("X-Courier-Profile-Id", response)
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+
+    def test_signed_header_profiles_api_requests(self):
+        with self.settings(PROFILING={"ENABLED": True, "DIRECTORY": self.profile_dir.name, "MODE": "cprofile"}):
+            response = Client().get(
+                "/api/v1/", HTTP_X_COURIER_PROFILE=profiling.make_profile_token(self.admin)
+            )
+            forged = Client().get("/api/v1/", HTTP_X_COURIER_PROFILE="profile:forged")
+        self.assertTrue(response["X-Courier-Profile-Id"].endswith(".prof"))
+        self.assertNotIn("X-Courier-Profile-Id", forged)
+
+    def test_profile_tokens_are_bound_to_an_admin(self):
+        customer = User.objects.create_user("profiler-customer", "c@example.com", "pass")
+        token = profiling.make_profile_token(self.admin)
+        self.client.force_login(customer)
+        self.assertNotIn("X-Courier-Profile-Id", self.client.get("/api/v1/", HTTP_X_COURIER_PROFILE=token))
+        self.assertNotIn("X-Courier-Profile-Id",
+                         Client().get("/api/v1/", HTTP_X_COURIER_PROFILE=profiling.make_profile_token(customer)))
+        self.assertIn("X-Courier-Profile-Id", Client().get("/api/v1/", HTTP_X_COURIER_PROFILE=token))
+
+        UserProfile.objects.filter(user=self.admin).update(role="customer")
+        self.assertNotIn("X-Courier-Profile-Id", Client().get("/api/v1/", HTTP_X_COURIER_PROFILE=token))
+
+    def test_profiles_pruned_while_listing_are_skipped(self):
+        for name in ("a.folded", "b.folded"):
+            Path(self.profile_dir.name, name).write_text("main 1\n")
+        real_stat = os.stat
+
+        def stat(path, *args, **kwargs):
+            if path.endswith("a.folded"):
+                raise FileNotFoundError(path)
+            return real_stat(path, *args, **kwargs)
+
+        with mock.patch("courier.profiling.os.stat", side_effect=stat):
+            self.assertEqual([profile["name"] for profile in profiling.recent_profiles()], ["b.folded"])
+            profiling.prune_profiles(self.profile_dir.name, keep=0)
+        self.assertEqual(os.listdir(self.profile_dir.name), ["a.folded"])
+
+    def test_requests_are_served_unprofiled_while_another_cprofile_session_runs(self):
+        with self.settings(PROFILING={"ENABLED": True, "DIRECTORY": self.profile_dir.name, "MODE": "cprofile"}):
+            busy = profiling.CProfileProfiler()
+            self.assertTrue(busy.start())
+            try:
+                response = Client().get("/api/v1/", HTTP_X_COURIER_PROFILE=profiling.make_profile_token(self.admin))
+            finally:
+                busy.stop()
+            after = Client().get("/api/v1/", HTTP_X_COURIER_PROFILE=profiling.make_profile_token(self.admin))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Courier-Profile-Id", response)
+        self.assertIn("X-Courier-Profile-Id", after)
+
+    def test_unknown_profile_names_are_rejected(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get("/admin/profiles/..%2Fsettings.py/").status_code, 404)
+
+
+def write_report(results):
+    """Write the benchmark results as JSON so runs can be compared over time"""
+    report_dir = Path(BENCHMARK_REPORT_DIR)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    generated_at = datetime.now(dt_timezone.utc)
+    report = {
+        "generated_at": generated_at.isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "latency_factor": BENCHMARK_LATENCY_FACTOR,
+        "endpoints": dict(sorted(results.items())),
+    }
+    path = report_dir / f"benchmark-{generated_at:%Y%m%dT%H%M%S}.json"
+    path.write_text(json.dumps(report, indent=2))
+    (report_dir / "latest.json").write_text(json.dumps(report, indent=2))
+    return path
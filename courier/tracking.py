@@ -0,0 +1,44 @@
+"""
+Public order tracking by barcode, one parcel or a batch at a time.
+
+``track()`` resolves a list of barcodes with one ``IN`` query on the hot
+orders and, only for the ones not found there, one on the archive. Barcodes
+the barcode filter knows to be unknown never reach the database. Results use
+TrackingSerializer, like single-barcode tracking, so both endpoints expose the
+same public fields for hot and archived orders.
+"""
+
+from django.conf import settings
+
+from . import barcode_filter
+from .models import ArchivedOrder, Order
+from .serializers import TrackingSerializer
+
+
+DEFAULT_TRACKING = {
+    "MAX_BATCH": 500,
+}
+
+
+def get_tracking_settings():
+    return {**DEFAULT_TRACKING, **getattr(settings, "TRACKING", {})}
+
+
+def track(barcodes):
+    """Tracking data by barcode for the orders found, and the barcodes that matched none"""
+    barcodes = list(dict.fromkeys(barcodes))
+    wanted = barcode_filter.possible_barcodes(barcodes)
+    found = {}
+    for model in (Order, ArchivedOrder):
+        remaining = [barcode for barcode in wanted if barcode not in found]
+        if not remaining:
+            break
+        orders = model.objects.filter(barcode__in=remaining)
+        for data in TrackingSerializer(orders, many=True).data:
+            found[data["barcode"]] = data
+
+    barcode_filter.record_false_positive(sum(1 for barcode in wanted if barcode not in found))
+    return (
+        {barcode: found[barcode] for barcode in barcodes if barcode in found},
+        [barcode for barcode in barcodes if barcode not in found],
+    )
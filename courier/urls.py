@@ -2,11 +2,27 @@ from django.urls import path
 from .views import (
     RegisterView,
     OrderListCreateView,
+    ArchivedOrderListView,
     TrackOrderView,
+    TrackBatchView,
     CustomTokenObtainPairView,
     CustomTokenRefreshView,
     OrderStatusUpdateView,
-    OrderPaymentUpdateView
+    OrderStatusBatchView,
+    OrderPaymentUpdateView,
+    AvailableDeliveryBoysView,
+    DeliveryAssignView,
+    DeliveryReassignView,
+    CourierDeliveryListView,
+    CourierDeliveryActionView,
+    CourierQueueClaimView,
+    CourierQueueTakeView,
+    CourierQueueReleaseView,
+    CourierSyncView,
+    DailyReportView,
+    CourierReportView,
+    WebhookEndpointListCreateView,
+    WebhookEndpointDetailView
 )
 
 app_name = 'courier'
@@ -16,7 +32,23 @@ urlpatterns = [
     path('token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
     path('orders/', OrderListCreateView.as_view(), name='orders'),
+    path('orders/archived/', ArchivedOrderListView.as_view(), name='archived_orders'),
+    path('orders/status/batch/', OrderStatusBatchView.as_view(), name='order_status_batch'),
     path('orders/<int:pk>/status/', OrderStatusUpdateView.as_view(), name='order_status_update'),
     path('orders/<int:pk>/payment/', OrderPaymentUpdateView.as_view(), name='order_payment_update'),
+    path('track/', TrackBatchView.as_view(), name='track_batch'),
     path('track/<str:barcode>/', TrackOrderView.as_view(), name='track_order'),
+    path('delivery-boys/available/', AvailableDeliveryBoysView.as_view(), name='available_delivery_boys'),
+    path('deliveries/assign/', DeliveryAssignView.as_view(), name='delivery_assign'),
+    path('deliveries/<int:pk>/reassign/', DeliveryReassignView.as_view(), name='delivery_reassign'),
+    path('courier/deliveries/', CourierDeliveryListView.as_view(), name='courier_deliveries'),
+    path('courier/deliveries/<int:pk>/<slug:action>/', CourierDeliveryActionView.as_view(), name='courier_delivery_action'),
+    path('courier/queue/claim/', CourierQueueClaimView.as_view(), name='courier_queue_claim'),
+    path('courier/queue/take/', CourierQueueTakeView.as_view(), name='courier_queue_take'),
+    path('courier/queue/release/', CourierQueueReleaseView.as_view(), name='courier_queue_release'),
+    path('courier/sync/', CourierSyncView.as_view(), name='courier_sync'),
+    path('reports/daily/', DailyReportView.as_view(), name='report_daily'),
+    path('reports/couriers/', CourierReportView.as_view(), name='report_couriers'),
+    path('webhooks/', WebhookEndpointListCreateView.as_view(), name='webhooks'),
+    path('webhooks/<int:pk>/', WebhookEndpointDetailView.as_view(), name='webhook_detail'),
 ]
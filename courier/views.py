@@ -1,9 +1,26 @@
-from rest_framework import generics
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags
+from rest_framework import generics, serializers
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .models import Order
-from .serializers import RegisterSerializer, OrderSerializer, CustomTokenObtainPairSerializer
+from . import archive, barcode_filter, bulk, order_cache, pull_queue, rollups, sync, tracking
+from .idempotency import idempotent
+from .models import ArchivedOrder, Delivery, DeliveryBoy, Order, WebhookEndpoint
+from .pagination import SeekPaginator
+from .permissions import IsAdminRole, IsDeliveryBoyRole
+from .roles import get_role
+from .serializers import (
+    RegisterSerializer, OrderSerializer, ArchivedOrderSerializer, CustomTokenObtainPairSerializer,
+    AvailableDeliveryBoySerializer, OrderStatusBatchItemSerializer, WebhookEndpointSerializer,
+    CourierDeliverySerializer, DeliveryTombstoneSerializer, QueuedOrderSerializer, TrackingSerializer
+)
 from rest_framework.permissions import IsAuthenticated
 
 
@@ -13,6 +30,17 @@ class RegisterView(generics.CreateAPIView):
     permission_classes = []  # Allow unauthenticated registration
 
 
+def etag_matches(etag, if_none_match):
+    """Weak comparison of If-None-Match with ``etag``"""
+    if not if_none_match:
+        return False
+    tags = parse_etags(if_none_match)
+    return '*' in tags or etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in tags}
+
+
+ARCHIVED_ORDERING = ['-created_at', '-id']
+
+
 # List/Create Orders
 class OrderListCreateView(generics.ListCreateAPIView):
     serializer_class = OrderSerializer
@@ -21,10 +49,52 @@ class OrderListCreateView(generics.ListCreateAPIView):
     def get_queryset(self):
         return Order.objects.filter(customer=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        if not order_cache.get_order_list_cache_settings()['ENABLED']:
+            return Response(self.list_data())
+        # The version is read before the orders, see courier/order_cache.py
+        version = order_cache.get_version(request.user.pk)
+        etag = order_cache.etag(request.user.pk, version)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag_matches(etag, request.headers.get('If-None-Match')):
+            return Response(status=304, headers=headers)
+        return Response(order_cache.cached_list(request.user.pk, version, self.list_data), headers=headers)
+
+    def list_data(self):
+        data = self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+        # The latest archived orders are still part of the customer's history; older ones are paged
+        # through ArchivedOrderListView so a long history does not grow this response without bound
+        limit = archive.get_archive_settings()['LIST_LIMIT']
+        archived = ArchivedOrder.objects.filter(customer=self.request.user).order_by(*ARCHIVED_ORDERING)[:limit]
+        return data + ArchivedOrderSerializer(archived, many=True).data
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(customer=self.request.user)
 
 
+# Archived orders of the customer, newest first, LIST_LIMIT per page behind a keyset cursor
+class ArchivedOrderListView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        paginator = SeekPaginator(
+            ArchivedOrder.objects.filter(customer=request.user), archive.get_archive_settings()['LIST_LIMIT'],
+            ARCHIVED_ORDERING,
+        )
+        cursor = request.query_params.get('cursor')
+        if cursor and paginator.decode_cursor(cursor) is None:
+            return Response({"error": "Invalid cursor"}, status=400)
+        page = paginator.get_page(after=cursor)
+        return Response({
+            "orders": ArchivedOrderSerializer(page.object_list, many=True).data,
+            "cursor": page.next_cursor,
+        })
+
+
 # Custom Token Obtain View
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
@@ -56,10 +126,47 @@ class OrderStatusUpdateView(APIView):
             return Response({"error": "Invalid status transition"}, status=400)
 
 
+# Apply many status changes at once (scanners, offline courier shifts, partners)
+class OrderStatusBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        role = get_role(self.request)
+        if role == 'admin':
+            return Order.objects.all()
+        if role == 'delivery_boy':
+            return Order.objects.filter(delivery__delivery_boy__user=self.request.user)
+        return Order.objects.filter(customer=self.request.user)
+
+    def post(self, request):
+        items = request.data.get('updates') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "updates must be a non-empty list"}, status=400)
+        if len(items) > bulk.MAX_STATUS_BATCH:
+            return Response({"error": f"At most {bulk.MAX_STATUS_BATCH} updates per request"}, status=400)
+
+        # One serializer instance validates every item; invalid items are reported, not fatal
+        item_serializer = OrderStatusBatchItemSerializer()
+        entries, results = [], {}
+        for index, item in enumerate(items):
+            try:
+                entries.append((index, item_serializer.run_validation(item)))
+            except serializers.ValidationError as e:
+                results[index] = {"outcome": "invalid", "errors": e.detail}
+
+        if entries:
+            results.update(bulk.apply_order_status_batch(self.get_queryset(), entries))
+        return Response({
+            "updated": sum(1 for result in results.values() if result["outcome"] == "updated"),
+            "results": [{"index": index, **results[index]} for index in range(len(items))],
+        })
+
+
 # Update Payment Status
 class OrderPaymentUpdateView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def patch(self, request, pk):
         try:
             order = Order.objects.get(pk=pk, customer=request.user)
@@ -88,9 +195,271 @@ class TrackOrderView(APIView):
     permission_classes = []  # Allow public access
 
     def get(self, request, barcode):
+        # Unknown barcodes (typos, enumeration) are rejected without a query
+        if not barcode_filter.might_exist(barcode):
+            return Response({"error": "Order not found"}, status=404)
         try:
             order = Order.objects.get(barcode=barcode)
-            serializer = OrderSerializer(order)
-            return Response(serializer.data)
+            return Response(TrackingSerializer(order).data)
         except Order.DoesNotExist:
+            pass
+        try:
+            archived = ArchivedOrder.objects.get(barcode=barcode)
+            return Response(TrackingSerializer(archived).data)
+        except ArchivedOrder.DoesNotExist:
+            barcode_filter.record_false_positive()
             return Response({"error": "Order not found"}, status=404)
+
+
+# Track many parcels in one request (warehouse scanners, partner portals)
+class TrackBatchView(APIView):
+    permission_classes = []  # Allow public access
+
+    def post(self, request):
+        barcodes = request.data.get('barcodes') if isinstance(request.data, dict) else request.data
+        if (not isinstance(barcodes, list) or not barcodes
+                or not all(isinstance(barcode, str) and barcode for barcode in barcodes)):
+            return Response({"error": "barcodes must be a non-empty list of strings"}, status=400)
+        max_batch = tracking.get_tracking_settings()["MAX_BATCH"]
+        if len(barcodes) > max_batch:
+            return Response({"error": f"At most {max_batch} barcodes per request"}, status=400)
+
+        found, missing = tracking.track(barcodes)
+        return Response({"orders": found, "missing": missing})
+
+
+# Couriers that can take new deliveries (admin dashboard)
+class AvailableDeliveryBoysView(generics.ListAPIView):
+    serializer_class = AvailableDeliveryBoySerializer
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminRole]
+    pagination_class = None
+
+    def get_queryset(self):
+        return (
+            DeliveryBoy.objects.filter(is_available=True)
+            .select_related('user')
+            .only('id', 'vehicle_type', 'vehicle_number', 'current_location',
+                  'user__id', 'user__username', 'user__first_name', 'user__last_name')
+            .order_by('user__first_name', 'user__last_name', 'id')
+        )
+
+
+# Assign one or more pending orders to a courier (admin dashboard)
+class DeliveryAssignView(APIView):
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminRole]
+
+    def post(self, request):
+        # Form posts repeat order_ids (or send a single order_id); JSON bodies send a list
+        if hasattr(request.data, 'getlist'):
+            values = request.data.getlist('order_ids') or request.data.getlist('order_id')
+        else:
+            values = request.data.get('order_ids') or request.data.get('order_id')
+        try:
+            order_ids = bulk.parse_ids(values if isinstance(values, list) else [values])
+        except ValueError as e:
+            return Response({"success": False, "error": str(e)}, status=400)
+        if not order_ids:
+            return Response({"success": False, "error": "order_id or order_ids is required"}, status=400)
+
+        try:
+            delivery_boy = DeliveryBoy.objects.get(pk=request.data.get('delivery_boy_id'))
+        except (DeliveryBoy.DoesNotExist, ValueError, TypeError):
+            return Response({"success": False, "error": "Delivery boy not found"}, status=404)
+
+        result = bulk.assign_orders(order_ids, delivery_boy, notes=request.data.get('notes') or '')
+        data = {"success": bool(result.updated), **result.as_dict()}
+        if not result.updated:
+            data["error"] = "No order could be assigned"
+            return Response(data, status=400)
+        return Response(data)
+
+
+# Reassign an unfinished delivery to another courier (admin dashboard)
+class DeliveryReassignView(APIView):
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminRole]
+
+    def post(self, request, pk):
+        try:
+            delivery = Delivery.objects.select_related('order').get(pk=pk)
+        except Delivery.DoesNotExist:
+            return Response({"error": "Delivery not found"}, status=404)
+        try:
+            delivery_boy = DeliveryBoy.objects.get(pk=request.data.get('delivery_boy_id'))
+        except (DeliveryBoy.DoesNotExist, ValueError, TypeError):
+            return Response({"error": "Delivery boy not found"}, status=404)
+
+        if delivery.reassign(delivery_boy):
+            return Response(CourierDeliverySerializer(delivery).data)
+        return Response({"error": "Only unfinished deliveries can move to another courier"}, status=400)
+
+
+# Courier app: endpoints scoped to the requesting courier's deliveries
+class CourierAPIView(APIView):
+    permission_classes = [IsDeliveryBoyRole]
+
+    def get_delivery_boy(self):
+        try:
+            return DeliveryBoy.objects.only('id').get(user=self.request.user)
+        except DeliveryBoy.DoesNotExist:
+            raise PermissionDenied("No courier profile for this user")
+
+
+class CourierDeliveryListView(CourierAPIView):
+    """Deliveries the courier still has to complete"""
+
+    def get(self, request):
+        deliveries = sync.active_deliveries(self.get_delivery_boy())
+        return Response(CourierDeliverySerializer(deliveries, many=True).data)
+
+
+class CourierDeliveryActionView(CourierAPIView):
+    ACTIONS = {
+        'accept': lambda delivery, request: delivery.mark_accepted(),
+        'pick-up': lambda delivery, request: delivery.mark_picked_up(),
+        'deliver': lambda delivery, request: delivery.mark_delivered(),
+        'fail': lambda delivery, request: delivery.mark_failed(notes=request.data.get('notes')),
+    }
+
+    @idempotent
+    def post(self, request, pk, action):
+        if action not in self.ACTIONS:
+            return Response({"error": "Unknown action"}, status=404)
+        try:
+            delivery = Delivery.objects.select_related('order').get(pk=pk, delivery_boy__user=request.user)
+        except Delivery.DoesNotExist:
+            return Response({"error": "Delivery not found"}, status=404)
+
+        if self.ACTIONS[action](delivery, request):
+            return Response(CourierDeliverySerializer(delivery).data)
+        return Response({"error": "Invalid status transition"}, status=400)
+
+
+class CourierQueueClaimView(CourierAPIView):
+    """Reserve the oldest pending orders for the courier (see courier/pull_queue.py)"""
+
+    def post(self, request):
+        max_claims = pull_queue.get_courier_queue_settings()['MAX_CLAIMS']
+        try:
+            count = int(request.data.get('count', max_claims))
+        except (TypeError, ValueError):
+            count = 0
+        if not 1 <= count <= max_claims:
+            return Response({"error": f"count must be between 1 and {max_claims}"}, status=400)
+        orders = pull_queue.claim(self.get_delivery_boy(), count)
+        return Response({"orders": QueuedOrderSerializer(orders, many=True).data})
+
+
+class CourierQueueOrdersView(CourierAPIView):
+    def get_order_ids(self, request):
+        values = request.data.get('order_ids') if isinstance(request.data, dict) else None
+        try:
+            order_ids = bulk.parse_ids(values) if isinstance(values, list) else []
+        except ValueError as e:
+            raise serializers.ValidationError({"error": str(e)})
+        if not order_ids:
+            raise serializers.ValidationError({"error": "order_ids must be a non-empty list of ids"})
+        return order_ids
+
+
+class CourierQueueTakeView(CourierQueueOrdersView):
+    """Turn claimed orders into deliveries of the courier"""
+
+    @idempotent
+    def post(self, request):
+        delivery_boy = self.get_delivery_boy()
+        result = pull_queue.take(delivery_boy, self.get_order_ids(request))
+        if not result.updated:
+            return Response({"error": "No claimed order could be taken", **result.as_dict()}, status=400)
+        deliveries = sync.courier_deliveries(delivery_boy).filter(order_id__in=result.updated).order_by('id')
+        return Response({"deliveries": CourierDeliverySerializer(deliveries, many=True).data, **result.as_dict()})
+
+
+class CourierQueueReleaseView(CourierQueueOrdersView):
+    """Give claimed orders back to the queue"""
+
+    def post(self, request):
+        released = pull_queue.release(self.get_delivery_boy(), self.get_order_ids(request))
+        return Response({"released": released})
+
+
+class CourierSyncView(CourierAPIView):
+    """Deliveries changed and removed since the cursor of the previous sync"""
+
+    def get(self, request):
+        try:
+            changes = sync.changes_since(self.get_delivery_boy(), request.query_params.get('cursor'))
+        except sync.CursorExpired as e:
+            return Response({"error": str(e)}, status=410)
+        except sync.InvalidCursor as e:
+            return Response({"error": str(e)}, status=400)
+        return Response({
+            "deliveries": CourierDeliverySerializer(changes["deliveries"], many=True).data,
+            "removed": DeliveryTombstoneSerializer(changes["removed"], many=True).data,
+            "cursor": changes["cursor"],
+            "has_more": changes["has_more"],
+        })
+
+
+# Reports read from the daily rollups (see courier/rollups.py), never from the order tables
+class ReportView(APIView):
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminRole]
+
+    def get_range(self, request):
+        """Days from ?from= to ?to= (YYYY-MM-DD), the last 30 days by default"""
+        end = timezone.localdate()
+        start = end - timedelta(days=29)
+        try:
+            if request.query_params.get('to'):
+                end = parse_date(request.query_params['to'])
+            if request.query_params.get('from'):
+                start = parse_date(request.query_params['from'])
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            raise serializers.ValidationError({"error": "from and to must be dates (YYYY-MM-DD)"})
+        if start > end or (end - start).days >= rollups.MAX_REPORT_DAYS:
+            raise serializers.ValidationError(
+                {"error": f"from must not be after to, and the range is limited to {rollups.MAX_REPORT_DAYS} days"}
+            )
+        return start, end
+
+    def get(self, request):
+        start, end = self.get_range(request)
+        return Response({"from": start, "to": end, "results": self.report(start, end)})
+
+
+class DailyReportView(ReportView):
+    def report(self, start, end):
+        days = rollups.daily_report(start, end)
+        for day in days:
+            day['amount'], day['revenue'] = str(day['amount']), str(day['revenue'])
+        return days
+
+
+class CourierReportView(ReportView):
+    def report(self, start, end):
+        return rollups.courier_report(start, end)
+
+
+# Webhook subscriptions of the requesting merchant (status changes of their orders)
+class WebhookEndpointListCreateView(generics.ListCreateAPIView):
+    serializer_class = WebhookEndpointSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return WebhookEndpoint.objects.filter(customer=self.request.user).order_by('id')
+
+    def perform_create(self, serializer):
+        serializer.save(customer=self.request.user)
+
+
+class WebhookEndpointDetailView(generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = WebhookEndpointSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return WebhookEndpoint.objects.filter(customer=self.request.user)
@@ -0,0 +1,272 @@
+"""
+Merchant webhooks for order and delivery status changes.
+
+Transitions call ``WebhookDelivery.record()`` in their own transaction, which
+queues one row per subscribed endpoint and makes sure each endpoint has one
+pending ``send_webhooks`` outbox job. The job claims the endpoint's pending
+events in batches of BATCH_SIZE, POSTs each batch as one signed JSON request
+over a pooled keep-alive connection and deletes the events once the endpoint
+answers 2xx.
+A failed batch goes back to pending and the job is retried with the outbox
+backoff; events are marked failed after MAX_ATTEMPTS. Different endpoints are
+served in parallel by the worker's thread pool, with at most
+``endpoint.max_concurrency`` requests in flight per endpoint and process.
+
+Requests carry ``X-Courier-Signature: t=<unix time>,v1=<hex>``, the
+HMAC-SHA256 of ``"<t>.<raw body>"`` keyed with the endpoint's secret.
+
+Endpoint URLs are chosen by merchants, so they must not reach the internal
+network: ``url_error()`` rejects URLs whose host resolves to a loopback,
+private, link-local (cloud metadata), shared or reserved address when an
+endpoint is saved, and the sender checks the address it actually connected to
+again, since DNS can change after validation. ALLOW_PRIVATE_URLS lifts both
+checks for local development.
+"""
+
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import socket
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import WebhookDelivery, WebhookEndpoint
+from .outbox import Deferred
+
+
+DEFAULT_WEBHOOKS = {
+    "BATCH_SIZE": 100,
+    "TIMEOUT": 10,
+    "MAX_ATTEMPTS": 8,
+    "LEASE_SECONDS": 60,
+    "POOL_SIZE": 10,
+    "ALLOW_PRIVATE_URLS": False,
+}
+
+SIGNATURE_HEADER = "X-Courier-Signature"
+USER_AGENT = "courier-webhooks/1.0"
+
+# A reused keep-alive connection the server has already closed fails with one of these
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class WebhookError(Exception):
+    pass
+
+
+def get_webhook_settings():
+    return {**DEFAULT_WEBHOOKS, **getattr(settings, "WEBHOOKS", {})}
+
+
+def is_public_address(address):
+    ip = ipaddress.ip_address(address.split("%", 1)[0])  # Drop an IPv6 zone
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def url_error(url, config=None):
+    """Why ``url`` may not receive webhooks, or None if it may"""
+    config = config or get_webhook_settings()
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return "Only http and https URLs are supported"
+    if config["ALLOW_PRIVATE_URLS"]:
+        return None
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)}
+    except (OSError, ValueError):
+        return "The host of the URL could not be resolved"
+    if not all(is_public_address(address) for address in addresses):
+        return "Webhook URLs must point to a public internet address"
+    return None
+
+
+def create_public_connection(address, *args, **kwargs):
+    """``socket.create_connection`` that refuses to talk to a non-public address"""
+    sock = socket.create_connection(address, *args, **kwargs)
+    peer = sock.getpeername()[0]
+    if not is_public_address(peer):
+        sock.close()
+        raise ConnectionRefusedError(f"{peer} is not a public address")
+    return sock
+
+
+def sign(secret, body, timestamp):
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared by the worker threads, per scheme, host and port"""
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key, timeout, allow_private=False):
+        """A connection for ``key`` and whether it was reused from the pool"""
+        with self.lock:
+            if self.idle.get(key):
+                return self.idle[key].pop(), True
+        scheme, host, port = key
+        factory = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        conn = factory(host, port, timeout=timeout)
+        if not allow_private:
+            conn._create_connection = create_public_connection
+        return conn, False
+
+    def release(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def post(self, url, body, headers, timeout, allow_private=False):
+        """POST ``body`` to ``url``; returns ``(status, response body)``"""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        while True:
+            conn, reused = self.acquire(key, timeout, allow_private)
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(key, conn)
+            return response.status, data
+
+    def clear(self):
+        with self.lock:
+            idle = [conn for conns in self.idle.values() for conn in conns]
+            self.idle.clear()
+        for conn in idle:
+            conn.close()
+
+
+pool = ConnectionPool(get_webhook_settings()["POOL_SIZE"])
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def endpoint_slots(endpoint):
+    """Semaphore bounding the concurrent requests to ``endpoint`` in this process"""
+    key = (endpoint.pk, endpoint.max_concurrency)
+    with _slots_lock:
+        if key not in _slots:
+            _slots[key] = threading.BoundedSemaphore(max(1, endpoint.max_concurrency))
+        return _slots[key]
+
+
+def claim_batch(endpoint, config):
+    """Lease the next BATCH_SIZE pending events of ``endpoint`` to this thread"""
+    now = timezone.now()
+    due = Q(status="pending") | Q(status="sending", locked_until__lt=now)
+    with transaction.atomic():
+        batch = list(
+            WebhookDelivery.objects.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+            .filter(due, endpoint=endpoint)
+            .order_by("id")[:config["BATCH_SIZE"]]
+        )
+        if batch:
+            WebhookDelivery.objects.filter(pk__in=[event.pk for event in batch]).update(
+                status="sending",
+                locked_until=now + timedelta(seconds=config["LEASE_SECONDS"]),
+            )
+    return batch
+
+
+def send_batch(endpoint, batch, config):
+    """POST ``batch`` to the endpoint; returns None on a 2xx answer or the error"""
+    body = json.dumps(
+        {"events": [{"id": event.pk, **event.payload} for event in batch]}, cls=DjangoJSONEncoder
+    ).encode()
+    headers = {
+        "Content-Type": "application/json",
+        "User-Agent": USER_AGENT,
+        SIGNATURE_HEADER: sign(endpoint.secret, body, int(time.time())),
+    }
+    try:
+        status, _ = pool.post(endpoint.url, body, headers, config["TIMEOUT"], config["ALLOW_PRIVATE_URLS"])
+    except (http.client.HTTPException, OSError) as e:
+        return f"{type(e).__name__}: {e}"
+    return None if 200 <= status < 300 else f"HTTP {status}"
+
+
+def finish_batch(batch, error, config):
+    pks = [event.pk for event in batch]
+    if error is None:
+        WebhookDelivery.objects.filter(pk__in=pks).delete()
+        metrics.webhook_events.inc(len(pks), result="delivered")
+        return
+
+    WebhookDelivery.objects.filter(pk__in=pks).update(
+        status="pending", attempts=F("attempts") + 1, locked_until=None, last_error=error[:4000],
+    )
+    gave_up = WebhookDelivery.objects.filter(pk__in=pks, attempts__gte=config["MAX_ATTEMPTS"]).update(
+        status="failed"
+    )
+    metrics.webhook_events.inc(len(pks) - gave_up, result="error")
+    if gave_up:
+        metrics.webhook_events.inc(gave_up, result="gave_up")
+
+
+def send_pending(endpoint_id, config=None):
+    """
+    Send every pending event of an endpoint, one batch per request.
+
+    Returns the number of events delivered; raises WebhookError when a batch
+    fails so the outbox retries the job later, and Deferred when the endpoint
+    already has max_concurrency requests in flight, which does not count as an
+    attempt.
+    """
+    config = config or get_webhook_settings()
+    endpoint = WebhookEndpoint.objects.filter(pk=endpoint_id, is_active=True).first()
+    if endpoint is None:
+        return 0
+
+    slots = endpoint_slots(endpoint)
+    if not slots.acquire(timeout=config["TIMEOUT"]):
+        raise Deferred(
+            f"{endpoint.url} already has {endpoint.max_concurrency} requests in flight", delay=config["TIMEOUT"]
+        )
+    try:
+        sent = 0
+        while True:
+            batch = claim_batch(endpoint, config)
+            if not batch:
+                return sent
+            error = send_batch(endpoint, batch, config)
+            finish_batch(batch, error, config)
+            if error is not None:
+                raise WebhookError(f"{endpoint.url}: {error}")
+            sent += len(batch)
+    finally:
+        slots.release()
@@ -85,12 +85,16 @@ SIMPLE_JWT = {
 
 
 MIDDLEWARE = [
+    "courier.middleware.MetricsMiddleware",
+    "courier.middleware.QueryInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.middleware.common.CommonMiddleware",
+    "courier.middleware.PasswordHashingBusyMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "courier.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -101,8 +105,17 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
-        "APP_DIRS": True,
         "OPTIONS": {
+            # Compiled templates are kept in memory in every environment
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
@@ -141,6 +154,22 @@ else:
         }
     }
 
+# PBKDF2 runs with bounded per-process concurrency (see courier/hashing.py); same hash format as Django's.
+# Django verifies with the last hasher listed per algorithm, so its own PBKDF2 hasher must not be listed too.
+PASSWORD_HASHERS = [
+    "courier.hashing.PooledPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+PASSWORD_POOL = {
+    "ENABLED": os.getenv("PASSWORD_POOL_ENABLED", "True").lower() == "true",
+    "THREADS": int(os.getenv("PASSWORD_POOL_THREADS", "2")),
+    "WAIT": float(os.getenv("PASSWORD_POOL_WAIT", "1.0")),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -197,7 +226,8 @@ LOGOUT_REDIRECT_URL = '/accounts/login/'
 
 # Security settings for production
 if not DEBUG:
-    SECURE_SSL_REDIRECT = True
+    # Off only where nothing terminates TLS in front of the app (local benchmarks)
+    SECURE_SSL_REDIRECT = os.getenv("SECURE_SSL_REDIRECT", "True").lower() == "true"
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
     SECURE_BROWSER_XSS_FILTER = True
@@ -207,6 +237,159 @@ if not DEBUG:
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
 
+# Per-request SQL instrumentation (Server-Timing header and slow request log)
+SQL_INSTRUMENTATION = {
+    "ENABLED": os.getenv("SQL_INSTRUMENTATION", "True").lower() == "true",
+    "SERVER_TIMING": True,
+    "SLOW_REQUEST_MS": int(os.getenv("SLOW_REQUEST_MS", "500")),
+    "SLOW_QUERY_COUNT": int(os.getenv("SLOW_QUERY_COUNT", "50")),
+    "SLOWEST_QUERIES": 5,
+    "LOG_SAMPLE_RATE": float(os.getenv("SQL_LOG_SAMPLE_RATE", "0.0")),
+    # N+1 detection: "off", "log" (staging) or "raise" (tests)
+    "REPEATED_QUERIES": os.getenv("SQL_REPEATED_QUERIES", "off"),
+    "REPEATED_QUERY_THRESHOLD": int(os.getenv("SQL_REPEATED_QUERY_THRESHOLD", "5")),
+}
+
+# Prometheus metrics, shared between worker processes through per-process files
+METRICS = {
+    "ENABLED": os.getenv("METRICS_ENABLED", "True").lower() == "true",
+    "DIRECTORY": os.getenv("METRICS_DIR", "/tmp/courier-metrics"),
+    "FLUSH_INTERVAL": float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0")),
+    "TOKEN": os.getenv("METRICS_TOKEN", ""),
+    # Without a token /metrics is refused, except in development
+    "REQUIRE_TOKEN": os.getenv("METRICS_REQUIRE_TOKEN", "False" if DEBUG else "True").lower() == "true",
+    # Gauges of other containers' files (shared METRICS_DIR) count while written this recently
+    "STALE_AFTER": float(os.getenv("METRICS_STALE_AFTER", "60")),
+}
+
+# On-demand request profiling (admins: ?__profile=1, API clients: signed X-Courier-Profile header)
+PROFILING = {
+    "ENABLED": os.getenv("PROFILING_ENABLED", "False").lower() == "true",
+    "DIRECTORY": os.getenv("PROFILING_DIR", str(BASE_DIR / "profiles")),
+    "MODE": os.getenv("PROFILING_MODE", "sampling"),  # "sampling" or "cprofile"
+    "SAMPLE_INTERVAL": float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.001")),
+    "SAMPLE_RATE": float(os.getenv("PROFILING_SAMPLE_RATE", "0.0")),
+    "TOKEN_MAX_AGE": 3600,
+    "KEEP": int(os.getenv("PROFILING_KEEP", "200")),
+}
+
+# Custom admin list pagination (see courier/pagination.py)
+ADMIN_PAGINATION = {
+    "MODE": os.getenv("ADMIN_PAGINATION_MODE", "seek"),  # "seek" or "offset"
+    "PER_PAGE": int(os.getenv("ADMIN_PAGINATION_PER_PAGE", "20")),
+    "COUNT_CACHE_TIMEOUT": int(os.getenv("ADMIN_COUNT_CACHE_TIMEOUT", "60")),
+    "ESTIMATE_THRESHOLD": int(os.getenv("ADMIN_COUNT_ESTIMATE_THRESHOLD", "100000")),
+}
+
+# Shared cache for list counts, role versions, order lists and template fragments.
+# Without REDIS_URL each worker has its own in-memory cache, bounded by entries and
+# bytes with least recently used eviction (Redis needs the redis package and its
+# own maxmemory / allkeys-lru configuration).
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "courier.cache_backends.BoundedLocMemCache",
+            "OPTIONS": {
+                "MAX_ENTRIES": int(os.getenv("LOCMEM_CACHE_MAX_ENTRIES", "5000")),
+                "MAX_BYTES": int(os.getenv("LOCMEM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            },
+        }
+    }
+
+# Per-customer cache of the order list with ETags (see courier/order_cache.py)
+ORDER_LIST_CACHE = {
+    "ENABLED": os.getenv("ORDER_LIST_CACHE_ENABLED", "True" if os.getenv("REDIS_URL") else "False").lower() == "true",
+    "TIMEOUT": int(os.getenv("ORDER_LIST_CACHE_TIMEOUT", "300")),
+}
+
+# Admin role kept in the session (see courier/roles.py)
+ROLE_CACHE = {
+    "ENABLED": os.getenv("ROLE_CACHE_ENABLED", "True").lower() == "true",
+    "TIMEOUT": int(os.getenv("ROLE_CACHE_TIMEOUT", "300")),
+}
+
+# Idempotency-Key support for order creation and payment actions (see courier/idempotency.py)
+IDEMPOTENCY = {
+    "TTL": int(os.getenv("IDEMPOTENCY_TTL", "86400")),
+}
+
+# Transactional outbox processed by `manage.py run_worker` (see courier/outbox.py)
+OUTBOX = {
+    "BATCH_SIZE": int(os.getenv("OUTBOX_BATCH_SIZE", "50")),
+    "THREADS": int(os.getenv("OUTBOX_THREADS", "4")),
+    "POLL_INTERVAL": float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0")),
+    "LEASE_SECONDS": int(os.getenv("OUTBOX_LEASE_SECONDS", "300")),
+    "MAX_ATTEMPTS": int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+    "BACKOFF_BASE": 2.0,
+    "BACKOFF_MAX": 3600,
+}
+
+# Merchant webhooks sent by the outbox worker (see courier/webhooks.py)
+WEBHOOKS = {
+    "BATCH_SIZE": int(os.getenv("WEBHOOK_BATCH_SIZE", "100")),
+    "TIMEOUT": float(os.getenv("WEBHOOK_TIMEOUT", "10")),
+    "MAX_ATTEMPTS": int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8")),
+    "LEASE_SECONDS": int(os.getenv("WEBHOOK_LEASE_SECONDS", "60")),
+    "POOL_SIZE": int(os.getenv("WEBHOOK_POOL_SIZE", "10")),
+    "ALLOW_PRIVATE_URLS": os.getenv("WEBHOOK_ALLOW_PRIVATE_URLS", "False").lower() == "true",
+}
+
+# Bloom filter that rejects unknown tracking barcodes without a query (see courier/barcode_filter.py).
+# It relies on the shared cache to see orders created by other processes, so it defaults to on with Redis.
+BARCODE_FILTER = {
+    "ENABLED": os.getenv("BARCODE_FILTER_ENABLED", "True" if os.getenv("REDIS_URL") else "False").lower() == "true",
+    "FALSE_POSITIVE_RATE": float(os.getenv("BARCODE_FILTER_FALSE_POSITIVE_RATE", "0.01")),
+    "REBUILD_INTERVAL": int(os.getenv("BARCODE_FILTER_REBUILD_INTERVAL", "300")),
+    "CHECK_INTERVAL": 10,
+    "MIN_CAPACITY": 100000,
+}
+
+# Batch tracking by barcode (see courier/tracking.py)
+TRACKING = {
+    "MAX_BATCH": int(os.getenv("TRACKING_MAX_BATCH", "500")),
+}
+
+# Courier app delta sync (see courier/sync.py)
+COURIER_SYNC = {
+    "PAGE_SIZE": int(os.getenv("COURIER_SYNC_PAGE_SIZE", "200")),
+    "SETTLE_SECONDS": int(os.getenv("COURIER_SYNC_SETTLE_SECONDS", "5")),
+    "TOMBSTONE_DAYS": int(os.getenv("COURIER_SYNC_TOMBSTONE_DAYS", "30")),
+}
+
+# Pull queue of pending orders for self-assigning couriers (see courier/pull_queue.py)
+COURIER_QUEUE = {
+    "LEASE_SECONDS": int(os.getenv("COURIER_QUEUE_LEASE_SECONDS", "120")),
+    "MAX_CLAIMS": int(os.getenv("COURIER_QUEUE_MAX_CLAIMS", "10")),
+}
+
+# Periodic maintenance jobs run by `manage.py run_scheduler` (see courier/scheduler.py)
+SCHEDULER = {
+    "POLL_INTERVAL": float(os.getenv("SCHEDULER_POLL_INTERVAL", "5")),
+    "JITTER": float(os.getenv("SCHEDULER_JITTER", "0.1")),
+    "OFF_PEAK_START": int(os.getenv("SCHEDULER_OFF_PEAK_START", "1")),
+    "OFF_PEAK_END": int(os.getenv("SCHEDULER_OFF_PEAK_END", "5")),
+    "DISABLED_JOBS": [name for name in os.getenv("SCHEDULER_DISABLED_JOBS", "").split(",") if name],
+    "INTERVALS": {},
+    "STUCK_DELIVERY_MINUTES": int(os.getenv("STUCK_DELIVERY_MINUTES", "120")),
+    "ARCHIVE_MAX_BATCHES": int(os.getenv("SCHEDULER_ARCHIVE_MAX_BATCHES", "20")),
+    "RECONCILE_BATCH_SIZE": 500,
+    "ROLLUP_DAYS": 2,
+}
+
+# Archival of finished orders by `manage.py archive_orders` (see courier/archive.py)
+ARCHIVE = {
+    "AFTER_DAYS": int(os.getenv("ARCHIVE_AFTER_DAYS", "90")),
+    "BATCH_SIZE": int(os.getenv("ARCHIVE_BATCH_SIZE", "1000")),
+    "LIST_LIMIT": int(os.getenv("ARCHIVE_LIST_LIMIT", "100")),
+}
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -220,4 +403,21 @@ LOGGING = {
         'handlers': ['console'],
         'level': 'INFO',
     },
+    'loggers': {
+        'courier.sql': {
+            'handlers': ['console'],
+            'level': os.getenv('SQL_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'courier.outbox': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'courier.scheduler': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
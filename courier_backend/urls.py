@@ -5,8 +5,10 @@ from django.contrib.auth import views as auth_views
 from courier.admin_views import (
     admin_dashboard, admin_users, admin_users_create, admin_users_edit, admin_users_delete,
     admin_delivery_boys, admin_delivery_boys_create, admin_delivery_boys_edit, admin_delivery_boys_delete,
-    admin_orders, admin_deliveries, admin_assign_delivery, admin_update_delivery_status, admin_logout
+    admin_orders, admin_deliveries, admin_assign_delivery, admin_update_delivery_status, admin_logout,
+    admin_profiles, admin_profile_download, admin_orders_bulk, admin_deliveries_bulk
 )
+from courier.metrics import metrics_view
 
 
 def api_v1_root(request):
@@ -18,9 +20,25 @@ def api_v1_root(request):
             "token": "/api/v1/token/",
             "token_refresh": "/api/v1/token/refresh/",
             "orders": "/api/v1/orders/",
+            "archived_orders": "/api/v1/orders/archived/",
             "order_status_update": "/api/v1/orders/<id>/status/",
+            "order_status_batch": "/api/v1/orders/status/batch/",
             "order_payment_update": "/api/v1/orders/<id>/payment/",
             "track": "/api/v1/track/<barcode>/",
+            "track_batch": "/api/v1/track/",
+            "available_delivery_boys": "/api/v1/delivery-boys/available/",
+            "delivery_assign": "/api/v1/deliveries/assign/",
+            "delivery_reassign": "/api/v1/deliveries/<id>/reassign/",
+            "courier_deliveries": "/api/v1/courier/deliveries/",
+            "courier_delivery_action": "/api/v1/courier/deliveries/<id>/<accept|pick-up|deliver|fail>/",
+            "courier_sync": "/api/v1/courier/sync/",
+            "courier_queue_claim": "/api/v1/courier/queue/claim/",
+            "courier_queue_take": "/api/v1/courier/queue/take/",
+            "courier_queue_release": "/api/v1/courier/queue/release/",
+            "webhooks": "/api/v1/webhooks/",
+            "report_daily": "/api/v1/reports/daily/",
+            "report_couriers": "/api/v1/reports/couriers/",
+            "metrics": "/metrics",
             "admin": "/admin/"
         }
     })
@@ -29,6 +47,7 @@ def api_v1_root(request):
 urlpatterns = [
     path('api/v1/', api_v1_root, name='api_v1_root'),
     path('api/v1/', include('courier.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
     # Authentication URLs
     path('accounts/login/', auth_views.LoginView.as_view(template_name='admin/login.html'), name='login'),
@@ -45,7 +64,11 @@ urlpatterns = [
     path('admin/delivery-boys/<int:delivery_boy_id>/edit/', admin_delivery_boys_edit, name='admin_delivery_boys_edit'),
     path('admin/delivery-boys/<int:delivery_boy_id>/delete/', admin_delivery_boys_delete, name='admin_delivery_boys_delete'),
     path('admin/orders/', admin_orders, name='admin_orders'),
+    path('admin/orders/bulk/', admin_orders_bulk, name='admin_orders_bulk'),
     path('admin/orders/<int:order_id>/assign/', admin_assign_delivery, name='admin_assign_delivery'),
     path('admin/deliveries/', admin_deliveries, name='admin_deliveries'),
+    path('admin/deliveries/bulk/', admin_deliveries_bulk, name='admin_deliveries_bulk'),
     path('admin/deliveries/<int:delivery_id>/update/', admin_update_delivery_status, name='admin_update_delivery_status'),
+    path('admin/profiles/', admin_profiles, name='admin_profiles'),
+    path('admin/profiles/<str:name>/', admin_profile_download, name='admin_profile_download'),
 ]
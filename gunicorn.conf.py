@@ -0,0 +1,122 @@
+"""
+Gunicorn configuration for courier_backend.
+
+Every setting can be overridden through a GUNICORN_* environment variable so
+the same image can be tuned per deployment without rebuilding. Worker counts
+are sized from the CPUs actually available to the container.
+
+For more information on these settings, see
+https://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    value = os.getenv(name, "")
+    return int(value) if value.strip() else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name, "")
+    return value.lower() == "true" if value.strip() else default
+
+
+def available_cpus():
+    """Number of CPUs this process may run on (respects cgroup/affinity limits)"""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return multiprocessing.cpu_count() or 1
+
+
+# Short aliases accepted by GUNICORN_WORKER_CLASS
+WORKER_CLASSES = {
+    "sync": "sync",
+    "gthread": "gthread",
+    "asgi": "uvicorn.workers.UvicornWorker",
+}
+
+# Worker mode: "gthread" (default), "sync", "asgi" or any dotted worker class path
+worker_mode = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+worker_class = WORKER_CLASSES.get(worker_mode, worker_mode)
+
+# The ASGI worker needs the ASGI entry point instead of the WSGI one
+if worker_class == WORKER_CLASSES["asgi"]:
+    wsgi_app = "courier_backend.asgi:application"
+else:
+    wsgi_app = "courier_backend.wsgi:application"
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+
+cpus = available_cpus()
+
+# Sync workers block on I/O, so they follow the classic (2 x cores) + 1 rule.
+# Threaded and async workers overlap I/O themselves and need one per core.
+if worker_class == "sync":
+    default_workers = cpus * 2 + 1
+else:
+    default_workers = cpus + 1
+workers = _env_int("GUNICORN_WORKERS", default_workers)
+
+# Only used by gthread workers; sized so workers x threads covers the DB pool
+threads = _env_int("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1)
+
+# Import Django once in the master so workers fork with shared pages
+preload_app = _env_bool("GUNICORN_PRELOAD", True)
+
+# Recycle workers periodically to bound memory growth; the jitter keeps them
+# from restarting in lock-step
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 2000)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", max_requests // 10)
+
+# Keep-alive must stay above the load balancer idle timeout to avoid 502s
+keepalive = _env_int("GUNICORN_KEEPALIVE", 75)
+timeout = _env_int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+worker_connections = _env_int("GUNICORN_WORKER_CONNECTIONS", 1000)
+backlog = _env_int("GUNICORN_BACKLOG", 2048)
+
+# Heartbeat files on tmpfs so a slow disk never trips the worker timeout
+worker_tmp_dir = os.getenv("GUNICORN_WORKER_TMP_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-") or None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+
+
+def on_starting(server):
+    # Fold the files of a previous run on this host into the archive; the directory may be shared
+    # with the worker and scheduler containers, so the files of other hosts are left alone
+    metrics_dir = os.getenv("METRICS_DIR", "/tmp/courier-metrics")
+    if metrics_dir:
+        from courier.metrics import registry
+
+        try:
+            registry.merge_exited_here(metrics_dir)
+        except OSError:
+            server.log.exception("Could not merge the metrics of the previous run")
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters in the archive file and drop its own file
+    metrics_dir = os.getenv("METRICS_DIR", "/tmp/courier-metrics")
+    if metrics_dir:
+        from courier.metrics import registry
+
+        try:
+            registry.merge_exited(metrics_dir, worker.pid)
+        except OSError:
+            server.log.exception("Could not merge the metrics of worker %s", worker.pid)
+
+
+def post_fork(server, worker):
+    # Connections opened in the master while preloading must not be shared
+    if not server.cfg.preload_app:
+        return
+
+    from django.db import connections
+
+    for conn in connections.all(initialized_only=True):
+        conn.close()
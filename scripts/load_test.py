@@ -0,0 +1,234 @@
+"""
+Compare throughput and p99 latency of the gunicorn worker modes.
+
+For each requested mode a gunicorn server is started with gunicorn.conf.py
+(mode selected through GUNICORN_WORKER_CLASS, DEBUG off), a mixed workload is
+replayed against the real API endpoints and a summary table is printed with
+the latency of every endpoint. Token logins and registrations are mixed in at
+--login-ratio and --register-ratio of the requests, so the table shows what a
+login storm does to tracking and order-list latency.
+
+Usage:
+    python scripts/load_test.py --modes sync gthread asgi --concurrency 32 --duration 20
+    python scripts/load_test.py --modes gthread --login-ratio 0.5   # login storm
+    python scripts/load_test.py --url http://localhost:8000   # against a running server
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def request(url, method="GET", data=None, token=None):
+    """(status, body); status 0 when no response came back (refused, reset or timed out)"""
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read()
+    except (OSError, http.client.HTTPException):  # URLError, connection resets, timeouts, truncated responses
+        return 0, b""
+
+
+def prepare_fixtures(base_url):
+    """Register a load-test user, log in and create an order to track"""
+    username = f"load-{uuid.uuid4().hex[:8]}"
+    password = uuid.uuid4().hex
+    request(f"{base_url}/api/v1/register/", "POST", {
+        "username": username, "email": f"{username}@example.com", "password": password,
+    })
+    _, body = request(f"{base_url}/api/v1/token/", "POST", {"username": username, "password": password})
+    token = json.loads(body)["access"]
+    _, body = request(f"{base_url}/api/v1/orders/", "POST", {
+        "receiver_name": "Load Test", "receiver_address": "1 Benchmark Road", "amount": "10.00",
+    }, token=token)
+    barcode = json.loads(body)["barcode"]
+    return {"username": username, "password": password, "token": token, "barcode": barcode}
+
+
+def new_user():
+    username = f"load-{uuid.uuid4().hex[:12]}"
+    return {"username": username, "email": f"{username}@example.com", "password": uuid.uuid4().hex}
+
+
+def build_workload(base_url, fixtures):
+    """
+    (reads, writes): reads are (name, method, url, data, token) tuples replayed
+    round-robin by every client; writes map a name to a request factory and are
+    picked at their configured ratio instead of the next read
+    """
+    reads = [
+        ("api_root", "GET", f"{base_url}/api/v1/", None, None),
+        ("track", "GET", f"{base_url}/api/v1/track/{fixtures['barcode']}/", None, None),
+        ("orders", "GET", f"{base_url}/api/v1/orders/", None, fixtures["token"]),
+        ("track", "GET", f"{base_url}/api/v1/track/{fixtures['barcode']}/", None, None),
+    ]
+    credentials = {"username": fixtures["username"], "password": fixtures["password"]}
+    writes = {
+        "login": lambda: ("POST", f"{base_url}/api/v1/token/", credentials, None),
+        "register": lambda: ("POST", f"{base_url}/api/v1/register/", new_user(), None),
+    }
+    return reads, writes
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def run_load(workload, concurrency, duration, ratios):
+    """Overall stats, plus the same stats by endpoint name under ``endpoints``"""
+    reads, writes = workload
+    latencies, errors = {}, {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def pick(rng, i):
+        roll = rng.random()
+        for name, ratio in ratios.items():
+            if roll < ratio:
+                method, url, data, token = writes[name]()
+                return name, method, url, data, token
+            roll -= ratio
+        return reads[i % len(reads)]
+
+    def client(offset):
+        rng = random.Random(offset)
+        local, failed = {}, {}
+        i = offset
+        while time.monotonic() < deadline:
+            name, method, url, data, token = pick(rng, i)
+            i += 1
+            start = time.perf_counter()
+            status, _ = request(url, method, data, token=token)
+            local.setdefault(name, []).append(time.perf_counter() - start)
+            if not status or status >= 400:
+                failed[name] = failed.get(name, 0) + 1
+        with lock:
+            for name, values in local.items():
+                latencies.setdefault(name, []).extend(values)
+            for name, count in failed.items():
+                errors[name] = errors.get(name, 0) + count
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = summarize([v for values in latencies.values() for v in values], sum(errors.values()), elapsed)
+    stats["endpoints"] = {
+        name: summarize(values, errors.get(name, 0), elapsed) for name, values in sorted(latencies.items())
+    }
+    return stats
+
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, _ = request(f"{base_url}/api/v1/")
+        if status:
+            return True
+        time.sleep(0.25)
+    return False
+
+
+def start_server(mode, port, extra_env):
+    env = dict(os.environ, **extra_env)
+    env["GUNICORN_WORKER_CLASS"] = mode
+    env["GUNICORN_BIND"] = f"127.0.0.1:{port}"
+    env["GUNICORN_ACCESSLOG"] = ""
+    env.setdefault("DJANGO_SETTINGS_MODULE", "courier_backend.settings")
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", str(BASE_DIR / "gunicorn.conf.py")],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["sync", "gthread"], help="Worker modes to compare")
+    parser.add_argument("--url", help="Benchmark an already running server instead of spawning gunicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per mode")
+    parser.add_argument("--workers", type=int, help="Override GUNICORN_WORKERS for every mode")
+    parser.add_argument("--login-ratio", type=float, default=0.1, help="Fraction of requests that are token logins")
+    parser.add_argument("--register-ratio", type=float, default=0.02, help="Fraction of requests that register a user")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+    if args.login_ratio + args.register_ratio > 1:
+        parser.error("--login-ratio and --register-ratio must add up to at most 1")
+    ratios = {"login": args.login_ratio, "register": args.register_ratio}
+
+    # Measure the production configuration; plain HTTP since no proxy terminates TLS here
+    extra_env = {"DEBUG": "False", "SECURE_SSL_REDIRECT": "False"}
+    if args.workers:
+        extra_env["GUNICORN_WORKERS"] = str(args.workers)
+
+    def benchmark(base_url):
+        return run_load(build_workload(base_url, prepare_fixtures(base_url)), args.concurrency, args.duration, ratios)
+
+    results = {}
+    if args.url:
+        results["external"] = benchmark(args.url.rstrip("/"))
+    else:
+        base_url = f"http://127.0.0.1:{args.port}"
+        for mode in args.modes:
+            process = start_server(mode, args.port, extra_env)
+            try:
+                if not wait_for_server(base_url):
+                    print(f"{mode}: server did not start", file=sys.stderr)
+                    continue
+                results[mode] = benchmark(base_url)
+            finally:
+                process.terminate()
+                process.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'mode':<10} {'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, stats in results.items():
+        for name, row in [("all", stats), *stats["endpoints"].items()]:
+            print(
+                f"{mode:<10} {name:<10} {row['requests']:>9} {row['errors']:>7} {row['rps']:>9.1f} "
+                f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()